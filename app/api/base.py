@@ -1,8 +1,10 @@
 from fastapi import APIRouter
 
-from app.api.routes import auth, dashboard
+from app.api.routes import auth, dashboard, metrics, status
 
 api_router = APIRouter()
 
 api_router.include_router(dashboard.router, tags=["dashboard"], prefix="/dashboard")
 api_router.include_router(auth.router, tags=["auth"], prefix="/auth")
+api_router.include_router(status.router, tags=["status"], prefix="/status")
+api_router.include_router(metrics.router, tags=["metrics"])
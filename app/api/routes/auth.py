@@ -1,15 +1,13 @@
 from datetime import timedelta
 from typing import Optional, Annotated
 
-from aioredis import Redis
 from fastapi import APIRouter, status, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 
 from app.core.auth_utils import create_access_token
-from app.core.cypt_utils import generate_key_pair
+from app.core.cypt_utils import key_pair_pool
 from app.crud.user import UserCRUD
 from app.dependencies.auth import get_current_user
-from app.dependencies.redis import get_redis
 from app.models.token import Token
 from app.models.user import UserCreate, User, UserRead, UserRegistrationRead, UserCreateInternal
 from config import ACCESS_TOKEN_EXPIRE_MINUTES
@@ -48,13 +46,13 @@ async def register_user(
             detail="User with this email already exist"
         )
 
-    # Generate public/private key pair
-    public_key, private_key = generate_key_pair()
+    # Take a pre-generated public/private key pair
+    public_key, private_key = await key_pair_pool.get()
 
     # Save user to database
     user_internal_data: UserCreateInternal = UserCreateInternal(**user_data.dict(), public_key=public_key)
     user = await user_crud.create(user_data=user_internal_data)
-    user_registration_read = UserRegistrationRead(**user.dict(exclude_unset=True), private_key=private_key)
+    user_registration_read = UserRegistrationRead(**user.dict(), private_key=private_key)
     return user_registration_read
 
 
@@ -66,8 +64,7 @@ async def register_user(
 )
 async def login_user(
         form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-        user_crud: UserCRUD = Depends(UserCRUD),
-        redis: Redis = Depends(get_redis)
+        user_crud: UserCRUD = Depends(UserCRUD)
 ):
     user: Optional[User] = await user_crud.authenticate(form_data.username, form_data.password)
     if not user:
@@ -80,8 +77,6 @@ async def login_user(
     access_token_expire_time = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(user=user.username, expires_delta=access_token_expire_time)
 
-    await redis.execute_command('set', str(user.id), user.public_key, 'ex', ACCESS_TOKEN_EXPIRE_MINUTES * 60)
-
     token = Token(access_token=access_token, token_type="bearer", expiration_time=access_token_expire_time.seconds)
     return token
 
@@ -1,16 +1,33 @@
-from typing import Optional, List
+import asyncio
+import json
+from typing import AsyncIterator, Optional, List, Tuple, Union
 
-from aioredis import Redis
-from config import ACCESS_TOKEN_EXPIRE_MINUTES
-from fastapi import APIRouter, HTTPException, status, Depends, Query, Response
+import config
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from app.core.cypt_utils import encrypt_with_key
+from app.core.blob_store import BlobTooLarge, chunk_store
+from app.core.cypt_utils import CredentialEncryptor
+from app.core.notifications import change_notifier
+from app.core.pagination import (NEXT_CURSOR_HEADER, decode_cursor, decode_sync_token, encode_cursor,
+                                 encode_sync_token)
+from app.core.serialization import credential_rows_to_compact_json, credential_rows_to_json
+from app.core.site_matcher import normalize_host
+from app.core.vault_import import VaultImport, iter_csv_records, iter_lines, iter_ndjson_records
+from app.crud.blob import BlobCRUD
 from app.crud.credential import CredentialCRUD
+from app.crud.data_key import DataKeyCRUD
 from app.crud.site import SiteCRUD
 from app.dependencies.auth import get_current_user
-from app.dependencies.redis import get_redis
+from app.dependencies.db import get_session_maker
+from app.dependencies.encryption import get_credential_encryptor, get_data_key
+from app.models.blob import Blob, BlobRead
+from app.models.data_key import DataKey, DataKeyRead
 from app.models.site import SiteCreate, SiteRead, Site, SiteSimpleRead
-from app.models.credential import Credential, CredentialCreate, CredentialRead
+from app.models.credential import (Credential, CredentialBatchConflict, CredentialBatchCreate, CredentialBatchRead,
+                                   CredentialChanges, CredentialCompactPage, CredentialCompactRead, CredentialCreate,
+                                   CredentialExport, CredentialImportRead, CredentialRead)
 
 router = APIRouter()
 
@@ -20,6 +37,36 @@ async def ping() -> dict[str, str]:
     return {"ping": "pong!"}
 
 
+def parse_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid cursor",
+        )
+
+
+def parse_sync_token(token: Optional[str]) -> Optional[Tuple[int, int]]:
+    if token is None:
+        return None
+    try:
+        return decode_sync_token(token)
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid sync token",
+        )
+
+
+def set_next_cursor(response: Response, items: list, limit: int) -> None:
+    # A full page means there may be more rows, the cursor lets the client seek past the last one
+    if limit and len(items) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(items[-1].id)
+
+
 # ----------------- Sites -----------------
 
 
@@ -32,8 +79,7 @@ async def ping() -> dict[str, str]:
 async def create_site(
         site_data: SiteCreate, site_crud: SiteCRUD = Depends(SiteCRUD)
 ) -> Site:
-    site = await site_crud.read_by_name(site_data.name)
-    if site:
+    if await site_crud.exists_by_name(site_data.name):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Site with this name already exist"
@@ -49,8 +95,10 @@ async def create_site(
     status_code=status.HTTP_200_OK,
 )
 async def read_sites(
+        response: Response,
         offset: int = 0,
         limit: int = Query(default=50, lte=50),
+        cursor: Optional[str] = None,
         site_crud: SiteCRUD = Depends(SiteCRUD),
 ) -> List[Site]:
     if limit < 0 or offset < 0:
@@ -58,7 +106,8 @@ async def read_sites(
             status_code=400,
             detail="Offset and limit must be positive numbers",
         )
-    sites = await site_crud.read_many(offset=offset, limit=limit)
+    sites = await site_crud.read_many(offset=offset, limit=limit, after_id=parse_cursor(cursor))
+    set_next_cursor(response, sites, limit)
     return sites
 
 
@@ -68,20 +117,45 @@ async def read_sites(
     response_model=List[SiteSimpleRead],
     status_code=status.HTTP_200_OK,
 )
-async def read_sites(
+async def read_sites_reduced(
+        response: Response,
         offset: int = 0,
         limit: int = Query(default=50, lte=50),
+        cursor: Optional[str] = None,
         site_crud: SiteCRUD = Depends(SiteCRUD),
-) -> List[Site]:
+) -> List[SiteSimpleRead]:
     if limit < 0 or offset < 0:
         raise HTTPException(
             status_code=400,
             detail="Offset and limit must be positive numbers",
         )
-    sites = await site_crud.read_many(offset=offset, limit=limit)
+    sites = await site_crud.read_many_reduced(offset=offset, limit=limit, after_id=parse_cursor(cursor))
+    set_next_cursor(response, sites, limit)
     return sites
 
 
+@router.get(
+    "/sites/match",
+    summary="Get the site of a page url",
+    description="The site registered at the longest domain the page host ends with, otherwise a site within the "
+                "same registrable domain",
+    response_model=SiteRead,
+    status_code=status.HTTP_200_OK,
+)
+async def match_site(
+        url: str = Query(min_length=1, max_length=2048), site_crud: SiteCRUD = Depends(SiteCRUD)
+) -> SiteRead:
+    if normalize_host(url) is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid url",
+        )
+    site = await site_crud.match(url)
+    if site is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return site
+
+
 @router.get(
     "/sites/{site_id}",
     summary="Get a site by id",
@@ -107,25 +181,201 @@ async def create_credential(
         credential_data: CredentialCreate,
         credential_crud: CredentialCRUD = Depends(CredentialCRUD),
         user=Depends(get_current_user),
-        redis: Redis = Depends(get_redis)
+        encryptor: CredentialEncryptor = Depends(get_credential_encryptor)
 ) -> Credential:
     # Overwrite the user_id with the current authenticated user id
     credential_data.user_id = user.id
 
     # Encrypt incoming password with user's key
-    encryption_key = await redis.get(str(user.id))
-    if not encryption_key:
-        encryption_key = user.public_key
-        await redis.execute_command('set', str(user.id), encryption_key, 'ex', ACCESS_TOKEN_EXPIRE_MINUTES * 60)
-    else:
-        encryption_key = encryption_key.decode("utf-8")
-
-    credential_data.encrypted_password = encrypt_with_key(encryption_key, credential_data.encrypted_password)
-    credential = await credential_crud.create(credential_data=credential_data)
+    credential_data.encrypted_password = encryptor.encrypt(credential_data.encrypted_password)
+    credential = await credential_crud.create(credential_data=credential_data, owner=user, **encryptor.fields)
 
     return credential
 
 
+@router.post(
+    "/credentials/batch",
+    summary="Create many credentials at once, reporting conflicting items instead of failing",
+    response_model=CredentialBatchRead,
+    status_code=status.HTTP_201_CREATED
+)
+async def create_credentials_batch(
+        batch_data: CredentialBatchCreate,
+        credential_crud: CredentialCRUD = Depends(CredentialCRUD),
+        user=Depends(get_current_user),
+        encryptor: CredentialEncryptor = Depends(get_credential_encryptor)
+) -> CredentialBatchRead:
+    # Every password in the batch is encrypted with the same parsed key
+    batch = CredentialBatchRead()
+    items, indexes = [], []
+    for index, item in enumerate(batch_data.credentials):
+        try:
+            item.encrypted_password = encryptor.encrypt(item.encrypted_password)
+        except ValueError:
+            # Passwords RSA-OAEP cannot encrypt are reported as the import does, the rest of the batch is written
+            batch.conflicts.append(CredentialBatchConflict(index=index, nickname=item.nickname,
+                                                           detail="Password is too long to be encrypted"))
+            continue
+        items.append(item)
+        indexes.append(index)
+
+    if items:
+        written = await credential_crud.create_many(user_id=user.id, items=items, **encryptor.fields)
+        # Indexes of the written batch refer to the encrypted items, map them back to the request
+        for created in written.created:
+            created.index = indexes[created.index]
+            batch.created.append(created)
+        for conflict in written.conflicts:
+            conflict.index = indexes[conflict.index]
+            batch.conflicts.append(conflict)
+        batch.conflicts.sort(key=lambda conflict: conflict.index)
+    return batch
+
+
+@router.post(
+    "/credentials/import",
+    summary="Import credentials from a CSV or newline delimited JSON upload streamed as the request body",
+    response_model=CredentialImportRead,
+    status_code=status.HTTP_200_OK
+)
+async def import_credentials(
+        request: Request,
+        file_format: str = Query(default="csv", alias="format", pattern="^(csv|ndjson)$"),
+        credential_crud: CredentialCRUD = Depends(CredentialCRUD),
+        user=Depends(get_current_user),
+        encryptor: CredentialEncryptor = Depends(get_credential_encryptor)
+) -> CredentialImportRead:
+    # The body is parsed as it arrives, so memory depends on the chunk size and not on the file size
+    lines = iter_lines(request.stream())
+    records = iter_csv_records(lines) if file_format == "csv" else iter_ndjson_records(lines)
+
+    vault_import = VaultImport(credential_crud, user_id=user.id, encryptor=encryptor,
+                               chunk_size=getattr(config, "IMPORT_CHUNK_SIZE", 500))
+    return await vault_import.run(records)
+
+
+@router.get(
+    "/credentials/export",
+    summary="Stream every credential of the current user as newline delimited JSON",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def export_credentials(
+        session_maker: async_sessionmaker[AsyncSession] = Depends(get_session_maker),
+        user=Depends(get_current_user)
+) -> StreamingResponse:
+    user_id = user.id
+
+    async def export_lines():
+        # Request sessions are closed before the body is sent, so the stream owns its session
+        async with session_maker() as session:
+            lines = []
+            async for credential in CredentialCRUD(session).stream_personal(user_id=user_id):
+                lines.append(CredentialExport.model_validate(credential).model_dump_json())
+                if len(lines) == 100:
+                    yield "\n".join(lines) + "\n"
+                    lines.clear()
+            if lines:
+                yield "\n".join(lines) + "\n"
+
+    return StreamingResponse(
+        export_lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="vault.ndjson"'},
+    )
+
+
+@router.get(
+    "/credentials/changes",
+    summary="Get the credentials inserted, updated or deleted since a sync token",
+    description="Without since every credential is returned. Keep requesting with the returned token while more is "
+                "true, then store the token for the next sync",
+    response_model=CredentialChanges,
+    status_code=status.HTTP_200_OK,
+)
+async def read_credential_changes(
+        since: Optional[str] = None,
+        limit: int = Query(default=100, lte=500),
+        credential_crud: CredentialCRUD = Depends(CredentialCRUD),
+        user=Depends(get_current_user)
+) -> CredentialChanges:
+    if limit < 1:
+        raise HTTPException(
+            status_code=400,
+            detail="Limit must be a positive number",
+        )
+    after = parse_sync_token(since)
+    credentials, tombstones, more = await credential_crud.read_changes(user_id=user.id, after=after, limit=limit)
+
+    # The token points at the newest change returned, versions are never shared between a credential and a tombstone
+    token = since or encode_sync_token(0, 0)
+    newest = max([(c.version, c.id) for c in credentials] + [(t.version, 0) for t in tombstones], default=None)
+    if newest is not None:
+        token = encode_sync_token(*newest)
+
+    return CredentialChanges(
+        credentials=[CredentialCompactRead.model_validate(credential) for credential in credentials],
+        deleted=[tombstone.credential_id for tombstone in tombstones],
+        token=token,
+        more=more,
+    )
+
+
+@router.get(
+    "/credentials/events",
+    summary="Stream an event every time the credentials of the current user change",
+    description="Server-Sent Events, change events carry the new change version. Clients sync through "
+                "/dashboard/credentials/changes once connected and whenever an event arrives",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def stream_credential_events(user=Depends(get_current_user)) -> StreamingResponse:
+    keep_alive = getattr(config, "CHANGE_EVENTS_KEEP_ALIVE", 15)
+
+    # The database session of get_current_user is closed before streaming, idle streams only hold a queue
+    async def events() -> AsyncIterator[str]:
+        with change_notifier.subscribe(user.id) as queue:
+            # Milliseconds browsers wait before reconnecting a dropped stream
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keep_alive)
+                except asyncio.TimeoutError:
+                    # Comment lines keep proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: change\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get(
+    "/credentials/search",
+    summary="Search the credentials of the current user",
+    description="Case insensitive substring match over nickname, username, email and site name. Credentials with a "
+                "field starting with q come first. compact works as in /dashboard/credentials",
+    response_model=Union[List[CredentialRead], CredentialCompactPage],
+    status_code=status.HTTP_200_OK,
+)
+async def search_credentials(
+        q: str = Query(min_length=1, max_length=100),
+        limit: int = Query(default=20, lte=50),
+        compact: bool = False,
+        credential_crud: CredentialCRUD = Depends(CredentialCRUD),
+        user=Depends(get_current_user)
+) -> Response:
+    if limit < 1:
+        raise HTTPException(
+            status_code=400,
+            detail="Limit must be a positive number",
+        )
+    credential_ids = await credential_crud.search(user_id=user.id, query=q, limit=limit)
+    rows = await credential_crud.read_personal_rows_by_ids(user_id=user.id, unique_ids=credential_ids)
+    content = credential_rows_to_compact_json(rows) if compact else credential_rows_to_json(rows, owner=user)
+    return Response(content=content, media_type="application/json")
+
+
 @router.get(
     "/credentials/{credential_id}",
     summary="Get a credential by id",
@@ -147,24 +397,32 @@ async def read_credential_by_id(
 @router.get(
     "/credentials",
     summary="Get a list of credentials for the current user",
-    response_model=List[CredentialRead],
+    description="With compact=true items reference their site by id, the page sideloads each site once and owners "
+                "are left out",
+    response_model=Union[List[CredentialRead], CredentialCompactPage],
     status_code=status.HTTP_200_OK,
 )
 async def read_credentials(
         offset: int = 0,
         limit: int = Query(default=10, lte=50),
         site_id: Optional[int] = None,
+        cursor: Optional[str] = None,
+        compact: bool = False,
         credential_crud: CredentialCRUD = Depends(CredentialCRUD),
         user=Depends(get_current_user)
-) -> list[Credential]:
+) -> Response:
     if limit < 0 or offset < 0:
         raise HTTPException(
             status_code=400,
             detail="Offset and limit must be positive numbers",
         )
-    credentials = await credential_crud.read_personal_many(offset=offset, limit=limit, site_id=site_id,
-                                                           user_id=user.id)
-    return credentials
+    # The JSON is built from row data, response_model only documents it and is not validated again
+    rows = await credential_crud.read_personal_rows(offset=offset, limit=limit, site_id=site_id,
+                                                    user_id=user.id, after_id=parse_cursor(cursor))
+    content = credential_rows_to_compact_json(rows) if compact else credential_rows_to_json(rows, owner=user)
+    response = Response(content=content, media_type="application/json")
+    set_next_cursor(response, rows, limit)
+    return response
 
 
 @router.delete(
@@ -177,9 +435,139 @@ async def delete_credential_by_id(
         credential_crud: CredentialCRUD = Depends(CredentialCRUD),
         user=Depends(get_current_user),
 ) -> None:
-    credential = await credential_crud.read_personal(credential_id, user.id)
-    if credential:
-        await credential_crud.delete(unique_id=credential_id)
+    # Ownership is checked by the delete itself
+    if await credential_crud.delete(unique_id=credential_id, user_id=user.id):
         return
 
     response.status_code = status.HTTP_404_NOT_FOUND
+
+
+# ----------------- Blobs -----------------
+
+@router.post(
+    "/blobs",
+    summary="Upload a file streamed as the request body, stored as encrypted content-addressed chunks",
+    response_model=BlobRead,
+    status_code=status.HTTP_201_CREATED
+)
+async def upload_blob(
+        request: Request,
+        name: str = Query(min_length=1),
+        blob_crud: BlobCRUD = Depends(BlobCRUD),
+        user=Depends(get_current_user),
+        data_key: Tuple[int, bytes] = Depends(get_data_key)
+) -> Blob:
+    data_key_id, key = data_key
+    chunk_size = getattr(config, "BLOB_CHUNK_SIZE", 1024 * 1024)
+
+    # Chunks are encrypted and written as the body arrives, the file is never held in memory. Chunks of failed
+    # uploads are left to the sweep
+    try:
+        chunks, _ = await chunk_store.put_stream(request.stream(), key, chunk_size=chunk_size,
+                                                 max_size=getattr(config, "BLOB_MAX_SIZE", 512 * 1024 * 1024))
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+    blob = Blob(name=name, content_type=request.headers.get("content-type", "application/octet-stream"),
+                user_id=user.id, chunk_size=chunk_size, data_key_id=data_key_id)
+    return await blob_crud.create(blob, chunks)
+
+
+@router.get(
+    "/blobs",
+    summary="Get a list of files for the current user",
+    response_model=List[BlobRead],
+    status_code=status.HTTP_200_OK,
+)
+async def read_blobs(
+        response: Response,
+        offset: int = 0,
+        limit: int = Query(default=10, lte=50),
+        cursor: Optional[str] = None,
+        blob_crud: BlobCRUD = Depends(BlobCRUD),
+        user=Depends(get_current_user)
+) -> List[Blob]:
+    if limit < 0 or offset < 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Offset and limit must be positive numbers",
+        )
+    blobs = await blob_crud.read_personal_many(offset=offset, limit=limit, user_id=user.id,
+                                               after_id=parse_cursor(cursor))
+    set_next_cursor(response, blobs, limit)
+    return blobs
+
+
+@router.get(
+    "/blobs/{blob_id}",
+    summary="Get a file description by id",
+    response_model=BlobRead,
+    status_code=status.HTTP_200_OK,
+)
+async def read_blob_by_id(
+        blob_id: int,
+        blob_crud: BlobCRUD = Depends(BlobCRUD),
+        user=Depends(get_current_user)
+) -> Blob:
+    blob = await blob_crud.read_personal(unique_id=blob_id, user_id=user.id)
+    if not blob:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    return blob
+
+
+@router.get(
+    "/blobs/{blob_id}/content",
+    summary="Stream the encrypted chunks of a file, each prefixed with its 4 byte big endian length",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def download_blob(
+        blob_id: int,
+        blob_crud: BlobCRUD = Depends(BlobCRUD),
+        user=Depends(get_current_user)
+) -> StreamingResponse:
+    blob = await blob_crud.read_personal(unique_id=blob_id, user_id=user.id)
+    if not blob:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    # Addresses are read before the response, the stream itself only touches the chunk files
+    addresses = await blob_crud.read_addresses(unique_id=blob_id)
+    return StreamingResponse(chunk_store.iter_frames(addresses), media_type="application/octet-stream")
+
+
+@router.delete(
+    "/blobs/{blob_id}",
+    status_code=status.HTTP_200_OK,
+)
+async def delete_blob_by_id(
+        blob_id: int,
+        response: Response,
+        blob_crud: BlobCRUD = Depends(BlobCRUD),
+        user=Depends(get_current_user),
+) -> None:
+    # Ownership is checked by the delete itself, the chunk files are removed later by the sweep
+    if await blob_crud.delete(unique_id=blob_id, user_id=user.id):
+        return
+
+    response.status_code = status.HTTP_404_NOT_FOUND
+
+
+# ----------------- Data keys -----------------
+
+@router.get(
+    "/data-keys/{data_key_id}",
+    summary="Get a wrapped data key by id, used to decrypt envelope encrypted credentials",
+    response_model=DataKeyRead,
+    status_code=status.HTTP_200_OK,
+)
+async def read_data_key_by_id(
+        data_key_id: int,
+        data_key_crud: DataKeyCRUD = Depends(DataKeyCRUD),
+        user=Depends(get_current_user)
+) -> DataKey:
+    data_key = await data_key_crud.read_personal(unique_id=data_key_id, user_id=user.id)
+    if not data_key:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    return data_key
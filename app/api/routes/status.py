@@ -0,0 +1,25 @@
+from typing import Any
+
+from fastapi import APIRouter, Depends, Request, status
+
+from app.core.auth_utils import hashing_pool
+from app.core.cypt_utils import encryption_pool, key_pair_pool
+from app.dependencies.auth import get_current_user
+from app.dependencies.redis import redis_pool_stats
+
+router = APIRouter()
+
+
+@router.get(
+    "/pools",
+    summary="Live statistics of the connection and worker pools of this process",
+    status_code=status.HTTP_200_OK,
+)
+async def read_pool_stats(request: Request, user=Depends(get_current_user)) -> dict[str, Any]:
+    # Numbers are per process, multiply by the worker count to size the database and redis limits
+    return {
+        "database": request.app.state.DB.pool_stats(),
+        "redis": redis_pool_stats(request.app.state.REDIS.connection_pool),
+        "workers": [pool.stats() for pool in (hashing_pool, encryption_pool)],
+        "key_pairs": key_pair_pool.stats(),
+    }
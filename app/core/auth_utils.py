@@ -1,16 +1,41 @@
+import os
 from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
-from jose import jwt
 
+import config
+from app.core.metrics import timed
+from app.core.workers import WorkerPool
 from config import SECRET_KEY, ALGORITHM
 
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# passlib and jose are imported on first use, keeping them off the worker startup path
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+
+@lru_cache(maxsize=None)
+def password_context() -> "CryptContext":
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", scheme_name="JWT")
 
+# bcrypt takes hundreds of milliseconds per call, so it runs here instead of on the event loop
+hashing_pool = WorkerPool(
+    name="hashing",
+    max_workers=getattr(config, "HASH_POOL_WORKERS", min(4, os.cpu_count() or 1)),
+    max_queue=getattr(config, "HASH_POOL_MAX_QUEUE", 64),
+    use_processes=getattr(config, "HASH_POOL_USE_PROCESSES", False),
+)
+
 
 def create_access_token(user: str, expires_delta: timedelta = timedelta(minutes=15)) -> str:
+    from jose import jwt
+
     # Default expiration time is 15 minutes
     expire = datetime.utcnow() + expires_delta
     to_encode = {"exp": expire, "sub": user}
@@ -18,9 +43,19 @@ def create_access_token(user: str, expires_delta: timedelta = timedelta(minutes=
     return encoded_jwt
 
 
+@timed("bcrypt_hash")
 def get_hashed_password(password: str) -> str:
-    return password_context.hash(password)
+    return password_context().hash(password)
 
 
+@timed("bcrypt_verify")
 def verify_password(password: str, hashed_password: str) -> bool:
-    return password_context.verify(password, hashed_password)
+    return password_context().verify(password, hashed_password)
+
+
+async def get_hashed_password_async(password: str) -> str:
+    return await hashing_pool.run(get_hashed_password, password)
+
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    return await hashing_pool.run(verify_password, password, hashed_password)
@@ -0,0 +1,263 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Every chunk is framed with its stored length when downloaded
+FRAME_HEADER = struct.Struct(">I")
+
+
+class BlobTooLarge(ValueError):
+    pass
+
+
+def seal_chunk(data_key: bytes, chunk: bytes) -> Tuple[str, bytes]:
+    """
+    Encrypts a chunk with AES-GCM and returns (address, nonce + ciphertext)
+
+    The nonce is derived from the chunk with HMAC, so the same chunk under the same data key is stored
+    once, and a nonce is only ever repeated for identical plaintext. The address is the SHA-256 of the
+    stored bytes, which keeps plaintext hashes off the disk.
+    """
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    nonce = hmac.new(data_key, chunk, hashlib.sha256).digest()[:12]
+    sealed = nonce + AESGCM(data_key).encrypt(nonce, chunk, None)
+    return hashlib.sha256(sealed).hexdigest(), sealed
+
+
+def open_chunk(data_key: bytes, sealed: bytes) -> bytes:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    return AESGCM(data_key).decrypt(sealed[:12], sealed[12:], None)
+
+
+class ChunkStore:
+    """
+    Content-addressed chunk files under `root`, fanned out by the first two characters of the address
+
+    Methods block on disk I/O, the async helpers below run them on the thread pool.
+    """
+
+    def __init__(self, root: str, read_size: int) -> None:
+        self.root = root
+        self.read_size = read_size
+
+    def path(self, address: str) -> str:
+        return os.path.join(self.root, address[:2], address[2:])
+
+    def write(self, address: str, sealed: bytes) -> bool:
+        """
+        Stores a chunk unless it already exists, returns True when a new file was written
+
+        An existing chunk gets its modification time refreshed instead, which keeps the sweep away from it until the
+        upload reusing it commits its reference.
+        """
+        path = self.path(address)
+        try:
+            os.utime(path)
+            return False
+        except FileNotFoundError:
+            pass
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Written to a temporary file first so a reader never sees a partial chunk
+        fd, temporary_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(sealed)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        return True
+
+    def stale(self, grace: float) -> List[str]:
+        """
+        Addresses of the chunks not written or reused for grace seconds
+        """
+        cutoff = time.time() - grace
+        addresses = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        addresses.append(os.path.basename(directory) + name)
+                except FileNotFoundError:
+                    pass
+        return addresses
+
+    def remove_stale(self, address: str, grace: float) -> bool:
+        """
+        Removes a chunk unless it was written or reused in the last grace seconds, returns whether it was removed
+
+        The chunk is moved aside before its age is checked. An upload reusing it before the move refreshed its age
+        and gets it back, one coming after the move finds no file and writes the chunk again.
+        """
+        path = self.path(address)
+        swept_path = f"{path}.swept"
+        try:
+            os.replace(path, swept_path)
+        except FileNotFoundError:
+            return False
+
+        try:
+            if os.stat(swept_path).st_mtime < time.time() - grace:
+                return True
+            try:
+                os.link(swept_path, path)
+            except FileExistsError:
+                # Written again by an upload in the meantime, the content is the same
+                pass
+            return False
+        finally:
+            os.unlink(swept_path)
+
+    def map(self, address: str) -> mmap.mmap:
+        with open(self.path(address), "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mapped, "madvise"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        return mapped
+
+    async def put_stream(self, chunks: AsyncIterator[bytes], data_key: bytes, chunk_size: int,
+                         max_size: int) -> Tuple[List[Tuple[str, int]], List[str]]:
+        """
+        Splits a byte stream into chunk_size chunks and stores them sealed with data_key
+
+        Returns the (address, plaintext size) of every chunk in order and the addresses of newly written files.
+        Files of uploads that are not committed are left to the sweep, another upload may already reuse them.
+        At most one chunk is held in memory.
+        """
+        stored: List[Tuple[str, int]] = []
+        written: List[str] = []
+        buffer = bytearray()
+        total = 0
+
+        async def flush(chunk: bytes) -> None:
+            address, sealed = await run_in_threadpool(seal_chunk, data_key, chunk)
+            if await run_in_threadpool(self.write, address, sealed):
+                written.append(address)
+            stored.append((address, len(chunk)))
+
+        async for data in chunks:
+            total += len(data)
+            if total > max_size:
+                raise BlobTooLarge(f"Blob exceeds {max_size} bytes")
+            buffer += data
+            while len(buffer) >= chunk_size:
+                chunk = bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+                await flush(chunk)
+        if buffer:
+            await flush(bytes(buffer))
+        return stored, written
+
+    async def iter_frames(self, addresses: List[str]) -> AsyncIterator[bytes]:
+        """
+        Yields every stored chunk prefixed with its length, reading through a memory map in read_size slices
+        """
+        for address in addresses:
+            mapped = await run_in_threadpool(self.map, address)
+            try:
+                yield FRAME_HEADER.pack(len(mapped))
+                for start in range(0, len(mapped), self.read_size):
+                    yield await run_in_threadpool(mapped.__getitem__, slice(start, start + self.read_size))
+            finally:
+                mapped.close()
+
+
+class ChunkSweeper:
+    """
+    Removes the chunk files no blob references anymore, every interval seconds
+
+    Deleting a blob only deletes its rows. A chunk it shared may be reused by an upload that has not committed yet,
+    so files are only removed once they were neither written nor reused for grace seconds and no committed blob
+    references them. Grace has to be longer than any upload takes. Every worker may sweep, moving a chunk aside is
+    atomic so two sweeps never remove a chunk an upload just reused.
+    """
+
+    def __init__(self, store: ChunkStore, interval: float, grace: float, batch_size: int) -> None:
+        self.store = store
+        self.interval = interval
+        self.grace = grace
+        self.batch_size = max(1, batch_size)
+        # Set at startup, returns which of the given addresses committed blobs reference
+        self.referenced: Optional[Callable[[List[str]], Awaitable[Set[str]]]] = None
+
+        self._task: Optional[asyncio.Task] = None
+
+        self.sweeps = 0
+        self.removed = 0
+
+    def start(self, referenced: Callable[[List[str]], Awaitable[Set[str]]]) -> None:
+        self.referenced = referenced
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.warning("Chunk sweep failed", exc_info=True)
+
+    async def sweep(self) -> int:
+        """
+        Removes the stale chunks committed blobs do not reference, returns how many were removed
+        """
+        stale = await run_in_threadpool(self.store.stale, self.grace)
+        removed = 0
+        for start in range(0, len(stale), self.batch_size):
+            batch = stale[start:start + self.batch_size]
+            referenced = await self.referenced(batch)
+            removed += await self._remove(address for address in batch if address not in referenced)
+        self.sweeps += 1
+        self.removed += removed
+        return removed
+
+    async def _remove(self, addresses: Iterable[str]) -> int:
+        removed = 0
+        for address in addresses:
+            if await run_in_threadpool(self.store.remove_stale, address, self.grace):
+                removed += 1
+        return removed
+
+    def stats(self) -> dict[str, int]:
+        return {"sweeps": self.sweeps, "removed": self.removed}
+
+
+chunk_store = ChunkStore(
+    root=getattr(config, "BLOB_STORAGE_PATH", "blobs"),
+    read_size=getattr(config, "BLOB_READ_SIZE", 64 * 1024),
+)
+chunk_sweeper = ChunkSweeper(
+    chunk_store,
+    interval=getattr(config, "BLOB_SWEEP_INTERVAL", 3600),
+    grace=getattr(config, "BLOB_SWEEP_GRACE", 86400),
+    batch_size=getattr(config, "BLOB_SWEEP_BATCH_SIZE", 500),
+)
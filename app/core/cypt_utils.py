@@ -1,16 +1,30 @@
+import asyncio
 import base64
+import hashlib
+import os
+import time
+from collections import OrderedDict, deque
+from typing import TYPE_CHECKING, Callable, Deque, List, Optional, Tuple, Union
 
-from Crypto.Hash import SHA512
-from Crypto.Protocol.KDF import PBKDF2
+import config
+from app.core.metrics import timed
+from app.core.workers import WorkerPool, WorkerPoolFull
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives import hashes
+# cryptography is imported on first use, workers that never encrypt do not pay for it at startup
+if TYPE_CHECKING:
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
 
+# Encryption schemes stored on each credential
+RSA_OAEP_SCHEME = 1
+ENVELOPE_SCHEME = 2
 
+
+@timed("generate_key_pair")
 def generate_key_pair():
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
     private_key = rsa.generate_private_key(
         public_exponent=65537,
         key_size=2048,
@@ -33,14 +47,368 @@ def generate_key_pair():
     return pem_public_key.decode('utf-8'), pem_private_key.decode('utf-8')
 
 
-def encrypt_with_key(public_key: str, data: str) -> str:
-    public_key = serialization.load_pem_public_key(public_key.encode(), backend=default_backend())
+def load_public_key(public_key: str) -> "RSAPublicKey":
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+
+    return serialization.load_pem_public_key(public_key.encode(), backend=default_backend())
+
+
+def _oaep_padding():
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+
+    return padding.OAEP(
+        mgf=padding.MGF1(algorithm=hashes.SHA256()),
+        algorithm=hashes.SHA256(),
+        label=None
+    )
+
+
+# Accepts either a PEM string or a key already parsed with load_public_key
+@timed("encrypt_with_key")
+def encrypt_with_key(public_key: Union[str, "RSAPublicKey"], data: str) -> str:
+    if isinstance(public_key, str):
+        public_key = load_public_key(public_key)
     encrypted_data = public_key.encrypt(
         data.encode(),
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None
-        )
+        _oaep_padding()
     )
     return base64.b64encode(encrypted_data).decode('utf-8')
+
+
+def decrypt_with_key(private_key: str, data: str) -> str:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+
+    private_key = serialization.load_pem_private_key(private_key.encode(), password=None, backend=default_backend())
+    decrypted_data = private_key.decrypt(
+        base64.b64decode(data),
+        _oaep_padding()
+    )
+    return decrypted_data.decode('utf-8')
+
+
+def generate_data_key() -> bytes:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    return AESGCM.generate_key(bit_length=256)
+
+
+# The wrapped key is the data key encrypted with the owner's public key, stored base64 encoded
+def wrap_data_key(public_key: Union[str, "RSAPublicKey"], data_key: bytes) -> str:
+    if isinstance(public_key, str):
+        public_key = load_public_key(public_key)
+    wrapped_key = public_key.encrypt(
+        data_key,
+        _oaep_padding()
+    )
+    return base64.b64encode(wrapped_key).decode('utf-8')
+
+
+def unwrap_data_key(private_key: str, wrapped_key: str) -> bytes:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+
+    private_key = serialization.load_pem_private_key(private_key.encode(), password=None, backend=default_backend())
+    return private_key.decrypt(
+        base64.b64decode(wrapped_key),
+        _oaep_padding()
+    )
+
+
+# Output is base64 of the 12 byte nonce followed by the ciphertext and its tag
+def encrypt_with_data_key(data_key: bytes, data: str) -> str:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    nonce = os.urandom(12)
+    encrypted_data = AESGCM(data_key).encrypt(nonce, data.encode(), None)
+    return base64.b64encode(nonce + encrypted_data).decode('utf-8')
+
+
+def decrypt_with_data_key(data_key: bytes, data: str) -> str:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    raw_data = base64.b64decode(data)
+    return AESGCM(data_key).decrypt(raw_data[:12], raw_data[12:], None).decode('utf-8')
+
+
+def encrypt_many_with_data_key(data_key: bytes, values: List[str]) -> List[Optional[str]]:
+    return [encrypt_with_data_key(data_key, value) for value in values]
+
+
+def encrypt_many_with_key(public_key: str, values: List[str]) -> List[Optional[str]]:
+    """
+    Encrypts every value with the same key, values that cannot be encrypted (e.g. too long for RSA) become None.
+    Takes the PEM instead of a parsed key so it can be sent to worker processes
+    """
+    parsed_key = load_public_key(public_key)
+    encrypted_values = []
+    for value in values:
+        try:
+            encrypted_values.append(encrypt_with_key(parsed_key, value))
+        except ValueError:
+            encrypted_values.append(None)
+    return encrypted_values
+
+
+def key_fingerprint(public_key: str) -> str:
+    return hashlib.sha256(public_key.encode()).hexdigest()
+
+
+class PublicKeyCache:
+    """
+    Bounded LRU cache of parsed public keys
+
+    Entries are keyed by user id and the fingerprint of the PEM they were parsed from,
+    so a user whose key changes never gets the old key back. Call `invalidate` whenever
+    a user's key changes or the user is removed to free the stale entries right away.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max(1, max_size)
+        self._keys: OrderedDict[Tuple[int, str], "RSAPublicKey"] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def get(self, user_id: int, public_key: str) -> Optional["RSAPublicKey"]:
+        cache_key = (user_id, key_fingerprint(public_key))
+        parsed_key = self._keys.get(cache_key)
+        if parsed_key is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._keys.move_to_end(cache_key)
+        return parsed_key
+
+    def put(self, user_id: int, public_key: str) -> "RSAPublicKey":
+        """
+        Parses the PEM and caches the result, evicting the least recently used key when full
+        """
+        cache_key = (user_id, key_fingerprint(public_key))
+        parsed_key = load_public_key(public_key)
+        self._keys[cache_key] = parsed_key
+        self._keys.move_to_end(cache_key)
+
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+            self.evictions += 1
+        return parsed_key
+
+    def get_or_load(self, user_id: int, public_key: str) -> "RSAPublicKey":
+        parsed_key = self.get(user_id, public_key)
+        if parsed_key is None:
+            parsed_key = self.put(user_id, public_key)
+        return parsed_key
+
+    def invalidate(self, user_id: int) -> None:
+        for cache_key in [k for k in self._keys if k[0] == user_id]:
+            del self._keys[cache_key]
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._keys.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._keys),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class CredentialEncryptor:
+    """
+    Encrypts credential secrets for one user with the configured scheme
+
+    `key_material` is the PEM public key or the raw data key, both can be sent to worker processes,
+    while `key` is the parsed form used when encrypting in the current process.
+    """
+
+    def __init__(self, scheme: int, key: Union["RSAPublicKey", bytes], key_material: Union[str, bytes],
+                 data_key_id: Optional[int] = None) -> None:
+        self.scheme = scheme
+        self.key = key
+        self.key_material = key_material
+        self.data_key_id = data_key_id
+
+    def encrypt(self, data: str) -> str:
+        if self.scheme == ENVELOPE_SCHEME:
+            return encrypt_with_data_key(self.key, data)
+        return encrypt_with_key(self.key, data)
+
+    # Module level function encrypting a list of values, meant to be run on a worker pool with key_material
+    @property
+    def encrypt_many(self) -> Callable[[Union[str, bytes], List[str]], List[Optional[str]]]:
+        if self.scheme == ENVELOPE_SCHEME:
+            return encrypt_many_with_data_key
+        return encrypt_many_with_key
+
+    # Columns stored next to the encrypted secret so clients know how to decrypt it
+    @property
+    def fields(self) -> dict[str, Optional[int]]:
+        return {"encryption_scheme": self.scheme, "data_key_id": self.data_key_id}
+
+
+class DataKeyRing:
+    """
+    Plaintext data keys currently used to encrypt each user's credentials
+
+    Keys only live in memory, the database stores them wrapped with the owner's public key.
+    A key is replaced once it is older than `max_age` seconds, which bounds how many values
+    share a key and keeps AES-GCM random nonces far from their collision bound.
+    """
+
+    def __init__(self, max_size: int, max_age: int) -> None:
+        self.max_size = max(1, max_size)
+        self.max_age = max_age
+        self._keys: OrderedDict[Tuple[int, str], Tuple[int, bytes, float]] = OrderedDict()
+        # Ids of the keys dropped for their age, kept until the caller rotates them
+        self._expired: dict[Tuple[int, str], int] = {}
+
+    def get(self, user_id: int, public_key: str) -> Optional[Tuple[int, bytes]]:
+        """
+        Returns the current (data key id, data key), None when a new key has to be created
+        """
+        cache_key = (user_id, key_fingerprint(public_key))
+        entry = self._keys.get(cache_key)
+        if entry is None:
+            return None
+
+        data_key_id, data_key, created_at = entry
+        if time.monotonic() - created_at > self.max_age:
+            del self._keys[cache_key]
+            self._expired[cache_key] = data_key_id
+            return None
+
+        self._keys.move_to_end(cache_key)
+        return data_key_id, data_key
+
+    def pop_expired(self, user_id: int, public_key: str) -> Optional[int]:
+        """
+        Id of the key last dropped for its age, None when there is none to rotate
+        """
+        return self._expired.pop((user_id, key_fingerprint(public_key)), None)
+
+    def put(self, user_id: int, public_key: str, data_key_id: int, data_key: bytes) -> None:
+        self._keys[(user_id, key_fingerprint(public_key))] = (data_key_id, data_key, time.monotonic())
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        for cache_key in [k for k in self._keys if k[0] == user_id]:
+            del self._keys[cache_key]
+        for cache_key in [k for k in self._expired if k[0] == user_id]:
+            del self._expired[cache_key]
+
+    def clear(self) -> None:
+        self._keys.clear()
+        self._expired.clear()
+
+
+class KeyPairPool:
+    """
+    Keeps a stock of fresh RSA key pairs so registration does not wait on prime generation
+
+    Pairs are handed out once and never reused. Whenever the stock drops below `low_water`
+    a background task refills it up to `size` using worker processes. If the stock is empty
+    the caller waits for a worker to generate its pair, key generation never runs on the event loop.
+    WorkerPoolFull propagates when the workers are saturated, so registration answers with a 503.
+    """
+
+    def __init__(self, size: int, low_water: int, workers: WorkerPool) -> None:
+        self.size = max(0, size)
+        self.low_water = min(max(0, low_water), self.size)
+        self.workers = workers
+
+        self._pairs: Deque[Tuple[str, str]] = deque()
+        self._refill_task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._pairs)
+
+    async def get(self) -> Tuple[str, str]:
+        if self._pairs:
+            self.hits += 1
+            key_pair = self._pairs.popleft()
+        else:
+            self.misses += 1
+            key_pair = await self.workers.run(generate_key_pair)
+
+        if len(self._pairs) < self.low_water:
+            self.start()
+        return key_pair
+
+    def start(self) -> None:
+        """
+        Schedules a refill unless one is already running
+        """
+        if self._refill_task is None and len(self._pairs) < self.size:
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self) -> None:
+        try:
+            while len(self._pairs) < self.size:
+                batch = min(self.size - len(self._pairs), self.workers.max_workers)
+                key_pairs = await asyncio.gather(*(self.workers.run(generate_key_pair) for _ in range(batch)))
+                self._pairs.extend(key_pairs)
+        except WorkerPoolFull:
+            # Requests that found the stock empty are using the workers, try again on the next get
+            pass
+        finally:
+            self._refill_task = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "available": len(self._pairs),
+            "size": self.size,
+            "low_water": self.low_water,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def shutdown(self) -> None:
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+        self.workers.shutdown()
+
+
+# Bulk encryption for imports
+encryption_pool = WorkerPool(
+    name="encryption",
+    max_workers=getattr(config, "ENCRYPTION_POOL_WORKERS", 2),
+    max_queue=getattr(config, "ENCRYPTION_POOL_MAX_QUEUE", 16),
+    use_processes=getattr(config, "ENCRYPTION_POOL_USE_PROCESSES", True),
+)
+
+public_key_cache = PublicKeyCache(max_size=getattr(config, "PUBLIC_KEY_CACHE_SIZE", 1024))
+
+data_key_ring = DataKeyRing(
+    max_size=getattr(config, "DATA_KEY_CACHE_SIZE", 1024),
+    max_age=getattr(config, "DATA_KEY_MAX_AGE", 24 * 60 * 60),
+)
+
+key_pair_pool = KeyPairPool(
+    size=getattr(config, "KEY_POOL_SIZE", 16),
+    low_water=getattr(config, "KEY_POOL_LOW_WATER", 4),
+    workers=WorkerPool(
+        name="key-generation",
+        max_workers=getattr(config, "KEY_POOL_WORKERS", 2),
+        max_queue=getattr(config, "KEY_POOL_WORKERS", 2) * 4,
+        use_processes=True,
+    ),
+)
@@ -0,0 +1,110 @@
+import os
+import time
+from functools import wraps
+from typing import Any, Callable, TypeVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+Function = TypeVar("Function", bound=Callable[..., Any])
+
+# Crypto and SQL calls are far shorter than requests, their buckets start lower
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time spent answering a request", ["method", "route"])
+REQUESTS = Counter(
+    "http_requests_total", "Requests answered, by status code", ["method", "route", "status"])
+SQL_DURATION = Histogram(
+    "db_statement_duration_seconds", "Time spent executing SQL statements", ["operation"], buckets=FAST_BUCKETS)
+REDIS_DURATION = Histogram(
+    "redis_command_duration_seconds", "Time spent on Redis commands and pipelines", ["command"], buckets=FAST_BUCKETS)
+CRYPTO_DURATION = Histogram(
+    "crypto_operation_duration_seconds", "Time spent on key generation, encryption and hashing", ["operation"],
+    buckets=FAST_BUCKETS)
+
+
+def timed(operation: str) -> Callable[[Function], Function]:
+    """
+    Records the duration of every call in CRYPTO_DURATION.
+    Works in worker processes too, multiprocess mode collects their samples from the shared directory
+    """
+    def decorator(function: Function) -> Function:
+        @wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                CRYPTO_DURATION.labels(operation).observe(time.perf_counter() - start)
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Times every statement run by the engine, labelled by its leading keyword
+    """
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        start = conn.info["query_start"].pop()
+        SQL_DURATION.labels(statement.lstrip().split(None, 1)[0].upper()).observe(time.perf_counter() - start)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context) -> None:
+        if context.connection is not None and context.connection.info.get("query_start"):
+            context.connection.info["query_start"].pop()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency and status of every HTTP request, labelled by route template
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Paths hold ids, the template keeps label cardinality bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            REQUEST_DURATION.labels(scope["method"], route_path).observe(time.perf_counter() - start)
+            REQUESTS.labels(scope["method"], route_path, str(status_code)).inc()
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    Returns the metrics in Prometheus text format and its content type
+
+    With PROMETHEUS_MULTIPROC_DIR set every worker process writes its samples there,
+    and whichever worker answers aggregates all of them.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Set
+
+from aioredis import Redis
+from aioredis.client import PubSub
+from aioredis.exceptions import RedisError
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Every worker publishes and subscribes on this channel, messages carry the user they are meant for
+CHANGES_CHANNEL = "vault:changes"
+
+
+class ChangeNotifier:
+    """
+    Pushes credential changes to the clients a user has connected to this worker
+
+    Writes publish the user id and the new change version on a Redis channel. Each worker holds a single
+    subscription and fans messages out to the queues of its own connections, so idle clients cost a queue
+    each and never a Redis or database connection. Events only tell clients to sync, the changes themselves
+    are read from /dashboard/credentials/changes, so an event dropped for a slow client loses nothing.
+    """
+
+    def __init__(self, queue_size: int) -> None:
+        self.queue_size = max(1, queue_size)
+        # Set at startup, publishing and listening are disabled without it
+        self.redis: Optional[Redis] = None
+
+        self._queues: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+        self._pubsub: Optional[PubSub] = None
+        self._listener: Optional[asyncio.Task] = None
+
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    async def start(self) -> None:
+        if self.redis is None or self._listener is not None:
+            return
+        self._pubsub = self.redis.pubsub()
+        await self._pubsub.subscribe(CHANGES_CHANNEL)
+        # Redis only delivers what is published after it confirmed the subscription, waiting for the reply means
+        # no change published once start returns is missed
+        while True:
+            message = await self._pubsub.get_message(timeout=1.0)
+            if message is not None and message["type"] == "subscribe":
+                break
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+
+    async def publish(self, user_id: int, version: int) -> None:
+        if self.redis is None:
+            return
+        try:
+            await self.redis.publish(CHANGES_CHANNEL, json.dumps({"user_id": user_id, "version": version}))
+            self.published += 1
+        except RedisError:
+            # The write is already committed, clients still catch up on their next sync
+            logger.warning("Could not publish the change of user %s", user_id, exc_info=True)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except RedisError:
+                logger.warning("Change subscription failed, resubscribing", exc_info=True)
+                await asyncio.sleep(1)
+                continue
+            if message is not None:
+                self.dispatch(json.loads(message["data"]))
+
+    def dispatch(self, event: dict[str, Any]) -> None:
+        for queue in self._queues.get(event["user_id"], ()):
+            try:
+                queue.put_nowait({"version": event["version"]})
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # The client has pending events already, it reads every change on its next sync anyway
+                self.dropped += 1
+
+    @contextmanager
+    def subscribe(self, user_id: int) -> Iterator[asyncio.Queue]:
+        """
+        Yields a queue receiving the change events of the user until the block exits
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._queues[user_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self._queues[user_id].discard(queue)
+            if not self._queues[user_id]:
+                del self._queues[user_id]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "users": len(self._queues),
+            "connections": sum(len(queues) for queues in self._queues.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+change_notifier = ChangeNotifier(queue_size=getattr(config, "CHANGE_EVENTS_QUEUE_SIZE", 16))
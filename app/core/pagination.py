@@ -0,0 +1,47 @@
+import base64
+import json
+
+# Response header carrying the cursor of the next page, only set when the page was full
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    payload = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Returns the id the next page starts after, raises ValueError for malformed cursors
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))["id"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid cursor") from e
+
+    if not isinstance(last_id, int) or last_id < 0:
+        raise ValueError("Invalid cursor")
+    return last_id
+
+
+def encode_sync_token(version: int, last_id: int) -> str:
+    # The id breaks ties between credentials sharing a version, only rows written before versioning do
+    payload = json.dumps({"v": version, "id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> tuple[int, int]:
+    """
+    Returns the (version, id) changes are read after, raises ValueError for malformed tokens
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        version, last_id = payload["v"], payload["id"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid sync token") from e
+
+    if not all(isinstance(value, int) and value >= 0 for value in (version, last_id)):
+        raise ValueError("Invalid sync token")
+    return version, last_id
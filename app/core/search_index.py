@@ -0,0 +1,187 @@
+from array import array
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+import config
+
+# Starts every field of an indexed text, queries never contain it
+FIELD_SEPARATOR = "\x00"
+
+
+def trigrams(value: str) -> Set[str]:
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def _text_grams(text: str) -> Set[str]:
+    # Fields are indexed separately so no gram spans two of them. Each field also gets its first one and two
+    # characters behind the separator, which find the fields starting with a query
+    grams: Set[str] = set()
+    for field in text.split(FIELD_SEPARATOR)[1:]:
+        field = FIELD_SEPARATOR + field
+        grams.update((field[:2], field[:3]))
+        grams.update(trigrams(field))
+    return grams
+
+
+class UserSearchIndex:
+    """
+    Trigram index over the credentials of one user, answering substring queries
+
+    Postings are append only arrays of credential ids. Removing or changing a credential leaves its old postings
+    behind, every candidate is checked against the current text so they never match, and postings are rebuilt once
+    stale ones outnumber live ones. Searches walk the smallest posting that holds every match and stop at the limit.
+    """
+
+    def __init__(self, version: int) -> None:
+        # Change version of the user the index reflects, see CredentialCRUD.search
+        self.version = version
+        self.texts: Dict[int, str] = {}
+        self._postings: Dict[str, array] = defaultdict(lambda: array("q"))
+        self._live = 0
+        self._stale = 0
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def put(self, credential_id: int, fields: Sequence[Optional[str]]) -> None:
+        text = "".join(FIELD_SEPARATOR + (field or "").lower() for field in fields)
+        previous = self.texts.get(credential_id)
+        if previous == text:
+            return
+
+        self.texts[credential_id] = text
+        grams = _text_grams(text)
+        for gram in grams:
+            self._postings[gram].append(credential_id)
+        self._live += len(grams)
+        if previous is not None:
+            self._forget(previous)
+
+    def remove(self, credential_id: int) -> None:
+        previous = self.texts.pop(credential_id, None)
+        if previous is not None:
+            self._forget(previous)
+
+    def _forget(self, text: str) -> None:
+        # Called once texts no longer holds the forgotten text, a compaction rebuilds from the current texts only
+        stale = len(_text_grams(text))
+        self._live -= stale
+        self._stale += stale
+        if self._stale > max(self._live, 1024):
+            self._compact()
+
+    def _compact(self) -> None:
+        self._postings.clear()
+        self._live = 0
+        for credential_id, text in self.texts.items():
+            grams = _text_grams(text)
+            for gram in grams:
+                self._postings[gram].append(credential_id)
+            self._live += len(grams)
+        self._stale = 0
+
+    def search(self, query: str, limit: int) -> List[int]:
+        """
+        Ids of the credentials with a field containing query, those with a field starting with it come first.
+        Within each group credentials are in the order they were indexed
+        """
+        query = query.lower()
+        grams = trigrams(query)
+        # Every match is in the posting of each trigram of the query, queries shorter than that scan the texts
+        containing: Iterable[int] = min((self._postings.get(gram, ()) for gram in grams), key=len) if grams \
+            else self.texts
+        starting = min(self._postings.get(FIELD_SEPARATOR + query[:2], ()), containing, key=len)
+
+        ranked = self._matches(starting, FIELD_SEPARATOR + query, limit, set())
+        if len(ranked) < limit:
+            ranked += self._matches(containing, query, limit - len(ranked), set(ranked))
+        return ranked
+
+    def _matches(self, candidates: Iterable[int], needle: str, limit: int, seen: Set[int]) -> List[int]:
+        matches: List[int] = []
+        for credential_id in candidates:
+            if credential_id in seen:
+                continue
+            seen.add(credential_id)
+            text = self.texts.get(credential_id)
+            if text is not None and needle in text:
+                matches.append(credential_id)
+                if len(matches) == limit:
+                    break
+        return matches
+
+
+class SearchIndex:
+    """
+    Per user search indexes of this worker, built on first use and kept up to date by CredentialCRUD
+
+    Indexes hold at most max_entries credentials altogether, the least recently searched users are evicted first
+    and rebuilt when they search again. The cap counts credentials, not bytes, memory grows with the length of the
+    indexed fields as well. Other workers' writes reach an index through the change version check
+    done before every search.
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max(1, max_entries)
+        self._indexes: OrderedDict[int, UserSearchIndex] = OrderedDict()
+
+        self.builds = 0
+        self.evictions = 0
+
+    def get(self, user_id: int) -> Optional[UserSearchIndex]:
+        index = self._indexes.get(user_id)
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+        return index
+
+    def store(self, user_id: int, index: UserSearchIndex) -> None:
+        self.builds += 1
+        self._indexes[user_id] = index
+        self._indexes.move_to_end(user_id)
+        self._evict()
+
+    def put(self, user_id: int, version: int, credential_id: int, fields: Sequence[Optional[str]]) -> None:
+        # Writes of users without an index are picked up when it is built
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        index.put(credential_id, fields)
+        self._advance(index, version)
+        self._evict()
+
+    def remove(self, user_id: int, version: int, credential_id: int) -> None:
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        index.remove(credential_id)
+        self._advance(index, version)
+
+    @staticmethod
+    def _advance(index: UserSearchIndex, version: int) -> None:
+        # A gap means another worker wrote in between, the next search reads the missing changes
+        if version == index.version + 1:
+            index.version = version
+
+    def _evict(self) -> None:
+        # The most recently used index stays even when it alone is over the cap
+        while len(self._indexes) > 1 and sum(len(index) for index in self._indexes.values()) > self.max_entries:
+            self._indexes.popitem(last=False)
+            self.evictions += 1
+
+    def drop(self, user_id: int) -> None:
+        self._indexes.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._indexes.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "users": len(self._indexes),
+            "entries": sum(len(index) for index in self._indexes.values()),
+            "max_entries": self.max_entries,
+            "builds": self.builds,
+            "evictions": self.evictions,
+        }
+
+
+search_index = SearchIndex(max_entries=getattr(config, "SEARCH_INDEX_MAX_ENTRIES", 200_000))
@@ -0,0 +1,54 @@
+from typing import Dict, List, Sequence
+
+import orjson
+from sqlalchemy import Row
+
+from app.models.user import User
+
+
+def credential_rows_to_json(rows: Sequence[Row], owner: User) -> bytes:
+    """
+    Encodes rows from CredentialCRUD.read_personal_rows exactly as a List[CredentialRead] response would be,
+    without building ORM objects or validating models. Every row belongs to owner, so it is only built once
+    """
+    owner_data = {"email": owner.email, "username": owner.username, "public_key": owner.public_key}
+    credentials: List[dict] = [{
+        "nickname": row.nickname,
+        "email": row.email,
+        "username": row.username,
+        "encrypted_password": row.encrypted_password,
+        "favorite": row.favorite,
+        "created_at": row.created_at,
+        "id": row.id,
+        "encryption_scheme": row.encryption_scheme,
+        "data_key_id": row.data_key_id,
+        "site": None if row.site_id is None else {"name": row.site_name, "id": row.site_id, "url": row.site_url},
+        "owner": owner_data,
+    } for row in rows]
+    return orjson.dumps(credentials)
+
+
+def credential_rows_to_compact_json(rows: Sequence[Row]) -> bytes:
+    """
+    Encodes rows from CredentialCRUD.read_personal_rows as a CredentialCompactPage. Items reference their site by
+    id and every site of the page is sent once, the owner is left out since it is always the requesting user
+    """
+    credentials: List[dict] = []
+    sites: Dict[str, dict] = {}
+    for row in rows:
+        credentials.append({
+            "nickname": row.nickname,
+            "email": row.email,
+            "username": row.username,
+            "encrypted_password": row.encrypted_password,
+            "favorite": row.favorite,
+            "created_at": row.created_at,
+            "id": row.id,
+            "encryption_scheme": row.encryption_scheme,
+            "data_key_id": row.data_key_id,
+            "site_id": row.site_id,
+        })
+        # JSON object keys are strings, the same keys pydantic writes for Dict[int, SiteRead]
+        if row.site_id is not None and str(row.site_id) not in sites:
+            sites[str(row.site_id)] = {"name": row.site_name, "id": row.site_id, "url": row.site_url}
+    return orjson.dumps({"credentials": credentials, "sites": sites})
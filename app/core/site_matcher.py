@@ -0,0 +1,225 @@
+import asyncio
+import ipaddress
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import config
+from app.models.site import SiteRead
+
+# Public suffixes of two labels, names under them are registered one label deeper. A full public suffix list is not
+# shipped, these cover the common country code second level domains
+MULTI_LABEL_SUFFIXES = frozenset({
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "me.uk", "com.au", "net.au", "org.au", "co.nz", "org.nz", "co.jp",
+    "ne.jp", "or.jp", "co.kr", "co.in", "co.za", "co.il", "com.br", "com.mx", "com.ar", "com.cn", "com.tr",
+    "com.tw", "com.hk", "com.sg", "com.my",
+})
+
+
+def normalize_host(url: str) -> Optional[str]:
+    """
+    Lowercase host of url without port or trailing dot, internationalized names in their ASCII form.
+    Urls without a scheme are read as a bare host, None when no host can be found
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = "//" + url
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+
+    host = host.rstrip(".")
+    try:
+        host = host.encode("idna").decode("ascii")
+    except UnicodeError:
+        pass
+    return host or None
+
+
+def _labels(host: str) -> List[str]:
+    # Addresses are a single label, so they only ever match a site at the same address
+    try:
+        ipaddress.ip_address(host)
+        return [host]
+    except ValueError:
+        return host.split(".")[::-1]
+
+
+def registrable_labels(host: str) -> int:
+    """
+    Number of labels, counted from the top level domain, of the domain the host was registered as
+    """
+    labels = _labels(host)
+    if len(labels) < 2:
+        return len(labels)
+    suffix = f"{labels[1]}.{labels[0]}"
+    return min(len(labels), 3 if suffix in MULTI_LABEL_SUFFIXES else 2)
+
+
+class _Node:
+    __slots__ = ("children", "site_ids", "domain_site_ids")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, _Node] = {}
+        # Sites whose host is exactly the domain of this node
+        self.site_ids: Set[int] = set()
+        # On registrable domain nodes, every site with a host inside that domain
+        self.domain_site_ids: Set[int] = set()
+
+
+class _Trie:
+    def __init__(self) -> None:
+        self.root = _Node()
+        self.sites: Dict[int, SiteRead] = {}
+        self.hosts: Dict[int, str] = {}
+
+    def put(self, site: SiteRead) -> None:
+        self.remove(site.id)
+        self.sites[site.id] = site
+        host = normalize_host(site.url) if site.url else None
+        if host is None:
+            return
+
+        self.hosts[site.id] = host
+        registrable = registrable_labels(host)
+        node = self.root
+        for depth, label in enumerate(_labels(host), start=1):
+            node = node.children.setdefault(label, _Node())
+            if depth == registrable:
+                node.domain_site_ids.add(site.id)
+        node.site_ids.add(site.id)
+
+    def remove(self, site_id: int) -> None:
+        self.sites.pop(site_id, None)
+        host = self.hosts.pop(site_id, None)
+        if host is None:
+            return
+
+        labels = _labels(host)
+        path = [self.root]
+        for label in labels:
+            path.append(path[-1].children[label])
+        for node in path:
+            node.site_ids.discard(site_id)
+            node.domain_site_ids.discard(site_id)
+
+        # Branches left without sites are pruned from the leaf up
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth]
+            if node.children or node.site_ids or node.domain_site_ids:
+                break
+            del path[depth - 1].children[labels[depth - 1]]
+
+    def match(self, host: str) -> Optional[int]:
+        labels = _labels(host)
+        registrable = registrable_labels(host)
+        node, best, domain = self.root, None, None
+        for depth, label in enumerate(labels, start=1):
+            node = node.children.get(label)
+            if node is None:
+                break
+            # Sites above the registrable domain, e.g. a bare suffix, never match
+            if depth >= registrable and node.site_ids:
+                best = node
+            if depth == registrable:
+                domain = node
+
+        if best is not None:
+            return min(best.site_ids)
+        if domain is not None and domain.domain_site_ids:
+            return min(domain.domain_site_ids)
+        return None
+
+
+class SiteMatcher:
+    """
+    Maps page urls to sites through a trie of the reversed labels of each site's host
+
+    The site registered at the longest domain the page host ends with wins, www.github.com and gist.github.com both
+    match a site at github.com. Without one, any site inside the registrable domain of the page matches, so
+    mail.google.com finds a site at accounts.google.com. Lookups walk one node per label and never query the
+    database. SiteCRUD applies this worker's writes as they commit, the whole catalog is read again once the trie
+    is older than max_age seconds so sites written through other workers show up.
+    """
+
+    def __init__(self, max_age: float) -> None:
+        self.max_age = max_age
+        self._trie: Optional[_Trie] = None
+        self._built_at = 0.0
+        # Writes committed while the catalog is read, replayed onto the new trie
+        self._pending: Optional[List[Tuple[int, Optional[SiteRead]]]] = None
+        # Held while the catalog is read, so an older snapshot never replaces a newer one
+        self._rebuild_lock = asyncio.Lock()
+
+        self.builds = 0
+
+    def expired(self) -> bool:
+        return self._trie is None or time.monotonic() - self._built_at > self.max_age
+
+    async def rebuild(self, read_sites: Callable[[], Awaitable[Iterable[SiteRead]]]) -> None:
+        """
+        Builds the trie again from the sites read_sites returns, unless another request rebuilt it while this one
+        waited for its turn. A single rebuild runs at a time
+        """
+        async with self._rebuild_lock:
+            if not self.expired():
+                return
+            self.begin_rebuild()
+            try:
+                sites = await read_sites()
+            except BaseException:
+                self._pending = None
+                raise
+            self.finish_rebuild(sites)
+
+    def begin_rebuild(self) -> None:
+        self._pending = []
+
+    def finish_rebuild(self, sites: Iterable[SiteRead]) -> None:
+        trie = _Trie()
+        for site in sites:
+            trie.put(site)
+        for site_id, site in self._pending or ():
+            if site is None:
+                trie.remove(site_id)
+            else:
+                trie.put(site)
+
+        self._trie, self._built_at, self._pending = trie, time.monotonic(), None
+        self.builds += 1
+
+    def put(self, site: SiteRead) -> None:
+        if self._pending is not None:
+            self._pending.append((site.id, site))
+        if self._trie is not None:
+            self._trie.put(site)
+
+    def remove(self, site_id: int) -> None:
+        if self._pending is not None:
+            self._pending.append((site_id, None))
+        if self._trie is not None:
+            self._trie.remove(site_id)
+
+    def match(self, url: str) -> Optional[SiteRead]:
+        host = normalize_host(url)
+        if host is None or self._trie is None:
+            return None
+        site_id = self._trie.match(host)
+        return self._trie.sites[site_id] if site_id is not None else None
+
+    def clear(self) -> None:
+        self._trie, self._pending = None, None
+        self._rebuild_lock = asyncio.Lock()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "sites": len(self._trie.sites) if self._trie is not None else 0,
+            "hosts": len(self._trie.hosts) if self._trie is not None else 0,
+            "builds": self.builds,
+        }
+
+
+site_matcher = SiteMatcher(max_age=getattr(config, "SITE_MATCHER_MAX_AGE", 300))
@@ -0,0 +1,105 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from aioredis import Redis
+
+import config
+from app.models.user import User
+
+
+class UserCache:
+    """
+    Two tier cache of authenticated users keyed by the token subject (username)
+
+    The first tier is an in-process LRU with a short TTL, the optional second tier is Redis
+    and is shared by every worker. Entries never outlive the token that created them.
+    Writes through UserCRUD invalidate both tiers of the current worker, other workers'
+    in-process tiers can serve a stale user for at most `ttl` seconds.
+    """
+
+    def __init__(self, max_size: int, ttl: int, shared_ttl: int) -> None:
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.shared_ttl = shared_ttl
+        # Set at startup when the shared tier is enabled
+        self.redis: Optional[Redis] = None
+
+        self._users: OrderedDict[str, Tuple[User, float]] = OrderedDict()
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _redis_key(username: str) -> str:
+        return f"user:{username}"
+
+    async def get(self, username: str) -> Optional[User]:
+        entry = self._users.get(username)
+        if entry is not None:
+            user, expires_at = entry
+            if expires_at > time.time():
+                self.hits += 1
+                self._users.move_to_end(username)
+                return user
+            del self._users[username]
+
+        if self.redis is not None:
+            # The entry and its remaining lifetime are read in a single round trip
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.get(self._redis_key(username))
+                pipe.ttl(self._redis_key(username))
+                cached_user, ttl = await pipe.execute()
+            if cached_user:
+                self.shared_hits += 1
+                user = User(**json.loads(cached_user))
+                self._store_local(user, time.time() + min(self.ttl, max(ttl, 0)))
+                return user
+
+        self.misses += 1
+        return None
+
+    async def set(self, user: User, token_expires_at: float) -> None:
+        # Cache a detached copy so the entry is not tied to the session of the current request
+        user = User(**user.model_dump())
+        now = time.time()
+        self._store_local(user, min(now + self.ttl, token_expires_at))
+
+        if self.redis is not None:
+            shared_ttl = int(min(self.shared_ttl, token_expires_at - now))
+            if shared_ttl > 0:
+                # The password hash is never needed by routes and stays out of the shared tier
+                await self.redis.set(self._redis_key(user.username),
+                                     user.model_dump_json(exclude={"hashed_password"}), ex=shared_ttl)
+
+    def _store_local(self, user: User, expires_at: float) -> None:
+        self._users[user.username] = (user, expires_at)
+        self._users.move_to_end(user.username)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    async def invalidate(self, username: str) -> None:
+        self._users.pop(username, None)
+        if self.redis is not None:
+            await self.redis.delete(self._redis_key(username))
+
+    def clear(self) -> None:
+        self._users.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._users),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+        }
+
+
+user_cache = UserCache(
+    max_size=getattr(config, "USER_CACHE_SIZE", 1024),
+    ttl=getattr(config, "USER_CACHE_TTL", 30),
+    shared_ttl=getattr(config, "USER_CACHE_SHARED_TTL", 300),
+)
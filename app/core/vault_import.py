@@ -0,0 +1,237 @@
+import asyncio
+import codecs
+import csv
+import json
+from typing import Any, AsyncIterator, List, Optional, Tuple
+
+import config
+from app.core.cypt_utils import CredentialEncryptor, encryption_pool
+from app.core.workers import WorkerPoolFull
+from app.crud.credential import CredentialCRUD
+from app.models.credential import CredentialBatchItem, CredentialImportError, CredentialImportRead
+
+# Column names used by the exports of common password managers, matched case insensitively
+FIELD_ALIASES = {
+    "nickname": ("nickname", "name", "title"),
+    "email": ("email",),
+    "username": ("username", "login_username", "login"),
+    "encrypted_password": ("encrypted_password", "password", "login_password"),
+    "favorite": ("favorite", "fav"),
+    "site_id": ("site_id",),
+}
+
+# Longest line, or CSV record spanning several lines, an upload may hold. Longer ones stop the import
+MAX_LINE_LENGTH = getattr(config, "IMPORT_MAX_LINE_LENGTH", 65536)
+
+
+class ImportStopped(Exception):
+    """
+    Raised when the rest of an upload cannot be imported, line is the first line left out
+    """
+
+    def __init__(self, line: int, detail: str) -> None:
+        super().__init__(detail)
+        self.line = line
+        self.detail = detail
+
+
+def _check_length(line_number: int, line: str, max_length: int) -> None:
+    if len(line) > max_length:
+        raise ImportStopped(line_number, f"Line is longer than {max_length} characters")
+
+
+async def iter_lines(chunks: AsyncIterator[bytes],
+                     max_line_length: int = MAX_LINE_LENGTH) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Splits a stream of UTF-8 bytes into numbered lines, holding at most one incomplete line in memory.
+    Raises ImportStopped once a line grows past max_line_length, so memory stays bounded on any upload
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            line_number += 1
+            _check_length(line_number, line, max_line_length)
+            yield line_number, line.rstrip("\r")
+        _check_length(line_number + 1, buffer, max_line_length)
+
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield line_number + 1, buffer.rstrip("\r")
+
+
+async def iter_csv_records(lines: AsyncIterator[Tuple[int, str]],
+                           max_record_length: int = MAX_LINE_LENGTH) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Yields (line number, record) pairs, the first row is the header. Quoted fields may span several lines,
+    ImportStopped is raised when a record grows past max_record_length
+    """
+    header: Optional[list[str]] = None
+    pending: Optional[str] = None
+    first_line = 0
+    async for line_number, line in lines:
+        if pending is None:
+            pending, first_line = line, line_number
+        else:
+            pending += "\n" + line
+        _check_length(first_line, pending, max_record_length)
+
+        # An odd number of quotes means a quoted field continues on the next line
+        if pending.count('"') % 2:
+            continue
+        record, pending = pending, None
+        if not record.strip():
+            continue
+
+        row = next(csv.reader([record]))
+        if header is None:
+            header = [column.strip().lower() for column in row]
+            continue
+        yield first_line, dict(zip(header, row))
+
+    if pending is not None:
+        yield first_line, ValueError("Unterminated quoted field")
+
+
+async def iter_ndjson_records(lines: AsyncIterator[Tuple[int, str]]) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Yields (line number, record) pairs, lines that are not JSON objects are yielded as the parsing error
+    """
+    async for line_number, line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+            continue
+        if not isinstance(record, dict):
+            yield line_number, ValueError("Line is not a JSON object")
+            continue
+        yield line_number, {str(key).lower(): value for key, value in record.items()}
+
+
+def record_to_item(record: dict) -> CredentialBatchItem:
+    """
+    Maps an imported record to a credential, raises ValueError when required fields are missing or invalid
+    """
+    values = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            if record.get(alias) not in (None, ""):
+                values[field] = record[alias]
+                break
+
+    if not values.get("nickname") or not values.get("encrypted_password"):
+        raise ValueError("A name and a password are required")
+    if isinstance(values.get("favorite"), str):
+        values["favorite"] = values["favorite"].strip().lower() in ("1", "true", "yes", "y")
+
+    return CredentialBatchItem(**values)
+
+
+class VaultImport:
+    """
+    Imports a stream of records into a user's vault chunk by chunk
+
+    Each chunk is encrypted on the encryption pool while the next one is parsed, then written
+    with a single bulk insert. At most three chunks are held in memory regardless of the file size.
+    """
+
+    max_errors = 100
+
+    def __init__(self, crud: CredentialCRUD, user_id: int, encryptor: CredentialEncryptor, chunk_size: int) -> None:
+        self.crud = crud
+        self.user_id = user_id
+        self.encryptor = encryptor
+        self.chunk_size = max(1, chunk_size)
+        self.summary = CredentialImportRead()
+
+    def _fail(self, line: int, detail: str) -> None:
+        self.summary.failed += 1
+        if len(self.summary.errors) < self.max_errors:
+            self.summary.errors.append(CredentialImportError(line=line, detail=detail))
+
+    def _stop(self, line: int, detail: str) -> None:
+        # Always reported, even past max_errors, the client needs the line to resume from
+        self.summary.stopped = True
+        self.summary.errors.append(CredentialImportError(line=line, detail=detail))
+
+    def _skip(self, line: int, detail: str) -> None:
+        self.summary.skipped += 1
+        if len(self.summary.errors) < self.max_errors:
+            self.summary.errors.append(CredentialImportError(line=line, detail=detail))
+
+    # Returns False when the import has to stop at this chunk
+    async def _write(self, chunk: List[Tuple[int, CredentialBatchItem]], encryption: asyncio.Future) -> bool:
+        try:
+            encrypted_passwords = await encryption
+        except WorkerPoolFull:
+            # Earlier chunks are committed, failing the request would hide what was imported
+            self._stop(chunk[0][0], "The server is busy, the import stopped before this line")
+            return False
+
+        items, lines = [], []
+        for (line, item), encrypted_password in zip(chunk, encrypted_passwords):
+            if encrypted_password is None:
+                self._fail(line, "Password is too long to be encrypted")
+                continue
+            item.encrypted_password = encrypted_password
+            items.append(item)
+            lines.append(line)
+
+        if items:
+            batch = await self.crud.create_many(user_id=self.user_id, items=items, **self.encryptor.fields)
+            self.summary.imported += len(batch.created)
+            for conflict in batch.conflicts:
+                self._skip(lines[conflict.index], conflict.detail)
+        return True
+
+    def _encrypt(self, chunk: List[Tuple[int, CredentialBatchItem]]) -> asyncio.Future:
+        passwords = [item.encrypted_password for _, item in chunk]
+        return asyncio.ensure_future(
+            encryption_pool.run(self.encryptor.encrypt_many, self.encryptor.key_material, passwords))
+
+    async def run(self, records: AsyncIterator[Tuple[int, Any]]) -> CredentialImportRead:
+        chunk: List[Tuple[int, CredentialBatchItem]] = []
+        in_flight: Optional[Tuple[list, asyncio.Future]] = None
+        stopped: Optional[ImportStopped] = None
+        try:
+            try:
+                async for line, record in records:
+                    if isinstance(record, Exception):
+                        self._fail(line, str(record))
+                        continue
+                    try:
+                        chunk.append((line, record_to_item(record)))
+                    except ValueError as e:
+                        self._fail(line, str(e).splitlines()[0])
+                        continue
+
+                    if len(chunk) == self.chunk_size:
+                        # The full chunk is encrypted while the previous one is written and the next one parsed
+                        previous, in_flight = in_flight, (chunk, self._encrypt(chunk))
+                        chunk = []
+                        if previous is not None and not await self._write(*previous):
+                            return self.summary
+            except ImportStopped as e:
+                # Records read before the upload became unreadable are still imported
+                stopped = e
+
+            if in_flight is not None:
+                previous, in_flight = in_flight, None
+                if not await self._write(*previous):
+                    return self.summary
+            if chunk and not await self._write(chunk, self._encrypt(chunk)):
+                return self.summary
+        finally:
+            if in_flight is not None:
+                in_flight[1].cancel()
+
+        if stopped is not None:
+            self._stop(stopped.line, stopped.detail)
+        return self.summary
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from fastapi import FastAPI
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+from app.core.auth_utils import create_access_token, hashing_pool, password_context
+from app.core.cypt_utils import encryption_pool, generate_data_key
+from config import ALGORITHM, SECRET_KEY
+
+logger = logging.getLogger(__name__)
+
+
+async def prime_database(application: FastAPI, connections: int) -> None:
+    # Connections opened together stay in the pool once returned, the first requests do not pay for the handshakes
+    async def checkout() -> None:
+        async with application.state.DB.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*[checkout() for _ in range(connections)])
+
+
+async def prime_redis(application: FastAPI, connections: int) -> None:
+    await asyncio.gather(*[application.state.REDIS.ping() for _ in range(connections)])
+
+
+async def build_schemas(application: FastAPI) -> None:
+    # Crypto libraries are imported lazily, importing them here keeps that cost off the first requests
+    from jose import jwt
+
+    jwt.decode(create_access_token("warm-up"), SECRET_KEY, algorithms=[ALGORITHM])
+    password_context()
+    generate_data_key()
+
+    # Mappers are configured on the first query and the OpenAPI schema on the first /docs visit
+    configure_mappers()
+    application.openapi()
+
+
+async def warm_up(application: FastAPI, db_connections: int, redis_connections: int) -> dict[str, Any]:
+    """
+    Gets a worker ready before it accepts traffic, returns how long each step took in milliseconds
+    """
+    steps: dict[str, Callable[[], Awaitable[Any]]] = {
+        "database": lambda: prime_database(application, db_connections),
+        "redis": lambda: prime_redis(application, redis_connections),
+        "schemas": lambda: build_schemas(application),
+        "hashing_pool": hashing_pool.warm_up,
+        "encryption_pool": encryption_pool.warm_up,
+    }
+    timings = {}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        await step()
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    logger.info("Worker warmed up in %s ms: %s", round(sum(timings.values()), 1), timings)
+    return timings
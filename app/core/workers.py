@@ -0,0 +1,105 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class WorkerPoolFull(Exception):
+    """
+    Raised when a worker pool already has as many waiting jobs as its queue allows
+    """
+
+
+class WorkerPool:
+    """
+    Runs blocking, CPU bound functions outside the event loop
+
+    At most `max_workers` jobs are handed to the executor at once, up to `max_queue` more jobs
+    wait for a free worker and anything beyond that is rejected with WorkerPoolFull.
+    The executor is created lazily so each gunicorn worker builds its own one after forking.
+    When using processes, the submitted functions and arguments must be picklable.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, use_processes: bool = False) -> None:
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.use_processes = use_processes
+
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self._waiting = 0
+        self._running = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        # Semaphores are bound to the loop they are first used on, so rebuild it if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_workers)
+            self._loop = loop
+        return self._slots
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Number of jobs waiting for a free worker
+        """
+        return self._waiting
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        slots = self._get_slots()
+        if slots.locked() and self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise WorkerPoolFull(f"The {self.name} pool has {self._waiting} jobs waiting and cannot accept more")
+
+        self._waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), partial(func, *args))
+        finally:
+            self._running -= 1
+            self.completed += 1
+            slots.release()
+
+    async def warm_up(self) -> None:
+        """
+        Starts every worker ahead of the first real job, processes are forked and threads spawned here
+        """
+        await asyncio.gather(*[self.run(os.getpid) for _ in range(self.max_workers)])
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "queue_depth": self._waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -1,10 +1,22 @@
 from abc import ABC, abstractmethod
-from typing import Generic, Optional, TypeVar, List
+from typing import Any, Generic, Optional, TypeVar, List, Sequence, Type
+
+from sqlalchemy import ColumnElement, delete, insert, Row, update
+from sqlalchemy.orm import QueryableAttribute, selectinload
+from sqlalchemy.orm.strategy_options import Load
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 Model = TypeVar("Model")
 CreateSchema = TypeVar("CreateSchema")
 UpdateSchema = TypeVar("UpdateSchema")
 
+# Relationships a query should load, models never load them implicitly
+LoadPolicy = Sequence[QueryableAttribute]
+
+
+def load_options(load: LoadPolicy) -> List[Load]:
+    return [selectinload(relationship) for relationship in load]
+
 
 class BaseCRUD(ABC, Generic[Model, CreateSchema, UpdateSchema]):
     """
@@ -14,8 +26,34 @@ class BaseCRUD(ABC, Generic[Model, CreateSchema, UpdateSchema]):
     -------
     OrderCRUD(BaseCRUD[Order, OrderCreate, OrderUpdate])
     * All BaseCrud parameters are schemas created for the object/table
+
+    Writes go through the _returning helpers, each one is a single statement that hands back the written row.
+    Ownership checks belong in their where clause rather than in a read before the write.
+    None of them commit, callers commit once any related rows they need are loaded
     """
 
+    # Table model written by the helpers, set by each implementation
+    model: Type[Model]
+    db_session: AsyncSession
+
+    async def _insert_returning(self, values: dict[str, Any]) -> Model:
+        statement = insert(self.model).values(**values).returning(self.model)
+        results = await self.db_session.scalars(statement=statement)
+        return results.one()
+
+    # Returns None when no row matched the where clause
+    async def _update_returning(self, where: ColumnElement[bool], values: dict[str, Any]) -> Optional[Model]:
+        statement = update(self.model).where(where).values(**values).returning(self.model).execution_options(
+            populate_existing=True)
+        results = await self.db_session.scalars(statement=statement)
+        return results.one_or_none()
+
+    # Returns the requested columns of the deleted row, None when no row matched the where clause
+    async def _delete_returning(self, where: ColumnElement[bool], *columns: Any) -> Optional[Row]:
+        statement = delete(self.model).where(where).returning(*(columns or self.model.__table__.primary_key.columns))
+        results = await self.db_session.execute(statement=statement)
+        return results.one_or_none()
+
     @abstractmethod
     async def create(self, data: CreateSchema) -> Model:
         ...
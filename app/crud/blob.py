@@ -0,0 +1,110 @@
+from typing import Optional, List, Set, Tuple
+
+from fastapi import Depends
+from sqlalchemy import and_, ColumnElement, delete, insert, select, Select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.crud.base import BaseCRUD
+from app.dependencies.db import get_db
+from app.models.blob import Blob, BlobBase, BlobChunk
+
+
+class BlobCRUD(BaseCRUD[Blob, Blob, BlobBase]):
+    model = Blob
+
+    def __init__(self, db_session: AsyncSession = Depends(get_db)):
+        self.db_session = db_session
+
+    # Where clause of a write, restricted to the user's blobs when a user id is given
+    @staticmethod
+    def _ownership(unique_id: int, user_id: Optional[int]) -> ColumnElement[bool]:
+        where = Blob.id == unique_id
+        if user_id is not None:
+            where = and_(where, Blob.user_id == user_id)
+        return where
+
+    async def create(self, blob: Blob, chunks: List[Tuple[str, int]] = ()) -> Blob:
+        """
+        Stores the blob and its ordered (address, size) chunks in a single transaction
+        """
+        blob.size = sum(size for _, size in chunks)
+        # Chunk rows need the id returned by the blob insert, all of them go in one executemany
+        record = await self._insert_returning(blob.model_dump(exclude={"id"}))
+        if chunks:
+            await self.db_session.execute(insert(BlobChunk), [
+                {"blob_id": record.id, "position": position, "address": address, "size": size}
+                for position, (address, size) in enumerate(chunks)])
+        await self.db_session.commit()
+        return record
+
+    # Reads a blob by its unique id regardless of the user, used for admin purposes
+    async def read(self, unique_id: int) -> Optional[Blob]:
+        statement: Select = select(Blob).where(Blob.id == unique_id)
+        results = await self.db_session.scalars(statement=statement)
+
+        # one or none allows empty results
+        blob = results.one_or_none()
+        return blob
+
+    # Does not require ownership, used for admin purposes
+    async def read_many(self, offset: int, limit: int) -> List[Blob]:
+        statement: Select = select(Blob).order_by(Blob.id).offset(offset).limit(limit)
+        results = await self.db_session.scalars(statement=statement)
+
+        blobs = [r for r in results.all()]
+        return blobs
+
+    # Requires a user id to ensure ownership
+    async def read_personal(self, unique_id: int, user_id: int) -> Optional[Blob]:
+        statement: Select = select(Blob).where(and_(Blob.id == unique_id, Blob.user_id == user_id))
+        results = await self.db_session.scalars(statement=statement)
+
+        # one or none allows empty results
+        blob = results.one_or_none()
+        return blob
+
+    # Requires a user id to ensure ownership
+    # When after_id is given the page seeks past that id and offset is ignored
+    async def read_personal_many(self, offset: int, limit: int, user_id: int,
+                                 after_id: Optional[int] = None) -> List[Blob]:
+        statement: Select = select(Blob).where(Blob.user_id == user_id).order_by(Blob.id).limit(limit)
+
+        if after_id is not None:
+            statement: Select = statement.where(Blob.id > after_id)
+        else:
+            statement: Select = statement.offset(offset)
+
+        results = await self.db_session.scalars(statement=statement)
+
+        blobs = [r for r in results.all()]
+        return blobs
+
+    # Addresses of the blob chunks in download order
+    async def read_addresses(self, unique_id: int) -> List[str]:
+        statement: Select = select(BlobChunk.address).where(BlobChunk.blob_id == unique_id).order_by(
+            BlobChunk.position)
+        results = await self.db_session.scalars(statement=statement)
+        return list(results.all())
+
+    # Only the name and content type can change, the content is immutable. Returns None when the blob does not exist
+    async def update(self, unique_id: int, blob_data: BlobBase, user_id: Optional[int] = None) -> Optional[Blob]:
+        blob = await self._update_returning(self._ownership(unique_id, user_id), blob_data.dict())
+        await self.db_session.commit()
+        return blob
+
+    # Returns whether a blob was deleted, only one of the user's blobs when a user id is given.
+    # Chunk files stay on disk, the sweep removes those no blob references anymore
+    async def delete(self, unique_id: int, user_id: Optional[int] = None) -> bool:
+        where = self._ownership(unique_id, user_id)
+
+        # Chunks go first since they reference the blob, the ownership check is folded into their delete
+        await self.db_session.execute(delete(BlobChunk).where(BlobChunk.blob_id.in_(select(Blob.id).where(where))))
+        deleted = await self._delete_returning(where) is not None
+        await self.db_session.commit()
+        return deleted
+
+    # Which of the addresses chunks of committed blobs still use
+    async def read_referenced(self, addresses: List[str]) -> Set[str]:
+        statement: Select = select(BlobChunk.address).where(BlobChunk.address.in_(addresses)).distinct()
+        results = await self.db_session.scalars(statement=statement)
+        return set(results.all())
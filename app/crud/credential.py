@@ -1,32 +1,160 @@
-from typing import Optional, List
+from datetime import datetime
+from typing import AsyncIterator, Optional, List, Tuple
 
 from fastapi import Depends
-from sqlalchemy import and_, delete, Delete, select, Select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import and_, ColumnElement, insert, Insert, Row, select, Select, tuple_, update
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.crud.base import BaseCRUD
+from app.core.cypt_utils import RSA_OAEP_SCHEME
+from app.core.notifications import change_notifier
+from app.core.search_index import search_index, UserSearchIndex
+from app.crud.base import BaseCRUD, LoadPolicy, load_options
 from app.dependencies.db import get_db
-from app.models.credential import Credential, CredentialCreate, CredentialUpdate
+from app.models.credential import (Credential, CredentialBatchConflict, CredentialBatchCreated, CredentialBatchItem,
+                                   CredentialBatchRead, CredentialCreate, CredentialTombstone, CredentialUpdate)
+from app.models.site import Site
+from app.models.user import User
+
+
+def _insert_ignoring_conflicts(dialect_name: str) -> Insert:
+    # Rows breaking a unique constraint are skipped instead of aborting the whole statement
+    if dialect_name == "postgresql":
+        return postgresql.insert(Credential).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        return sqlite.insert(Credential).on_conflict_do_nothing()
+    return insert(Credential)
+
+
+# Relationships needed to build a CredentialRead
+READ_LOAD: LoadPolicy = (Credential.site, Credential.owner)
+
+# Columns of a CredentialRead, without the nested site and owner
+CREDENTIAL_ROW_COLUMNS = (Credential.nickname, Credential.email, Credential.username, Credential.encrypted_password,
+                          Credential.favorite, Credential.created_at, Credential.id, Credential.encryption_scheme,
+                          Credential.data_key_id)
+
+# Columns indexed for search, in the order UserSearchIndex.put expects them
+SEARCH_COLUMNS = (Credential.id, Credential.nickname, Credential.username, Credential.email, Site.name)
 
 
 class CredentialCRUD(BaseCRUD[Credential, CredentialCreate, CredentialUpdate]):
+    model = Credential
+
     def __init__(self, db_session: AsyncSession = Depends(get_db)):
         self.db_session = db_session
 
-    async def _commit_refresh(self, instance: Credential):
-        self.db_session.add(instance)
+    # Where clause of a write, restricted to the user's credentials when a user id is given
+    @staticmethod
+    def _ownership(unique_id: int, user_id: Optional[int]) -> ColumnElement[bool]:
+        where = Credential.id == unique_id
+        if user_id is not None:
+            where = and_(where, Credential.user_id == user_id)
+        return where
+
+    async def _next_versions(self, user_id: int, count: int = 1) -> int:
+        """
+        Reserves count change versions of the user and returns the last one.
+        The row lock taken on the user is held until the commit, so the user's changes commit in version order
+        and a client syncing past a version can never miss a lower one committed later
+        """
+        statement = update(User).where(User.id == user_id).values(
+            change_version=User.change_version + count).returning(User.change_version).execution_options(
+            synchronize_session=False)
+        results = await self.db_session.execute(statement=statement)
+        return results.scalar_one()
+
+    async def _attach_relationships(self, credential: Credential, owner: Optional[User]) -> Credential:
+        """
+        Writes answer with a CredentialRead, which needs the related site and owner.
+        The owner is usually the authenticated user and is only read when not given, the site is read by primary key
+        and comes from the identity map when the session already holds it
+        """
+        site = await self.db_session.get(Site, credential.site_id) if credential.site_id is not None else None
+        if owner is None:
+            owner = await self.db_session.get(User, credential.user_id)
+        set_committed_value(credential, "site", site)
+        set_committed_value(credential, "owner", owner)
+        return credential
+
+    # Keeps the owner's search index, when this worker holds one, in step with a committed write
+    @staticmethod
+    def _index(credential: Credential, version: int) -> None:
+        site_name = credential.site.name if credential.site is not None else None
+        search_index.put(credential.user_id, version, credential.id,
+                         (credential.nickname, credential.username, credential.email, site_name))
+
+    async def create(self, credential_data: CredentialCreate, encryption_scheme: int = RSA_OAEP_SCHEME,
+                     data_key_id: Optional[int] = None, owner: Optional[User] = None) -> Credential:
+        version = await self._next_versions(credential_data.user_id)
+        credential = await self._insert_returning({**credential_data.dict(), "encryption_scheme": encryption_scheme,
+                                                   "data_key_id": data_key_id, "version": version})
+        await self._attach_relationships(credential, owner)
         await self.db_session.commit()
-        await self.db_session.refresh(instance)
-        return instance
+        self._index(credential, version)
+        # Published once committed, clients told to sync must find the change
+        await change_notifier.publish(credential.user_id, version)
+        return credential
+
+    async def create_many(self, user_id: int, items: List[CredentialBatchItem], encryption_scheme: int = RSA_OAEP_SCHEME,
+                          data_key_id: Optional[int] = None) -> CredentialBatchRead:
+        """
+        Inserts all items with a single INSERT ... RETURNING in one transaction.
+        Items that would break a constraint are reported as conflicts instead of aborting the batch
+        """
+        batch = CredentialBatchRead()
+
+        # Unknown sites would abort the insert with a foreign key error, so filter them out first
+        site_ids = {item.site_id for item in items if item.site_id is not None}
+        site_names: dict[int, str] = {}
+        if site_ids:
+            results = await self.db_session.execute(select(Site.id, Site.name).where(Site.id.in_(site_ids)))
+            site_names = {site_id: name for site_id, name in results.all()}
+
+        created_at = datetime.utcnow()
+        rows: dict[str, tuple[int, dict]] = {}
+        for index, item in enumerate(items):
+            if item.nickname in rows:
+                detail = "Credential with this nickname is repeated in the batch"
+            elif item.site_id is not None and item.site_id not in site_names:
+                detail = "Site not found"
+            else:
+                rows[item.nickname] = (index, {**item.dict(), "user_id": user_id, "created_at": created_at,
+                                               "encryption_scheme": encryption_scheme, "data_key_id": data_key_id})
+                continue
+            batch.conflicts.append(CredentialBatchConflict(index=index, nickname=item.nickname, detail=detail))
 
-    async def create(self, credential_data: CredentialCreate) -> Credential:
-        credential = Credential(**credential_data.dict())
-        return await self._commit_refresh(credential)
+        if rows:
+            # Rows skipped as conflicts leave gaps in the versions, clients only rely on their order
+            first_version = await self._next_versions(user_id, len(rows)) - len(rows) + 1
+            for version, (_, row) in enumerate(rows.values(), start=first_version):
+                row["version"] = version
+            statement = _insert_ignoring_conflicts(self.db_session.bind.dialect.name).values(
+                [row for _, row in rows.values()]).returning(Credential.id, Credential.nickname)
+            results = await self.db_session.execute(statement=statement)
+            inserted = {nickname: credential_id for credential_id, nickname in results.all()}
+            await self.db_session.commit()
+            for _, row in rows.values():
+                if row["nickname"] in inserted:
+                    search_index.put(user_id, row["version"], inserted[row["nickname"]],
+                                     (row["nickname"], row["username"], row["email"], site_names.get(row["site_id"])))
+            if inserted:
+                await change_notifier.publish(user_id, first_version + len(rows) - 1)
+
+            for nickname, (index, _) in rows.items():
+                if nickname in inserted:
+                    batch.created.append(CredentialBatchCreated(index=index, id=inserted[nickname], nickname=nickname))
+                else:
+                    batch.conflicts.append(CredentialBatchConflict(
+                        index=index, nickname=nickname, detail="Credential with this nickname already exist"))
+
+        batch.conflicts.sort(key=lambda conflict: conflict.index)
+        return batch
 
     # Reads a credential by its unique id regardless of the user, used for admin purposes
-    async def read(self, unique_id: int) -> Optional[Credential]:
-        statement: Select = select(Credential).where(Credential.id == unique_id).options(selectinload(Credential.site))
+    async def read(self, unique_id: int, load: LoadPolicy = ()) -> Optional[Credential]:
+        statement: Select = select(Credential).where(Credential.id == unique_id).options(*load_options(load))
         results = await self.db_session.scalars(statement=statement)
 
         # one or none allows empty results
@@ -42,41 +170,189 @@ class CredentialCRUD(BaseCRUD[Credential, CredentialCreate, CredentialUpdate]):
         return credentials
 
     # Requires a user id to ensure ownership
-    async def read_personal(self, unique_id: int, user_id: int) -> Optional[Credential]:
+    async def read_personal(self, unique_id: int, user_id: int, load: LoadPolicy = READ_LOAD) -> Optional[Credential]:
         statement: Select = select(Credential).where(and_(Credential.id == unique_id, Credential.user_id == user_id)).options(
-                selectinload(Credential.site)).options(selectinload(Credential.owner))
+                *load_options(load))
         results = await self.db_session.scalars(statement=statement)
 
         # one or none allows empty results
         credential = results.one_or_none()
         return credential
 
-    # Requires a user id to ensure ownership
-    async def read_personal_many(self, offset: int, limit: int, user_id: Optional[int], site_id: Optional[int]) -> List[
-            Credential]:
-        statement: Select = select(Credential).where(Credential.user_id == user_id).offset(offset).limit(limit).options(
-            selectinload(Credential.site))
+    # When after_id is given the page seeks past that id on the (user_id, id) index and offset is ignored
+    @staticmethod
+    def _personal_page(statement: Select, offset: int, limit: int, user_id: Optional[int], site_id: Optional[int],
+                       after_id: Optional[int]) -> Select:
+        statement: Select = statement.where(Credential.user_id == user_id).order_by(Credential.id).limit(limit)
+
+        if after_id is not None:
+            statement: Select = statement.where(Credential.id > after_id)
+        else:
+            statement: Select = statement.offset(offset)
 
         # Site id allows for additional filtering when retrieving credentials
         if site_id:
             statement: Select = statement.where(Credential.site_id == site_id)
+        return statement
 
+    # Requires a user id to ensure ownership
+    async def read_personal_many(self, offset: int, limit: int, user_id: Optional[int], site_id: Optional[int],
+                                 after_id: Optional[int] = None, load: LoadPolicy = READ_LOAD) -> List[Credential]:
+        statement: Select = self._personal_page(select(Credential).options(*load_options(load)), offset, limit,
+                                                user_id, site_id, after_id)
         results = await self.db_session.scalars(statement=statement)
 
         credentials = [r for r in results.all()]
         return credentials
 
-    async def update(self, unique_id: int, credential_data: CredentialUpdate) -> Credential:
-        credential = await self.read(unique_id=unique_id)
-        assert credential is not None, f"Credential {unique_id} not found"
-        values = credential_data.dict()
+    # Requires a user id to ensure ownership
+    async def read_personal_rows(self, offset: int, limit: int, user_id: Optional[int], site_id: Optional[int],
+                                 after_id: Optional[int] = None) -> List[Row]:
+        """
+        Same page as read_personal_many as plain rows with the site columns joined in, no ORM objects are built.
+        Site columns are labelled site_id, site_name and site_url, they are None for credentials without a site
+        """
+        statement: Select = select(*CREDENTIAL_ROW_COLUMNS, Site.id.label("site_id"), Site.name.label("site_name"),
+                                   Site.url.label("site_url")).outerjoin(Site, Credential.site_id == Site.id)
+        statement: Select = self._personal_page(statement, offset, limit, user_id, site_id, after_id)
+        results = await self.db_session.execute(statement=statement)
+        return list(results.all())
+
+    # Requires a user id to ensure ownership
+    async def stream_personal(self, user_id: int, batch_size: int = 500) -> AsyncIterator[Credential]:
+        """
+        Yields every credential of the user through a server-side cursor, holding at most batch_size rows in memory
+        """
+        statement: Select = select(Credential).where(Credential.user_id == user_id).order_by(Credential.id).execution_options(
+            yield_per=batch_size)
+        results = await self.db_session.stream_scalars(statement=statement)
+        async for partition in results.partitions():
+            for credential in partition:
+                yield credential
+            # Streamed rows are not needed once serialized, keep the identity map from growing with the vault
+            for credential in partition:
+                self.db_session.expunge(credential)
+
+    # Owner whose change version a write takes, admin writes without a user id have to look it up
+    async def _write_owner(self, unique_id: int, user_id: Optional[int]) -> Optional[int]:
+        if user_id is not None:
+            return user_id
+        return await self.db_session.scalar(select(Credential.user_id).where(Credential.id == unique_id))
+
+    # With a user id only a credential of that user is updated, returns None when there was no such credential
+    async def update(self, unique_id: int, credential_data: CredentialUpdate, user_id: Optional[int] = None,
+                     owner: Optional[User] = None) -> Optional[Credential]:
+        owner_id = await self._write_owner(unique_id, user_id)
+        if owner_id is None:
+            return None
 
-        for k, v in values.items():
-            setattr(credential, k, v)
+        version = await self._next_versions(owner_id)
+        credential = await self._update_returning(self._ownership(unique_id, owner_id),
+                                                  {**credential_data.dict(), "version": version})
+        if credential is None:
+            # Nothing matched, the reserved version is left as a gap
+            await self.db_session.commit()
+            return None
 
-        return await self._commit_refresh(credential)
+        await self._attach_relationships(credential, owner)
+        await self.db_session.commit()
+        self._index(credential, version)
+        await change_notifier.publish(owner_id, version)
+        return credential
+
+    # With a user id only a credential of that user is deleted, returns whether a credential was deleted
+    async def delete(self, unique_id: int, user_id: Optional[int] = None) -> bool:
+        owner_id = await self._write_owner(unique_id, user_id)
+        if owner_id is None:
+            return False
 
-    async def delete(self, unique_id: int) -> None:
-        statement: Delete = delete(Credential).where(Credential.id == unique_id)
-        await self.db_session.execute(statement=statement)
+        version = await self._next_versions(owner_id)
+        deleted = await self._delete_returning(self._ownership(unique_id, owner_id))
+        if deleted is None:
+            await self.db_session.commit()
+            return False
+
+        await self.db_session.execute(insert(CredentialTombstone).values(
+            credential_id=unique_id, user_id=owner_id, version=version))
         await self.db_session.commit()
+        search_index.remove(owner_id, version, unique_id)
+        await change_notifier.publish(owner_id, version)
+        return True
+
+    # Requires a user id to ensure ownership
+    async def read_changes(self, user_id: int, after: Optional[Tuple[int, int]],
+                           limit: int) -> Tuple[List[Credential], List[CredentialTombstone], bool]:
+        """
+        Returns the credentials written and the tombstones left after the (version, id) position, oldest first and
+        at most limit of them altogether, and whether more changes are waiting. Both reads seek on the
+        (user_id, version) indexes, so the cost follows the number of changes rather than the size of the vault
+        """
+        credentials: Select = select(Credential).where(Credential.user_id == user_id).order_by(
+            Credential.version, Credential.id).limit(limit + 1)
+        tombstones: Select = select(CredentialTombstone).where(CredentialTombstone.user_id == user_id).order_by(
+            CredentialTombstone.version).limit(limit + 1)
+        if after is not None:
+            credentials: Select = credentials.where(tuple_(Credential.version, Credential.id) > tuple_(*after))
+            tombstones: Select = tombstones.where(CredentialTombstone.version > after[0])
+
+        # Versions only repeat on credentials written before versioning, those all sit at 0 before any tombstone
+        changes = sorted([*(await self.db_session.scalars(statement=credentials)).all(),
+                          *(await self.db_session.scalars(statement=tombstones)).all()],
+                         key=lambda change: (change.version, isinstance(change, CredentialTombstone)))
+        more = len(changes) > limit
+        changes = changes[:limit]
+        return ([change for change in changes if isinstance(change, Credential)],
+                [change for change in changes if isinstance(change, CredentialTombstone)], more)
+
+    # Requires a user id to ensure ownership
+    async def search(self, user_id: int, query: str, limit: int) -> List[int]:
+        """
+        Ids of the user's credentials whose nickname, username, email or site name contain query, best matches first.
+        The index is built from the whole vault on first use. Afterwards only the credentials written and deleted
+        since the change version it reflects are read, which is nothing when every write went through this worker
+        """
+        current_version = await self.db_session.scalar(select(User.change_version).where(User.id == user_id))
+        if current_version is None:
+            return []
+
+        index = search_index.get(user_id)
+        if index is None:
+            index = UserSearchIndex(version=current_version)
+            await self._load_search_entries(index, user_id, after_version=None)
+            search_index.store(user_id, index)
+        elif index.version < current_version:
+            await self._load_search_entries(index, user_id, after_version=index.version)
+            index.version = current_version
+
+        return index.search(query, limit)
+
+    async def _load_search_entries(self, index: UserSearchIndex, user_id: int, after_version: Optional[int]) -> None:
+        # Writes committed while reading carry a version above the one the index is set to, so they are read again
+        # by the next search, applying a change twice leaves the same index
+        statement: Select = select(*SEARCH_COLUMNS).outerjoin(Site, Credential.site_id == Site.id).where(
+            Credential.user_id == user_id)
+        if after_version is not None:
+            statement: Select = statement.where(Credential.version > after_version)
+            tombstones: Select = select(CredentialTombstone.credential_id).where(and_(
+                CredentialTombstone.user_id == user_id, CredentialTombstone.version > after_version))
+            for credential_id in await self.db_session.scalars(statement=tombstones):
+                index.remove(credential_id)
+
+        results = await self.db_session.execute(statement=statement)
+        for credential_id, *fields in results.all():
+            index.put(credential_id, fields)
+
+    # Requires a user id to ensure ownership
+    async def read_personal_rows_by_ids(self, user_id: int, unique_ids: List[int]) -> List[Row]:
+        """
+        Rows of read_personal_rows for the given credentials, in the order of unique_ids. Ids of credentials the user
+        does not own or that no longer exist are left out
+        """
+        if not unique_ids:
+            return []
+        statement: Select = select(*CREDENTIAL_ROW_COLUMNS, Site.id.label("site_id"), Site.name.label("site_name"),
+                                   Site.url.label("site_url")).outerjoin(Site, Credential.site_id == Site.id).where(
+            and_(Credential.user_id == user_id, Credential.id.in_(unique_ids)))
+        results = await self.db_session.execute(statement=statement)
+        rows = {row.id: row for row in results.all()}
+        return [rows[unique_id] for unique_id in unique_ids if unique_id in rows]
@@ -0,0 +1,68 @@
+from datetime import datetime
+from typing import Optional, List
+
+from fastapi import Depends
+from sqlalchemy import and_, select, Select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.crud.base import BaseCRUD
+from app.dependencies.db import get_db
+from app.models.data_key import DataKey
+
+
+class DataKeyCRUD(BaseCRUD[DataKey, DataKey, DataKey]):
+    model = DataKey
+
+    def __init__(self, db_session: AsyncSession = Depends(get_db)):
+        self.db_session = db_session
+
+    async def create(self, data_key: DataKey) -> DataKey:
+        record = await self._insert_returning(data_key.model_dump(exclude={"id"}))
+        await self.db_session.commit()
+        return record
+
+    async def read(self, unique_id: int) -> Optional[DataKey]:
+        statement: Select = select(DataKey).where(DataKey.id == unique_id)
+        results = await self.db_session.scalars(statement=statement)
+
+        # one or none allows empty results
+        data_key = results.one_or_none()
+        return data_key
+
+    # Requires a user id to ensure ownership
+    async def read_personal(self, unique_id: int, user_id: int) -> Optional[DataKey]:
+        statement: Select = select(DataKey).where(and_(DataKey.id == unique_id, DataKey.user_id == user_id))
+        results = await self.db_session.scalars(statement=statement)
+
+        # one or none allows empty results
+        data_key = results.one_or_none()
+        return data_key
+
+    async def read_many(self, offset: int, limit: int) -> List[DataKey]:
+        statement: Select = select(DataKey).order_by(DataKey.id).offset(offset).limit(limit)
+        results = await self.db_session.scalars(statement=statement)
+
+        data_keys = [r for r in results.all()]
+        return data_keys
+
+    async def update(self, unique_id: int, data: DataKey) -> Optional[DataKey]:
+        """
+        Rotates a data key. The key is retired and data is stored as the owner's new key in the same transaction,
+        the retired key is kept so values it encrypted stay readable. Returns the new key, None when the key does not
+        exist or was already retired, e.g. by another worker rotating it first
+        """
+        retired = await self._update_returning(and_(DataKey.id == unique_id, DataKey.retired_at.is_(None)),
+                                               {"retired_at": datetime.utcnow()})
+        if retired is None:
+            await self.db_session.commit()
+            return None
+
+        record = await self._insert_returning({"wrapped_key": data.wrapped_key, "user_id": retired.user_id})
+        await self.db_session.commit()
+        return record
+
+    # Returns whether a data key was deleted
+    async def delete(self, unique_id: int) -> bool:
+        deleted = await self._delete_returning(DataKey.id == unique_id)
+        await self.db_session.commit()
+        return deleted is not None
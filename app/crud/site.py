@@ -1,63 +1,136 @@
-from typing import Optional, List
+from typing import Optional, List, Tuple
 
 from fastapi import Depends
-from sqlalchemy import delete, select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.crud.base import BaseCRUD
+from app.core.notifications import change_notifier
+from app.core.site_matcher import site_matcher
+from app.crud.base import BaseCRUD, LoadPolicy, load_options
 from app.dependencies.db import get_db
-from app.models.site import Site, SiteCreate, SiteUpdate
+from app.models.credential import Credential
+from app.models.site import Site, SiteCreate, SiteRead, SiteSimpleRead, SiteUpdate
+from app.models.user import User
 
 
 class SiteCRUD(BaseCRUD[Site, SiteCreate, SiteUpdate]):
+    model = Site
+
     def __init__(self, db_session: AsyncSession = Depends(get_db)):
         self.db_session = db_session
 
-    async def _commit_refresh(self, instance: Site):
-        self.db_session.add(instance)
-        await self.db_session.commit()
-        await self.db_session.refresh(instance)
-        return instance
-
     async def create(self, site_data: SiteCreate) -> Site:
-        site = Site(**site_data.dict())
-        return await self._commit_refresh(site)
+        site = await self._insert_returning(site_data.dict())
+        await self.db_session.commit()
+        site_matcher.put(SiteRead(id=site.id, name=site.name, url=site.url))
+        return site
 
-    async def read(self, unique_id: int) -> Optional[Site]:
-        statement = select(Site).where(Site.id == unique_id).options(selectinload(Site.credentials))
+    # Relationships are only loaded when listed in load, e.g. load=(Site.credentials,)
+    async def read(self, unique_id: int, load: LoadPolicy = ()) -> Optional[Site]:
+        statement = select(Site).where(Site.id == unique_id).options(*load_options(load))
         results = await self.db_session.scalars(statement=statement)
 
         # Scalar one or none allows empty results
         site: Site = results.one_or_none()
         return site
 
-    async def read_by_name(self, name: str) -> Optional[Site]:
-        statement = select(Site).where(Site.name == name).options(selectinload(Site.credentials))
+    async def read_by_name(self, name: str, load: LoadPolicy = ()) -> Optional[Site]:
+        statement = select(Site).where(Site.name == name).options(*load_options(load))
         results = await self.db_session.scalars(statement=statement)
 
         # Scalar one or none allows empty results
         site: Site = results.one_or_none()
         return site
 
-    async def read_many(self, offset: int, limit: int, group_id: Optional[int] = None) -> List[Site]:
-        statement = select(Site).offset(offset).limit(limit).options(selectinload(Site.credentials))
+    async def exists_by_name(self, name: str) -> bool:
+        statement = select(Site.id).where(Site.name == name).limit(1)
+        results = await self.db_session.scalars(statement=statement)
+        return results.first() is not None
+
+    # When after_id is given the page seeks past that id on the primary key and offset is ignored
+    async def read_many(self, offset: int, limit: int, group_id: Optional[int] = None,
+                        after_id: Optional[int] = None, load: LoadPolicy = ()) -> List[Site]:
+        statement = select(Site).order_by(Site.id).limit(limit).options(*load_options(load))
+
+        if after_id is not None:
+            statement = statement.where(Site.id > after_id)
+        else:
+            statement = statement.offset(offset)
+
         results = await self.db_session.scalars(statement=statement)
 
         sites: List[Site] = [r for r in results.all()]
         return sites
 
-    async def update(self, unique_id: int, site_data: SiteUpdate) -> Site:
-        site = await self.read(unique_id=unique_id)
-        assert site is not None, f"Site {unique_id} not found"
-        values = site_data.dict()
+    # Projection only listing, selects just the columns of SiteSimpleRead
+    async def read_many_reduced(self, offset: int, limit: int, after_id: Optional[int] = None) -> List[SiteSimpleRead]:
+        statement = select(Site.id, Site.name).order_by(Site.id).limit(limit)
+
+        if after_id is not None:
+            statement = statement.where(Site.id > after_id)
+        else:
+            statement = statement.offset(offset)
 
-        for k, v in values.items():
-            setattr(site, k, v)
+        results = await self.db_session.execute(statement=statement)
+
+        sites: List[SiteSimpleRead] = [SiteSimpleRead(id=r.id, name=r.name) for r in results.all()]
+        return sites
+
+    async def _touch_credentials(self, unique_id: int) -> List[Tuple[int, int]]:
+        """
+        Gives every credential of the site a new change version of its owner and returns the (owner id, version)
+        pairs. Credentials are read with their site name, so search indexes and syncing clients of every worker pick
+        the change up through the version like any other write. The owners stay locked until the commit
+        """
+        owners = await self.db_session.execute(
+            update(User).where(User.id.in_(select(Credential.user_id).where(Credential.site_id == unique_id)))
+            .values(change_version=User.change_version + 1).returning(User.id, User.change_version)
+            .execution_options(synchronize_session=False))
+        versions = [(owner_id, version) for owner_id, version in owners.all()]
+        if versions:
+            await self.db_session.execute(
+                update(Credential).where(Credential.site_id == unique_id)
+                .values(version=select(User.change_version).where(User.id == Credential.user_id).scalar_subquery())
+                .execution_options(synchronize_session=False))
+        return versions
+
+    # Returns None when the site does not exist
+    async def update(self, unique_id: int, site_data: SiteUpdate) -> Optional[Site]:
+        site = await self._update_returning(Site.id == unique_id, site_data.dict())
+        if site is None:
+            await self.db_session.commit()
+            return None
+
+        versions = await self._touch_credentials(unique_id)
+        await self.db_session.commit()
+        site_matcher.put(SiteRead(id=site.id, name=site.name, url=site.url))
+        for owner_id, version in versions:
+            await change_notifier.publish(owner_id, version)
+        return site
 
-        return await self._commit_refresh(site)
+    # Returns whether a site was deleted
+    async def delete(self, unique_id: int) -> bool:
+        versions = await self._touch_credentials(unique_id)
+        deleted = await self._delete_returning(Site.id == unique_id)
+        if deleted is None:
+            await self.db_session.rollback()
+            return False
 
-    async def delete(self, unique_id: int) -> None:
-        statement = delete(Site).where(Site.id == unique_id)
-        await self.db_session.execute(statement=statement)
         await self.db_session.commit()
+        site_matcher.remove(unique_id)
+        for owner_id, version in versions:
+            await change_notifier.publish(owner_id, version)
+        return True
+
+    async def match(self, url: str) -> Optional[SiteRead]:
+        """
+        Site of the page at url, see SiteMatcher. Answered from memory, the catalog is only read when the matcher
+        is built or has expired
+        """
+        if site_matcher.expired():
+            await site_matcher.rebuild(self._read_catalog)
+        return site_matcher.match(url)
+
+    async def _read_catalog(self) -> List[SiteRead]:
+        results = await self.db_session.execute(select(Site.id, Site.name, Site.url))
+        return [SiteRead(id=r.id, name=r.name, url=r.url) for r in results.all()]
@@ -1,33 +1,32 @@
 from typing import Optional, List
 
 from fastapi import Depends
-from sqlalchemy import delete, Delete, select, Select
+from sqlalchemy import select, Select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.core.auth_utils import get_hashed_password, verify_password
+from app.core.auth_utils import get_hashed_password_async, verify_password_async
+from app.core.cypt_utils import data_key_ring, public_key_cache
+from app.core.search_index import search_index
+from app.core.user_cache import user_cache
 from app.crud.base import BaseCRUD
 from app.dependencies.db import get_db
 from app.models.user import User, UserUpdate, UserCreateInternal
 
 
 class UserCRUD(BaseCRUD[User, UserCreateInternal, UserUpdate]):
+    model = User
+
     def __init__(self, db_session: AsyncSession = Depends(get_db)):
         self.db_session = db_session
 
-    # Private helper method to commit and refresh the instance
-    async def _commit_refresh(self, instance: User):
-        self.db_session.add(instance)
-        await self.db_session.commit()
-        await self.db_session.refresh(instance)
-        return instance
-
     async def create(self, user_data: UserCreateInternal) -> User:
         # Hash the password before saving so the server doesn't store plaintext passwords
-        user = User(
+        user = await self._insert_returning({
             **user_data.dict(exclude={"password"}),
-            hashed_password=get_hashed_password(user_data.password)
-        )
-        return await self._commit_refresh(user)
+            "hashed_password": await get_hashed_password_async(user_data.password)
+        })
+        await self.db_session.commit()
+        return user
 
     async def read(self, unique_id: int) -> Optional[User]:
         statement: Select = select(User).where(User.id == unique_id)
@@ -60,34 +59,48 @@ class UserCRUD(BaseCRUD[User, UserCreateInternal, UserUpdate]):
         users = [r for r in results.all()]
         return users
 
-    # TODO: Use Update sqlalchemy method
-    async def update(self, unique_id: int, user_data: UserUpdate) -> User:
-        user = await self.read(unique_id=unique_id)
-        assert user is not None, f"User {unique_id} not found"
-
-        # Get only the values that are set and update the user object
+    # Returns None when the user does not exist
+    async def update(self, unique_id: int, user_data: UserUpdate) -> Optional[User]:
+        # Get only the values that are set
         values = user_data.dict(exclude_unset=True)
 
         # If the password is being updated, it needs to be hashed
         if 'password' in values:
-            hashed_password = get_hashed_password(values['password'])
+            hashed_password = await get_hashed_password_async(values['password'])
             del values['password']
             values['hashed_password'] = hashed_password
 
-        for k, v in values.items():
-            setattr(user, k, v)
+        # RETURNING only gives the new username, the previous one is only read when it is about to change
+        previous_username = None
+        if 'username' in values:
+            previous_username = await self.db_session.scalar(select(User.username).where(User.id == unique_id))
 
-        return await self._commit_refresh(user)
+        user = await self._update_returning(User.id == unique_id, values)
+        await self.db_session.commit()
 
-    async def delete(self, unique_id: int) -> None:
-        statement: Delete = delete(User).where(User.id == unique_id)
-        await self.db_session.execute(statement=statement)
+        # Cached copies of the user and its parsed key must not outlive a change
+        public_key_cache.invalidate(unique_id)
+        data_key_ring.invalidate(unique_id)
+        for username in {previous_username, user.username if user else None} - {None}:
+            await user_cache.invalidate(username)
+        return user
+
+    # Returns whether a user was deleted
+    async def delete(self, unique_id: int) -> bool:
+        deleted = await self._delete_returning(User.id == unique_id, User.username)
         await self.db_session.commit()
 
+        public_key_cache.invalidate(unique_id)
+        data_key_ring.invalidate(unique_id)
+        search_index.drop(unique_id)
+        if deleted is not None:
+            await user_cache.invalidate(deleted.username)
+        return deleted is not None
+
     async def authenticate(self, username: str, password: str) -> Optional[User]:
         user = await self.read_by_username(username=username)
         if not user:
             return None
-        if not verify_password(password, user.hashed_password):
+        if not await verify_password_async(password, user.hashed_password):
             return None
         return user
@@ -1,13 +1,120 @@
+import time
+from typing import Any, Optional
+
 import config
+from app.core.metrics import instrument_engine
 
+from sqlalchemy import Connection, delete, func, insert, inspect, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlmodel import SQLModel  # noqa  # Imported here to gather model metadata
 
+from app.models.schema_version import SchemaVersion
+
+# Bump whenever a table or column is added so every database is brought up to date on the next boot
+SCHEMA_VERSION = 3
+# Serializes schema upgrades of workers booting at the same time on PostgreSQL
+SCHEMA_LOCK_KEY = 4545
+
+
+def add_missing_columns(connection: Connection) -> None:
+    """
+    Adds the columns and indexes models gained after their table was created, create_all only creates whole tables.
+    New columns must be nullable or have a server default, which existing rows take. Foreign keys are not added
+    """
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} " \
+                  f"{column.type.compile(dialect=connection.dialect)}"
+            if column.server_default is not None:
+                default = column.server_default.arg
+                ddl += f" DEFAULT {getattr(default, 'text', default)}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+            connection.execute(text(ddl))
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool recording how long checkouts wait for a connection, including the ones that time out
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def recreate(self) -> "TimedQueuePool":
+        # Engine disposal builds a new pool, the counters keep accumulating on it
+        pool = super().recreate()
+        pool.checkouts, pool.timeouts = self.checkouts, self.timeouts
+        pool.wait_seconds_total, pool.wait_seconds_max = self.wait_seconds_total, self.wait_seconds_max
+        return pool
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": max(0, self.overflow()),
+            "max_overflow": self._max_overflow,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+        }
+
+
+def engine_options(url: str) -> dict[str, Any]:
+    """
+    Pool and driver settings read from config, sized per process so the total is this times the worker count
+    """
+    options: dict[str, Any] = {
+        "poolclass": TimedQueuePool,
+        "pool_size": getattr(config, "DB_POOL_SIZE", 5),
+        "max_overflow": getattr(config, "DB_MAX_OVERFLOW", 10),
+        "pool_timeout": getattr(config, "DB_POOL_TIMEOUT", 30),
+        "pool_recycle": getattr(config, "DB_POOL_RECYCLE", -1),
+        "pool_pre_ping": getattr(config, "DB_POOL_PRE_PING", False),
+    }
+    if make_url(url).get_driver_name() == "asyncpg":
+        # Prepared statements are cached per connection, by SQLAlchemy and by asyncpg itself
+        options["connect_args"] = {
+            "prepared_statement_cache_size": getattr(config, "DB_STATEMENT_CACHE_SIZE", 100),
+            "statement_cache_size": getattr(config, "DB_STATEMENT_CACHE_SIZE", 100),
+        }
+    return options
+
 
 class PasswordDB:
     def __init__(self) -> None:
         # Maintains the connection pool and executes SQL queries
-        self.engine: AsyncEngine = create_async_engine(config.DB_URL)
+        self.engine: AsyncEngine = create_async_engine(config.DB_URL, **engine_options(config.DB_URL))
+        instrument_engine(self.engine)
         # Used to manage independent sessions for each request. This allows the program to stage and buffer
         # transactions allowing for asynchronous execution
         self.async_session: async_sessionmaker[AsyncSession] = async_sessionmaker(
@@ -15,8 +122,51 @@ class PasswordDB:
         )
 
     async def initiate_db(self) -> None:
-        async with self.engine.begin() as conn:
-            if config.TESTING:
+        if config.TESTING:
+            async with self.engine.begin() as conn:
                 # While testing this will drop and create all tables at startup
                 await conn.run_sync(SQLModel.metadata.drop_all)
+                await conn.run_sync(SQLModel.metadata.create_all)
+                await conn.execute(insert(SchemaVersion).values(version=SCHEMA_VERSION))
+            return
+
+        # A single primary key read on every boot, the catalog is only inspected when the schema is behind
+        version = await self.schema_version()
+        if version is None or version < SCHEMA_VERSION:
+            version = await self.upgrade_schema()
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {version} is newer than this code ({SCHEMA_VERSION})")
+
+    async def schema_version(self) -> Optional[int]:
+        try:
+            async with self.engine.connect() as conn:
+                return await conn.scalar(select(func.max(SchemaVersion.version)))
+        except DBAPIError:
+            # Databases created before versioning have no schema_version table
+            return None
+
+    async def upgrade_schema(self) -> int:
+        """
+        Creates the missing tables, columns and indexes and records SCHEMA_VERSION, returns the version found once
+        the lock is held
+        """
+        async with self.engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
             await conn.run_sync(SQLModel.metadata.create_all)
+            await conn.run_sync(add_missing_columns)
+
+            # Another worker may have finished the upgrade while this one waited for the lock
+            version = await conn.scalar(select(func.max(SchemaVersion.version)))
+            if version is None or version < SCHEMA_VERSION:
+                await conn.execute(delete(SchemaVersion))
+                await conn.execute(insert(SchemaVersion).values(version=SCHEMA_VERSION))
+                version = SCHEMA_VERSION
+        return version
+
+    def pool_stats(self) -> dict[str, Any]:
+        return self.engine.pool.stats()
+
+    async def close(self) -> None:
+        # Closes every pooled connection, checked out connections are closed when returned
+        await self.engine.dispose()
@@ -2,11 +2,10 @@ from typing import Optional
 
 from fastapi import Depends, HTTPException
 from fastapi import status
-
-from jose import JWTError, jwt
 from pydantic import BaseModel
 
 from app.core.auth_utils import oauth2_scheme
+from app.core.user_cache import user_cache
 from app.crud.user import UserCRUD
 from app.models.user import User
 from config import SECRET_KEY, ALGORITHM
@@ -22,6 +21,9 @@ async def get_current_user(token: str = Depends(oauth2_scheme), user_crud: UserC
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # Imported here so jose stays off the startup path, it is cached in sys.modules after the first request
+    from jose import JWTError, jwt
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -30,7 +32,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme), user_crud: UserC
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user: Optional[User] = await user_crud.read_by_username(username=token_data.username)
+
+    # Resolved users are cached until the token expires, so most requests never reach the database
+    user: Optional[User] = await user_cache.get(token_data.username)
     if user is None:
-        raise credentials_exception
+        user = await user_crud.read_by_username(username=token_data.username)
+        if user is None:
+            raise credentials_exception
+        await user_cache.set(user, token_expires_at=payload.get("exp", 0))
     return user
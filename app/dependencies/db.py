@@ -1,7 +1,7 @@
 from typing import AsyncGenerator
 
 from fastapi import Request
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 
 async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
@@ -10,3 +10,10 @@ async def get_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
     """
     async with request.app.state.DB.async_session() as session:
         yield session
+
+
+def get_session_maker(request: Request) -> async_sessionmaker[AsyncSession]:
+    """
+    Returns the session factory, used by streaming responses which outlive the sessions yielded by get_db
+    """
+    return request.app.state.DB.async_session
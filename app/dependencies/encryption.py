@@ -0,0 +1,66 @@
+from typing import TYPE_CHECKING, Tuple
+
+from fastapi import Depends
+
+import config
+from app.core.cypt_utils import (CredentialEncryptor, ENVELOPE_SCHEME, RSA_OAEP_SCHEME, data_key_ring,
+                                 generate_data_key, public_key_cache, wrap_data_key)
+from app.crud.data_key import DataKeyCRUD
+from app.dependencies.auth import get_current_user
+from app.models.data_key import DataKey
+from app.models.user import User
+
+if TYPE_CHECKING:
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+
+
+def get_encryption_key(user: User) -> "RSAPublicKey":
+    # Keyed by the fingerprint of the stored PEM, a changed key is parsed again instead of served stale
+    return public_key_cache.get_or_load(user.id, user.public_key)
+
+
+async def current_data_key(user: User, encryption_key: "RSAPublicKey", data_key_crud: DataKeyCRUD) -> Tuple[int, bytes]:
+    """
+    Returns the (data key id, data key) the user's new secrets are encrypted with, creating one when needed
+    """
+    # The data key is wrapped with RSA once and then reused for every secret until it is rotated
+    current_key = data_key_ring.get(user.id, user.public_key)
+    if current_key is None:
+        data_key = generate_data_key()
+        new_key = DataKey(user_id=user.id, wrapped_key=wrap_data_key(encryption_key, data_key))
+        # A key that aged out is rotated, so the database tells which keys still encrypt
+        expired_id = data_key_ring.pop_expired(user.id, user.public_key)
+        record = await data_key_crud.update(expired_id, new_key) if expired_id is not None else None
+        if record is None:
+            record = await data_key_crud.create(new_key)
+        data_key_ring.put(user.id, user.public_key, record.id, data_key)
+        current_key = record.id, data_key
+    return current_key
+
+
+async def get_credential_encryptor(
+        user: User = Depends(get_current_user),
+        data_key_crud: DataKeyCRUD = Depends(DataKeyCRUD)
+) -> CredentialEncryptor:
+    """
+    Yields the encryptor for the current user's new credentials, used by FastApi "Depends".
+    The scheme is chosen by ENCRYPTION_SCHEME, existing credentials keep the scheme they were written with
+    """
+    encryption_key = get_encryption_key(user)
+    if getattr(config, "ENCRYPTION_SCHEME", RSA_OAEP_SCHEME) != ENVELOPE_SCHEME:
+        return CredentialEncryptor(RSA_OAEP_SCHEME, key=encryption_key, key_material=user.public_key)
+
+    data_key_id, data_key = await current_data_key(user, encryption_key, data_key_crud)
+    return CredentialEncryptor(ENVELOPE_SCHEME, key=data_key, key_material=data_key, data_key_id=data_key_id)
+
+
+async def get_data_key(
+        user: User = Depends(get_current_user),
+        data_key_crud: DataKeyCRUD = Depends(DataKeyCRUD)
+) -> Tuple[int, bytes]:
+    """
+    Yields the current user's (data key id, data key), used by FastApi "Depends".
+    Blobs are always envelope encrypted, RSA cannot encrypt more than a few hundred bytes
+    """
+    encryption_key = get_encryption_key(user)
+    return await current_data_key(user, encryption_key, data_key_crud)
@@ -1,14 +1,69 @@
-from typing import AsyncGenerator
+import time
+from typing import Any, AsyncGenerator
 
-from aioredis import Redis, from_url
+from aioredis import BlockingConnectionPool, Redis
+from aioredis.client import Pipeline
+from fastapi import Request
 
 import config
+from app.core.metrics import REDIS_DURATION
 
 
-async def get_redis() -> AsyncGenerator[Redis, None]:
+class InstrumentedPipeline(Pipeline):
+    # Queued commands are sent together, the whole round trip is timed as one PIPELINE sample
+    async def execute(self, raise_on_error: bool = True) -> list:
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error=raise_on_error)
+        finally:
+            REDIS_DURATION.labels("PIPELINE").observe(time.perf_counter() - start)
+
+
+class InstrumentedRedis(Redis):
     """
-    Yields redis object, used by FastApi "Depends"
+    Redis client recording the duration of every command in REDIS_DURATION
     """
 
-    session = from_url(config.REDIS_URL)
-    yield session
+    async def execute_command(self, *args: Any, **options: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_DURATION.labels(str(args[0]).upper()).observe(time.perf_counter() - start)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Any = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+def create_redis_pool() -> BlockingConnectionPool:
+    """
+    Builds the connection pool shared by every request of the application.
+    Requests wait up to REDIS_POOL_TIMEOUT seconds for a free connection once all are in use
+    """
+    return BlockingConnectionPool.from_url(
+        config.REDIS_URL,
+        max_connections=getattr(config, "REDIS_POOL_SIZE", 50),
+        timeout=getattr(config, "REDIS_POOL_TIMEOUT", 5),
+        socket_timeout=getattr(config, "REDIS_SOCKET_TIMEOUT", 5),
+        socket_connect_timeout=getattr(config, "REDIS_CONNECT_TIMEOUT", 5),
+    )
+
+
+def redis_pool_stats(pool: BlockingConnectionPool) -> dict[str, Any]:
+    # Idle connections sit in the queue, empty slots are placeholders for connections not opened yet
+    idle = sum(1 for connection in pool.pool._queue if connection is not None)
+    created = len(pool._connections)
+    return {
+        "max_connections": pool.max_connections,
+        "created": created,
+        "idle": idle,
+        "in_use": created - idle,
+        "waiting": len(pool.pool._getters),
+    }
+
+
+async def get_redis(request: Request) -> AsyncGenerator[Redis, None]:
+    """
+    Yields redis object backed by the application connection pool, used by FastApi "Depends"
+    """
+    yield request.app.state.REDIS
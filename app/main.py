@@ -1,29 +1,90 @@
-from fastapi import FastAPI
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, List, Set
+
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
+import config
 from app.api.base import api_router
+from app.core.auth_utils import hashing_pool
+from app.core.blob_store import chunk_sweeper
+from app.core.cypt_utils import encryption_pool, key_pair_pool
+from app.core.metrics import MetricsMiddleware
+from app.core.notifications import change_notifier
+from app.core.pagination import NEXT_CURSOR_HEADER
+from app.core.user_cache import user_cache
+from app.core.warmup import warm_up
+from app.core.workers import WorkerPoolFull
+from app.crud.blob import BlobCRUD
 from app.database import PasswordDB
+from app.dependencies.redis import InstrumentedRedis, create_redis_pool
+
+# Selected with the PYVAULT_PROFILE environment variable, gunicorn_conf.py reads the same variable
+PRODUCTION = os.environ.get("PYVAULT_PROFILE", "development") == "production"
+
+
+async def worker_pool_full_handler(request: Request, exc: WorkerPoolFull) -> JSONResponse:
+    # The server is saturated, ask the client to back off instead of queueing without bounds
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+@asynccontextmanager
+async def lifespan(application: FastAPI) -> AsyncGenerator[None, None]:
+    application.state.DB = PasswordDB()
+    await application.state.DB.initiate_db()
+    application.state.REDIS = InstrumentedRedis(connection_pool=create_redis_pool())
+    if getattr(config, "USER_CACHE_SHARED", False):
+        user_cache.redis = application.state.REDIS
+    if getattr(config, "CHANGE_EVENTS", True):
+        change_notifier.redis = application.state.REDIS
+        await change_notifier.start()
+    key_pair_pool.start()
+
+    async def referenced_chunks(addresses: List[str]) -> Set[str]:
+        async with application.state.DB.async_session() as session:
+            return await BlobCRUD(session).read_referenced(addresses)
+
+    chunk_sweeper.start(referenced_chunks)
+
+    # Lifespan startup completes before the worker accepts connections
+    if getattr(config, "WARM_UP", PRODUCTION):
+        await warm_up(application,
+                      db_connections=getattr(config, "WARM_UP_DB_CONNECTIONS", getattr(config, "DB_POOL_SIZE", 5)),
+                      redis_connections=getattr(config, "WARM_UP_REDIS_CONNECTIONS", 5))
+
+    yield
+
+    await change_notifier.stop()
+    await chunk_sweeper.stop()
+    hashing_pool.shutdown()
+    key_pair_pool.shutdown()
+    encryption_pool.shutdown()
+    await application.state.REDIS.connection_pool.disconnect()
+    await application.state.DB.close()
 
 
 def build_app() -> FastAPI:
-    application = FastAPI(title="Password Manager", debug=True, version="1.0")
+    application = FastAPI(title="Password Manager", debug=getattr(config, "DEBUG", not PRODUCTION), version="1.0",
+                          lifespan=lifespan)
     application.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER],
     )
+    # Added last so it wraps every other middleware and times the whole request
+    application.add_middleware(MetricsMiddleware)
+    application.add_exception_handler(WorkerPoolFull, worker_pool_full_handler)
     application.include_router(api_router)
     return application
 
 
 app = build_app()
-
-
-@app.on_event("startup")
-async def startup() -> None:
-    app.state.DB = PasswordDB()
-    await app.state.DB.initiate_db()
-
-# TODO: Add shutdown event to close db connection
@@ -0,0 +1,44 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlmodel import Field, SQLModel
+
+# Imported so the data_key table is known before blob references it
+from app.models.data_key import DataKey  # noqa
+
+
+# Data only model
+class BlobBase(SQLModel):
+    name: str
+    content_type: str = Field(default="application/octet-stream")
+
+
+class Blob(BlobBase, table=True):
+    __tablename__ = "blob"
+
+    id: Optional[int] = Field(default=None, primary_key=True, index=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    # Plaintext size in bytes, chunks hold chunk_size bytes except the last one
+    size: int = Field(default=0)
+    chunk_size: int
+    # Every chunk of the blob is encrypted with this data key
+    data_key_id: int = Field(foreign_key="data_key.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+
+
+class BlobChunk(SQLModel, table=True):
+    __tablename__ = "blob_chunk"
+
+    blob_id: int = Field(foreign_key="blob.id", primary_key=True)
+    position: int = Field(primary_key=True)
+    # SHA-256 of the stored chunk, identical chunks share a single file on disk
+    address: str = Field(index=True)
+    size: int
+
+
+class BlobRead(BlobBase):
+    id: int
+    size: int
+    chunk_size: int
+    data_key_id: int
+    created_at: datetime
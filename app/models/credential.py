@@ -1,11 +1,14 @@
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 from app.models.user import UserRead
+from sqlalchemy import Index
 from sqlmodel import Field, Relationship, SQLModel
 
 # Data only model
 from app.models.site import SiteRead
+# Imported so the data_key table is known before credential references it
+from app.models.data_key import DataKey  # noqa
 
 
 class CredentialBase(SQLModel):
@@ -18,16 +21,40 @@ class CredentialBase(SQLModel):
 
 class Credential(CredentialBase, table=True):
     __tablename__ = "credential"
+    # Serves keyset pagination over a user's credentials and delta sync over its changes
+    __table_args__ = (Index("ix_credential_user_id_id", "user_id", "id"),
+                      Index("ix_credential_user_id_version", "user_id", "version"))
 
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     user_id: int = Field(foreign_key="user.id")
     created_at: datetime = Field(default=datetime.utcnow(), nullable=False)
 
-    site: Optional["Site"] = Relationship(back_populates="credentials", sa_relationship_kwargs={'lazy': 'selectin'})
+    # Relationships are never loaded implicitly, queries that need them ask for them through the CRUD layer
+    site: Optional["Site"] = Relationship(back_populates="credentials", sa_relationship_kwargs={'lazy': 'raise'})
     site_id: Optional[int] = Field(foreign_key="site.id", nullable=True)
 
     # Owner of the credential
-    owner: "User" = Relationship(back_populates="credentials", sa_relationship_kwargs={'lazy': 'selectin'})
+    owner: "User" = Relationship(back_populates="credentials", sa_relationship_kwargs={'lazy': 'raise'})
+
+    # 1: RSA-OAEP with the owner's public key, 2: AES-GCM with the data key referenced by data_key_id
+    encryption_scheme: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+    data_key_id: Optional[int] = Field(default=None, foreign_key="data_key.id", nullable=True)
+
+    # Change version of the last insert or update, increases with every write to one of the owner's credentials
+    version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+
+
+# Left behind by deleted credentials so clients syncing changes learn about the delete
+class CredentialTombstone(SQLModel, table=True):
+    __tablename__ = "credential_tombstone"
+    __table_args__ = (Index("ix_credential_tombstone_user_id_version", "user_id", "version"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    credential_id: int
+    user_id: int = Field(foreign_key="user.id")
+    # Change version of the delete, taken from the same sequence as Credential.version
+    version: int
+    deleted_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
 
 
 # User id has to be provided when creating a credential
@@ -43,5 +70,84 @@ class CredentialUpdate(CredentialBase):
 class CredentialRead(CredentialBase):
     created_at: datetime
     id: int
+    encryption_scheme: int
+    data_key_id: Optional[int]
     site: Optional[SiteRead]
     owner: UserRead
+
+
+# Item of a compact page, the site is sideloaded once per page and the owner is the requesting user
+class CredentialCompactRead(CredentialBase):
+    created_at: datetime
+    id: int
+    encryption_scheme: int
+    data_key_id: Optional[int]
+    site_id: Optional[int]
+
+
+class CredentialCompactPage(SQLModel):
+    credentials: List[CredentialCompactRead]
+    # Sites referenced by the page, keyed by id
+    sites: Dict[int, SiteRead]
+
+
+# Credentials changed since a sync token, replaying them in order brings a client up to date
+class CredentialChanges(SQLModel):
+    # Current state of every credential inserted or updated since the token
+    credentials: List[CredentialCompactRead]
+    # Ids of the credentials deleted since the token
+    deleted: List[int]
+    # Token to send as since on the next request
+    token: str
+    # More changes are waiting, request again with the new token
+    more: bool
+
+
+# Flat representation used by exports, relationships are referenced by id only
+class CredentialExport(CredentialBase):
+    id: int
+    created_at: datetime
+    site_id: Optional[int]
+    encryption_scheme: int
+    data_key_id: Optional[int]
+
+
+# Items of a batch always belong to the authenticated user
+class CredentialBatchItem(CredentialBase):
+    site_id: Optional[int] = None
+
+
+class CredentialBatchCreate(SQLModel):
+    credentials: List[CredentialBatchItem] = Field(min_length=1, max_length=500)
+
+
+class CredentialBatchCreated(SQLModel):
+    index: int
+    id: int
+    nickname: str
+
+
+class CredentialBatchConflict(SQLModel):
+    index: int
+    nickname: str
+    detail: str
+
+
+class CredentialBatchRead(SQLModel):
+    created: List[CredentialBatchCreated] = []
+    conflicts: List[CredentialBatchConflict] = []
+
+
+class CredentialImportError(SQLModel):
+    line: int
+    detail: str
+
+
+class CredentialImportRead(SQLModel):
+    imported: int = 0
+    skipped: int = 0
+    failed: int = 0
+    # True when the upload was not read to the end, the last error holds the first line left out
+    stopped: bool = False
+    # Only the first errors are reported
+    errors: List[CredentialImportError] = []
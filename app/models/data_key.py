@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlmodel import Field, SQLModel
+
+
+# Data only model
+class DataKeyBase(SQLModel):
+    # AES key wrapped with the owner's public key, only the owner's private key can unwrap it
+    wrapped_key: str
+
+
+class DataKey(DataKeyBase, table=True):
+    __tablename__ = "data_key"
+
+    id: Optional[int] = Field(default=None, primary_key=True, index=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    # Set once the key was rotated, retired keys still decrypt what they encrypted but never encrypt again
+    retired_at: Optional[datetime] = None
+
+
+class DataKeyRead(DataKeyBase):
+    id: int
+    created_at: datetime
+    retired_at: Optional[datetime] = None
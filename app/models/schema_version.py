@@ -0,0 +1,8 @@
+from sqlmodel import Field, SQLModel
+
+
+# Single row table holding the version of the schema the database was created with
+class SchemaVersion(SQLModel, table=True):
+    __tablename__ = "schema_version"
+
+    version: int = Field(primary_key=True)
@@ -25,8 +25,9 @@ class Site(SiteBase, table=True):
     url: Optional[str] = Field(default=None, unique=True)
 
     # TODO: Add if sites get tied to each user
+    # Never loaded implicitly, queries that need it ask for it through the CRUD layer
     credentials: list["Credential"] = Relationship(back_populates="site",
-                                                   sa_relationship_kwargs={"cascade": "delete", 'lazy': 'selectin'})
+                                                   sa_relationship_kwargs={"cascade": "delete", 'lazy': 'raise'})
 
 
 class SiteCreate(SiteBase):
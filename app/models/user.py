@@ -18,6 +18,8 @@ class User(UserBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     hashed_password: str
     public_key: str
+    # Last change version given to one of the user's credentials, see CredentialCRUD
+    change_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
     credentials: List["Credential"] = Relationship(back_populates="owner")
 
 
@@ -1,8 +1,20 @@
+import asyncio
+import json
 from typing import Any
 
-from app.tests.conftest import db_site_quantity, db_credential_quantity, db_user_quantity
+import config
+from aioredis import Redis
+from app.core.blob_store import FRAME_HEADER, ChunkSweeper, chunk_store, open_chunk
+from app.core.cypt_utils import ENVELOPE_SCHEME, encryption_pool, decrypt_with_data_key, unwrap_data_key
+from app.core.notifications import change_notifier
+from app.core.vault_import import MAX_LINE_LENGTH
+from app.core.workers import WorkerPoolFull
+from app.crud.blob import BlobCRUD
+from app.main import app
+from app.tests.conftest import db_site_quantity, db_credential_quantity, db_user_quantity, super_user_key_pair
 from fastapi import status
 from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
 import pytest
 
 
@@ -36,6 +48,24 @@ async def test_get_site_list_negative_offset(client_populated_db: AsyncClient) -
     assert response.status_code == status.HTTP_400_BAD_REQUEST
 
 
+@pytest.mark.asyncio
+async def test_get_site_list_with_cursor(client_populated_db: AsyncClient) -> None:
+    response = await client_populated_db.get("/dashboard/sites?limit=1")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()[0]["name"] == "Site_0"
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = await client_populated_db.get(f"/dashboard/sites?limit=1&cursor={cursor}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()[0]["name"] == "Site_1"
+
+
+@pytest.mark.asyncio
+async def test_get_site_list_with_invalid_cursor(client_populated_db: AsyncClient) -> None:
+    response = await client_populated_db.get("/dashboard/sites?cursor=invalid")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
 @pytest.mark.asyncio
 async def test_get_site_list_reduced_details(client_populated_db: AsyncClient) -> None:
     response = await client_populated_db.get("/dashboard/sites/reduced")
@@ -188,6 +218,47 @@ async def test_create_credential_with_invalid_data_throws_error(client_populated
     assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
 
 
+@pytest.mark.asyncio
+async def test_create_credential_batch_reports_conflicts(client_populated_db: AsyncClient,
+                                                         superuser_token_headers: dict[str, str]) -> None:
+    batch_data = {"credentials": [
+        {"nickname": "batch_credential_0", "encrypted_password": "pass_pass", "site_id": 1},
+        {"nickname": "Credential0", "encrypted_password": "pass_pass", "site_id": 1},
+        {"nickname": "batch_credential_0", "encrypted_password": "pass_pass"},
+        {"nickname": "batch_credential_1", "encrypted_password": "pass_pass", "site_id": 6},
+        {"nickname": "batch_credential_2", "encrypted_password": "pass_pass"},
+    ]}
+    response = await client_populated_db.post("/dashboard/credentials/batch", json=batch_data,
+                                              headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    response_json = response.json()
+    assert [item["index"] for item in response_json["created"]] == [0, 4]
+    assert [item["index"] for item in response_json["conflicts"]] == [1, 2, 3]
+
+    credential_id = response_json["created"][0]["id"]
+    response = await client_populated_db.get(f"/dashboard/credentials/{credential_id}", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["encrypted_password"] != "pass_pass"
+
+
+@pytest.mark.asyncio
+async def test_create_credential_batch_reports_passwords_too_long_to_encrypt(
+        client_populated_db: AsyncClient, superuser_token_headers: dict[str, str]) -> None:
+    # RSA-OAEP with a 2048 bit key encrypts at most 190 bytes
+    batch_data = {"credentials": [
+        {"nickname": "batch_credential_0", "encrypted_password": "p" * 300},
+        {"nickname": "batch_credential_1", "encrypted_password": "pass_pass"},
+        {"nickname": "Credential0", "encrypted_password": "pass_pass"},
+    ]}
+    response = await client_populated_db.post("/dashboard/credentials/batch", json=batch_data,
+                                              headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    response_json = response.json()
+    assert [(item["index"], item["nickname"]) for item in response_json["created"]] == [(1, "batch_credential_1")]
+    assert [(item["index"], item["detail"]) for item in response_json["conflicts"]] == [
+        (0, "Password is too long to be encrypted"), (2, "Credential with this nickname already exist")]
+
+
 @pytest.mark.asyncio
 async def test_get_credential_list(client_populated_db: AsyncClient, superuser_token_headers: dict[str, str]) -> None:
     response = await client_populated_db.get("/dashboard/credentials", headers=superuser_token_headers)
@@ -196,6 +267,189 @@ async def test_get_credential_list(client_populated_db: AsyncClient, superuser_t
     assert response.json()[0]["nickname"] == "Credential0"
 
 
+@pytest.mark.asyncio
+async def test_get_credential_list_with_cursor(client_populated_db: AsyncClient,
+                                               superuser_token_headers: dict[str, str]) -> None:
+    response = await client_populated_db.get("/dashboard/credentials?limit=1", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = await client_populated_db.get(f"/dashboard/credentials?limit=1&cursor={cursor}",
+                                             headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()[0]["nickname"] == "Credential5"
+
+
+@pytest.mark.asyncio
+async def test_get_compact_credential_list(client_populated_db: AsyncClient,
+                                           superuser_token_headers: dict[str, str]) -> None:
+    response = await client_populated_db.get("/dashboard/credentials?compact=true", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    page = response.json()
+    assert len(page["credentials"]) == int(db_credential_quantity / db_user_quantity)
+    assert "owner" not in page["credentials"][0]
+    site_ids = {credential["site_id"] for credential in page["credentials"]}
+    assert set(page["sites"]) == {str(site_id) for site_id in site_ids}
+    assert page["sites"]["1"]["name"] == "Site_0"
+
+
+@pytest.mark.asyncio
+async def test_sync_credential_changes(client_populated_db: AsyncClient,
+                                       superuser_token_headers: dict[str, str]) -> None:
+    # A first sync without a token returns everything
+    response = await client_populated_db.get("/dashboard/credentials/changes", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    changes = response.json()
+    assert len(changes["credentials"]) == int(db_credential_quantity / db_user_quantity)
+    assert changes["deleted"] == [] and not changes["more"]
+    token = changes["token"]
+
+    credential_data = {"nickname": "synced", "encrypted_password": "secret", "favorite": False, "user_id": 0,
+                       "site_id": 1}
+    response = await client_populated_db.post("/dashboard/credentials", json=credential_data,
+                                              headers=superuser_token_headers)
+    created_id = response.json()["id"]
+    response = await client_populated_db.delete("/dashboard/credentials/1", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+
+    # Only what changed since the token comes back
+    response = await client_populated_db.get(f"/dashboard/credentials/changes?since={token}",
+                                             headers=superuser_token_headers)
+    changes = response.json()
+    assert [credential["id"] for credential in changes["credentials"]] == [created_id]
+    assert changes["deleted"] == [1]
+
+    response = await client_populated_db.get(f"/dashboard/credentials/changes?since={changes['token']}",
+                                             headers=superuser_token_headers)
+    assert response.json()["credentials"] == [] and response.json()["deleted"] == []
+
+    response = await client_populated_db.get("/dashboard/credentials/changes?since=bad",
+                                             headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_credential_events_stream_changes(client_populated_db: AsyncClient,
+                                                superuser_token_headers: dict[str, str], redis_client: Redis,
+                                                monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(change_notifier, "redis", redis_client)
+    await change_notifier.start()
+
+    # The stream never ends, so the app is driven directly instead of through the client which waits for the body
+    chunks: asyncio.Queue = asyncio.Queue()
+    disconnected = asyncio.Event()
+
+    async def receive() -> dict[str, Any]:
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict[str, Any]) -> None:
+        if message["type"] == "http.response.body" and message.get("body"):
+            await chunks.put(message["body"].decode())
+
+    headers = [(key.lower().encode(), value.encode()) for key, value in superuser_token_headers.items()]
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/dashboard/credentials/events", "raw_path": b"/dashboard/credentials/events",
+             "query_string": b"", "headers": headers, "client": ("127.0.0.1", 1), "server": ("test", 80)}
+    stream = asyncio.create_task(app(scope, receive, send))
+    try:
+        assert (await asyncio.wait_for(chunks.get(), timeout=5)).startswith("retry:")
+
+        credential_data = {"nickname": "pushed", "encrypted_password": "secret", "favorite": False, "user_id": 0,
+                           "site_id": 1}
+        response = await client_populated_db.post("/dashboard/credentials", json=credential_data,
+                                                  headers=superuser_token_headers)
+        assert response.status_code == status.HTTP_201_CREATED
+
+        event = await asyncio.wait_for(chunks.get(), timeout=5)
+        assert event.startswith("event: change")
+        assert json.loads(event.split("data: ", 1)[1])["version"] > 0
+    finally:
+        disconnected.set()
+        await asyncio.wait_for(stream, timeout=5)
+        await change_notifier.stop()
+    assert change_notifier.stats()["connections"] == 0
+
+
+@pytest.mark.asyncio
+async def test_import_credentials_from_csv(client_populated_db: AsyncClient,
+                                           superuser_token_headers: dict[str, str]) -> None:
+    content = ("name,url,username,password\n"
+               "imported_0,https://site0.com,test_username,pass_pass\n"
+               "Credential0,https://site0.com,test_username,pass_pass\n"
+               "imported_1,,test_username,\n")
+    response = await client_populated_db.post("/dashboard/credentials/import?format=csv", content=content,
+                                              headers={**superuser_token_headers, "Content-Type": "text/csv"})
+    assert response.status_code == status.HTTP_200_OK
+    response_json = response.json()
+    assert response_json["imported"] == 1
+    assert response_json["skipped"] == 1
+    assert response_json["failed"] == 1
+    assert [error["line"] for error in response_json["errors"]] == [4, 3]
+
+
+@pytest.mark.asyncio
+async def test_import_credentials_from_ndjson(client_populated_db: AsyncClient,
+                                              superuser_token_headers: dict[str, str]) -> None:
+    content = '{"nickname": "imported_0", "password": "pass_pass", "site_id": 1}\nnot json\n'
+    response = await client_populated_db.post("/dashboard/credentials/import?format=ndjson", content=content,
+                                              headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["imported"] == 1
+    assert response.json()["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_import_credentials_stops_at_an_overlong_line(client_populated_db: AsyncClient,
+                                                             superuser_token_headers: dict[str, str]) -> None:
+    content = ('{"nickname": "imported_0", "password": "pass_pass"}\n'
+               + "x" * (MAX_LINE_LENGTH + 1) + "\n"
+               + '{"nickname": "imported_1", "password": "pass_pass"}\n')
+    response = await client_populated_db.post("/dashboard/credentials/import?format=ndjson", content=content,
+                                              headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    response_json = response.json()
+    # Lines before the overlong one are imported, the summary tells where the import stopped
+    assert response_json["imported"] == 1 and response_json["stopped"]
+    assert response_json["errors"][-1]["line"] == 2
+
+
+@pytest.mark.asyncio
+async def test_import_credentials_stops_when_the_encryption_pool_is_full(client_populated_db: AsyncClient,
+                                                                        superuser_token_headers: dict[str, str],
+                                                                        monkeypatch: pytest.MonkeyPatch) -> None:
+    run = encryption_pool.run
+    calls = []
+
+    async def run_until_full(*args: Any) -> Any:
+        calls.append(args)
+        if len(calls) > 1:
+            raise WorkerPoolFull("full")
+        return await run(*args)
+
+    monkeypatch.setattr(config, "IMPORT_CHUNK_SIZE", 1, raising=False)
+    monkeypatch.setattr(encryption_pool, "run", run_until_full)
+    content = "".join(f'{{"nickname": "imported_{i}", "password": "pass_pass"}}\n' for i in range(3))
+    response = await client_populated_db.post("/dashboard/credentials/import?format=ndjson", content=content,
+                                              headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    response_json = response.json()
+    assert response_json["imported"] == 1 and response_json["stopped"]
+    assert response_json["errors"] == [{"line": 2, "detail": "The server is busy, the import stopped before this line"}]
+
+
+@pytest.mark.asyncio
+async def test_export_credentials(client_populated_db: AsyncClient, superuser_token_headers: dict[str, str]) -> None:
+    response = await client_populated_db.get("/dashboard/credentials/export", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    credentials = [json.loads(line) for line in response.text.splitlines()]
+    assert len(credentials) == int(db_credential_quantity / db_user_quantity)
+    assert credentials[0]["nickname"] == "Credential0"
+    assert "owner" not in credentials[0]
+
+
 @pytest.mark.asyncio
 async def test_get_credential_by_id(client_populated_db: AsyncClient, superuser_token_headers: dict[str, str]) -> None:
     response = await client_populated_db.get("/dashboard/credentials/1", headers=superuser_token_headers)
@@ -230,3 +484,143 @@ async def test_delete_non_existent_credential_return_informative_error(client_po
                                                                        superuser_token_headers: dict[str, str]) -> None:
     response = await client_populated_db.delete("/dashboard/credentials/10", headers=superuser_token_headers)
     assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_create_credential_with_envelope_scheme(client_populated_db: AsyncClient,
+                                                      superuser_token_headers: dict[str, str],
+                                                      monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(config, "ENCRYPTION_SCHEME", ENVELOPE_SCHEME, raising=False)
+    credential_data = {"nickname": "envelope", "email": "a@gmail.com", "username": "a",
+                       "encrypted_password": "secret", "favorite": False, "user_id": 0, "site_id": 1}
+
+    response = await client_populated_db.post("/dashboard/credentials", json=credential_data,
+                                              headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    credential = response.json()
+    assert credential["encryption_scheme"] == ENVELOPE_SCHEME
+
+    response = await client_populated_db.get(f"/dashboard/data-keys/{credential['data_key_id']}",
+                                             headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+
+    data_key = unwrap_data_key(super_user_key_pair[1], response.json()["wrapped_key"])
+    assert decrypt_with_data_key(data_key, credential["encrypted_password"]) == "secret"
+
+
+# ----------------- Blobs -----------------
+
+
+@pytest.mark.asyncio
+async def test_upload_and_download_blob(client_populated_db: AsyncClient, superuser_token_headers: dict[str, str],
+                                        monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    monkeypatch.setattr(config, "BLOB_CHUNK_SIZE", 1024, raising=False)
+    monkeypatch.setattr(chunk_store, "root", str(tmp_path))
+    content = bytes(range(256)) * 10
+
+    response = await client_populated_db.post("/dashboard/blobs", params={"name": "file.bin"}, content=content,
+                                              headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_201_CREATED
+    blob = response.json()
+    assert blob["size"] == len(content)
+
+    response = await client_populated_db.get(f"/dashboard/blobs/{blob['id']}/content", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert content not in response.content
+
+    wrapped_key = (await client_populated_db.get(f"/dashboard/data-keys/{blob['data_key_id']}",
+                                                 headers=superuser_token_headers)).json()["wrapped_key"]
+    data_key = unwrap_data_key(super_user_key_pair[1], wrapped_key)
+
+    downloaded, data = b"", response.content
+    while data:
+        (length,) = FRAME_HEADER.unpack(data[:FRAME_HEADER.size])
+        downloaded += open_chunk(data_key, data[FRAME_HEADER.size:FRAME_HEADER.size + length])
+        data = data[FRAME_HEADER.size + length:]
+    assert downloaded == content
+
+    response = await client_populated_db.delete(f"/dashboard/blobs/{blob['id']}", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    response = await client_populated_db.get(f"/dashboard/blobs/{blob['id']}", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_deleted_blob_chunks_stay_until_swept(client_populated_db: AsyncClient,
+                                                    superuser_token_headers: dict[str, str],
+                                                    loaded_db_session: AsyncSession,
+                                                    monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    monkeypatch.setattr(config, "BLOB_CHUNK_SIZE", 1024, raising=False)
+    monkeypatch.setattr(chunk_store, "root", str(tmp_path))
+    blob_ids = []
+    for name in ("first.bin", "second.bin"):
+        response = await client_populated_db.post("/dashboard/blobs", params={"name": name}, content=b"x" * 1024,
+                                                  headers=superuser_token_headers)
+        blob_ids.append(response.json()["id"])
+
+    # Both blobs share their only chunk, an upload could be reusing it while the first one is deleted
+    response = await client_populated_db.delete(f"/dashboard/blobs/{blob_ids[0]}", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    response = await client_populated_db.get(f"/dashboard/blobs/{blob_ids[1]}/content",
+                                             headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+
+    async def referenced(addresses: list[str]) -> set[str]:
+        return await BlobCRUD(loaded_db_session).read_referenced(addresses)
+
+    sweeper = ChunkSweeper(chunk_store, interval=3600, grace=0, batch_size=10)
+    sweeper.referenced = referenced
+    assert await sweeper.sweep() == 0
+    await client_populated_db.delete(f"/dashboard/blobs/{blob_ids[1]}", headers=superuser_token_headers)
+    assert await sweeper.sweep() == 1
+
+
+@pytest.mark.asyncio
+async def test_search_credentials(client_populated_db: AsyncClient, superuser_token_headers: dict[str, str]) -> None:
+    response = await client_populated_db.get("/dashboard/credentials/search?q=credential",
+                                             headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_200_OK
+    credentials = response.json()
+    assert len(credentials) == int(db_credential_quantity / db_user_quantity)
+    assert all(credential["owner"]["username"] == "test_superuser" for credential in credentials)
+
+    # Site names are searched too
+    response = await client_populated_db.get("/dashboard/credentials/search?q=site_1&compact=true",
+                                             headers=superuser_token_headers)
+    page = response.json()
+    assert page["credentials"] and all(credential["site_id"] == 2 for credential in page["credentials"])
+
+    # The index follows writes
+    credential_data = {"nickname": "Zebra Bank", "encrypted_password": "secret", "favorite": False, "user_id": 0,
+                       "site_id": None}
+    response = await client_populated_db.post("/dashboard/credentials", json=credential_data,
+                                              headers=superuser_token_headers)
+    created_id = response.json()["id"]
+    response = await client_populated_db.get("/dashboard/credentials/search?q=zebra", headers=superuser_token_headers)
+    assert [credential["id"] for credential in response.json()] == [created_id]
+
+    await client_populated_db.delete(f"/dashboard/credentials/{created_id}", headers=superuser_token_headers)
+    response = await client_populated_db.get("/dashboard/credentials/search?q=zebra", headers=superuser_token_headers)
+    assert response.json() == []
+
+    response = await client_populated_db.get("/dashboard/credentials/search?q=", headers=superuser_token_headers)
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+async def test_match_site_by_url(client_populated_db: AsyncClient) -> None:
+    response = await client_populated_db.get("/dashboard/sites/match?url=https://login.site1.com/path?next=/")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"id": 2, "name": "Site_1", "url": "https://site1.com"}
+
+    # Sites created afterwards are matched without reading the catalog again
+    response = await client_populated_db.post("/dashboard/sites",
+                                              json={"name": "Example", "url": "https://example.org"})
+    assert response.status_code == status.HTTP_201_CREATED
+    response = await client_populated_db.get("/dashboard/sites/match?url=www.example.org")
+    assert response.json()["name"] == "Example"
+
+    response = await client_populated_db.get("/dashboard/sites/match?url=https://unknown.org")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = await client_populated_db.get("/dashboard/sites/match?url=https://")
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -1,8 +1,12 @@
+from contextlib import asynccontextmanager
 from typing import AsyncGenerator, Any, Dict, Coroutine
 
 import config
 from app.core.auth_utils import get_hashed_password
-from app.core.cypt_utils import generate_key_pair, encrypt_with_key
+from app.core.cypt_utils import data_key_ring, generate_key_pair, encrypt_with_key
+from app.core.search_index import search_index
+from app.core.site_matcher import site_matcher
+from app.core.user_cache import user_cache
 from app.models.credential import Credential
 from app.models.site import Site
 from app.models.user import User
@@ -13,7 +17,10 @@ from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, async_sessionmaker
 from sqlmodel import SQLModel
 from sqlmodel.pool import StaticPool
 
-from app.dependencies.db import get_db
+from aioredis import Redis
+
+from app.dependencies.db import get_db, get_session_maker
+from app.dependencies.redis import create_redis_pool, get_redis
 from app.main import app
 
 db_user_quantity = 5
@@ -111,8 +118,25 @@ async def db_session() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
+@pytest.fixture(autouse=True)
+def clear_user_cache() -> None:
+    # Every test starts from a fresh database, users cached by a previous test are stale
+    user_cache.clear()
+    data_key_ring.clear()
+    search_index.clear()
+    site_matcher.clear()
+
+
 @pytest.fixture
-async def client(db_session: AsyncSession) -> AsyncGenerator[AsyncClient, None]:
+async def redis_client() -> AsyncGenerator[Redis, None]:
+    # The test client does not run startup events, so the application pool is built here
+    pool = create_redis_pool()
+    yield Redis(connection_pool=pool)
+    await pool.disconnect()
+
+
+@pytest.fixture
+async def client(db_session: AsyncSession, redis_client: Redis) -> AsyncGenerator[AsyncClient, None]:
     def get_session_override() -> AsyncSession:
         return db_session
 
@@ -120,18 +144,26 @@ async def client(db_session: AsyncSession) -> AsyncGenerator[AsyncClient, None]:
         # dependency_overrides is a dict holding the current function (overridden) as
         # a key and the new functions as a value
         app.dependency_overrides[get_db] = get_session_override
+        app.dependency_overrides[get_redis] = lambda: redis_client
         yield client
         # Clearing the dictionary resets all overrides
         app.dependency_overrides.clear()
 
 
 @pytest.fixture
-async def client_populated_db(loaded_db_session: AsyncSession) -> AsyncGenerator[AsyncClient, None]:
+async def client_populated_db(loaded_db_session: AsyncSession, redis_client: Redis) -> AsyncGenerator[AsyncClient, None]:
     def get_session_override() -> AsyncSession:
         return loaded_db_session
 
+    # Streaming routes open their own sessions, hand them the test session instead
+    @asynccontextmanager
+    async def session_maker_override() -> AsyncGenerator[AsyncSession, None]:
+        yield loaded_db_session
+
     async with AsyncClient(app=app, base_url="http://127.0.0.1:8000") as client:
         app.dependency_overrides[get_db] = get_session_override
+        app.dependency_overrides[get_session_maker] = lambda: session_maker_override
+        app.dependency_overrides[get_redis] = lambda: redis_client
         yield client
         app.dependency_overrides.clear()
 
@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+from app.core.blob_store import FRAME_HEADER, BlobTooLarge, ChunkStore, ChunkSweeper, open_chunk, seal_chunk
+from app.core.cypt_utils import generate_data_key
+
+
+async def stream(data: bytes, piece: int):
+    for start in range(0, len(data), piece):
+        yield data[start:start + piece]
+
+
+def unframe(data: bytes) -> list[bytes]:
+    frames = []
+    while data:
+        (length,) = FRAME_HEADER.unpack(data[:FRAME_HEADER.size])
+        frames.append(data[FRAME_HEADER.size:FRAME_HEADER.size + length])
+        data = data[FRAME_HEADER.size + length:]
+    return frames
+
+
+@pytest.mark.asyncio
+async def test_chunk_store_round_trip_and_deduplication(tmp_path) -> None:
+    store = ChunkStore(root=str(tmp_path), read_size=7)
+    data_key = generate_data_key()
+    data = b"a" * 16 + b"a" * 16 + b"tail"
+
+    chunks, written = await store.put_stream(stream(data, 5), data_key, chunk_size=16, max_size=1024)
+    assert [size for _, size in chunks] == [16, 16, 4]
+    # Both identical chunks share one file
+    assert chunks[0][0] == chunks[1][0]
+    assert len(written) == 2
+
+    downloaded = b"".join([frame async for frame in store.iter_frames([address for address, _ in chunks])])
+    assert b"".join(open_chunk(data_key, sealed) for sealed in unframe(downloaded)) == data
+    assert b"tail" not in downloaded
+
+    _, written = await store.put_stream(stream(data, 5), data_key, chunk_size=16, max_size=1024)
+    assert written == []
+
+
+@pytest.mark.asyncio
+async def test_chunk_store_rejects_streams_over_max_size(tmp_path) -> None:
+    store = ChunkStore(root=str(tmp_path), read_size=64)
+
+    with pytest.raises(BlobTooLarge):
+        await store.put_stream(stream(b"x" * 64, 8), generate_data_key(), chunk_size=16, max_size=32)
+
+
+def age(store: ChunkStore, address: str, seconds: float) -> None:
+    modified = time.time() - seconds
+    os.utime(store.path(address), (modified, modified))
+
+
+@pytest.mark.asyncio
+async def test_chunk_sweeper_removes_stale_unreferenced_chunks(tmp_path) -> None:
+    store = ChunkStore(root=str(tmp_path), read_size=64)
+    data_key = generate_data_key()
+    referenced, orphaned, fresh = (seal_chunk(data_key, data) for data in (b"referenced", b"orphaned", b"fresh"))
+    for address, sealed in (referenced, orphaned, fresh):
+        store.write(address, sealed)
+    age(store, referenced[0], 120)
+    age(store, orphaned[0], 120)
+
+    async def lookup(addresses: list[str]) -> set[str]:
+        return {referenced[0]} & set(addresses)
+
+    sweeper = ChunkSweeper(store, interval=3600, grace=60, batch_size=1)
+    sweeper.referenced = lookup
+    assert await sweeper.sweep() == 1
+    assert os.path.exists(store.path(referenced[0])) and os.path.exists(store.path(fresh[0]))
+    assert not os.path.exists(store.path(orphaned[0]))
+
+
+def test_chunk_store_keeps_stale_chunks_reused_before_removal(tmp_path) -> None:
+    store = ChunkStore(root=str(tmp_path), read_size=64)
+    address, sealed = seal_chunk(generate_data_key(), b"shared")
+    store.write(address, sealed)
+    age(store, address, 120)
+    assert store.stale(grace=60) == [address]
+
+    # An upload reuses the chunk after the sweep listed it, before the sweep removes it
+    assert not store.write(address, sealed)
+    assert not store.remove_stale(address, grace=60)
+    with open(store.path(address), "rb") as file:
+        assert file.read() == sealed
+    assert os.listdir(os.path.dirname(store.path(address))) == [address[2:]]
+
+    age(store, address, 120)
+    assert store.remove_stale(address, grace=60)
+    assert os.listdir(os.path.dirname(store.path(address))) == []
+    # An upload coming after the removal writes the chunk again
+    assert store.write(address, sealed)
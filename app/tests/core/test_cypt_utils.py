@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core.cypt_utils import (CredentialEncryptor, DataKeyRing, ENVELOPE_SCHEME, KeyPairPool, PublicKeyCache,
+                                 decrypt_with_data_key, decrypt_with_key, encrypt_with_key, generate_data_key,
+                                 generate_key_pair, unwrap_data_key, wrap_data_key)
+from app.core.workers import WorkerPool, WorkerPoolFull
+from app.dependencies.encryption import get_encryption_key
+from app.models.user import User
+
+
+@pytest.mark.asyncio
+async def test_key_pair_pool_generates_on_workers_when_empty_and_refills() -> None:
+    pool = KeyPairPool(size=2, low_water=1, workers=WorkerPool(name="test", max_workers=2, max_queue=2))
+
+    public_key, private_key = await pool.get()
+    assert "PUBLIC KEY" in public_key and "PRIVATE KEY" in private_key
+    assert pool.stats()["misses"] == 1
+
+    # The miss scheduled a refill in the background
+    for _ in range(100):
+        if len(pool) == pool.size:
+            break
+        await asyncio.sleep(0.05)
+    assert len(pool) == pool.size
+
+    first, _ = await pool.get()
+    second, _ = await pool.get()
+    assert first != second
+    assert pool.stats()["hits"] == 2
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_key_pair_pool_rejects_when_empty_and_workers_saturated() -> None:
+    workers = WorkerPool(name="test", max_workers=1, max_queue=0)
+    pool = KeyPairPool(size=0, low_water=0, workers=workers)
+
+    busy = asyncio.create_task(workers.run(time.sleep, 0.5))
+    await asyncio.sleep(0.05)
+    # Generating the pair on the event loop instead would stall every other request
+    with pytest.raises(WorkerPoolFull):
+        await pool.get()
+    await busy
+    pool.shutdown()
+
+
+def test_public_key_cache_hits_evicts_and_invalidates() -> None:
+    cache = PublicKeyCache(max_size=2)
+    first_key, _ = generate_key_pair()
+    second_key, _ = generate_key_pair()
+
+    assert cache.get(1, first_key) is None
+    parsed_key = cache.put(1, first_key)
+    assert cache.get(1, first_key) is parsed_key
+    assert encrypt_with_key(parsed_key, "secret") != "secret"
+
+    # A different key for the same user is a separate entry
+    assert cache.get(1, second_key) is None
+    cache.put(1, second_key)
+    cache.put(2, first_key)
+    assert cache.stats()["evictions"] == 1
+    assert cache.get(1, first_key) is None
+
+    cache.invalidate(1)
+    assert cache.get(1, second_key) is None
+    assert cache.get(2, first_key) is not None
+
+
+def test_encryption_key_follows_a_changed_user_key() -> None:
+    first_key, _ = generate_key_pair()
+    second_key, second_private_key = generate_key_pair()
+
+    get_encryption_key(User(id=1, username="user", public_key=first_key))
+    encryption_key = get_encryption_key(User(id=1, username="user", public_key=second_key))
+    assert decrypt_with_key(second_private_key, encrypt_with_key(encryption_key, "secret")) == "secret"
+
+
+def test_envelope_encryption_round_trip() -> None:
+    public_key, private_key = generate_key_pair()
+    data_key = generate_data_key()
+    encryptor = CredentialEncryptor(ENVELOPE_SCHEME, key=data_key, key_material=data_key, data_key_id=7)
+
+    encrypted = encryptor.encrypt("secret")
+    assert encrypted != encryptor.encrypt("secret")
+    assert encryptor.fields == {"encryption_scheme": ENVELOPE_SCHEME, "data_key_id": 7}
+
+    # The client only receives the wrapped key and unwraps it with the private key
+    unwrapped = unwrap_data_key(private_key, wrap_data_key(public_key, data_key))
+    assert decrypt_with_data_key(unwrapped, encrypted) == "secret"
+    assert encryptor.encrypt_many(data_key, ["a", "b"]) != ["a", "b"]
+
+
+def test_data_key_ring_rotates_and_invalidates() -> None:
+    ring = DataKeyRing(max_size=2, max_age=60)
+    public_key, _ = generate_key_pair()
+    data_key = generate_data_key()
+
+    assert ring.get(1, public_key) is None
+    ring.put(1, public_key, 3, data_key)
+    assert ring.get(1, public_key) == (3, data_key)
+
+    ring.invalidate(1)
+    assert ring.get(1, public_key) is None
+
+    ring.max_age = -1
+    ring.put(1, public_key, 4, data_key)
+    assert ring.get(1, public_key) is None
+    assert ring.pop_expired(1, public_key) == 4
+    assert ring.pop_expired(1, public_key) is None
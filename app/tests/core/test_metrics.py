@@ -0,0 +1,55 @@
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.core.metrics import MetricsMiddleware, instrument_engine, render_metrics, timed
+
+
+def sample(name: str, labels: dict[str, str]) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.asyncio
+async def test_middleware_labels_requests_by_route_template() -> None:
+    application = FastAPI()
+    application.add_middleware(MetricsMiddleware)
+
+    @application.get("/items/{item_id}")
+    async def read_item(item_id: int) -> dict[str, int]:
+        return {"id": item_id}
+
+    before = sample("http_requests_total", {"method": "GET", "route": "/items/{item_id}", "status": "200"})
+    async with AsyncClient(app=application, base_url="http://test") as client:
+        await client.get("/items/1")
+        await client.get("/items/2")
+        await client.get("/missing")
+
+    assert sample("http_requests_total",
+                  {"method": "GET", "route": "/items/{item_id}", "status": "200"}) == before + 2
+    assert sample("http_requests_total", {"method": "GET", "route": "unmatched", "status": "404"}) >= 1
+
+    body, _ = render_metrics()
+    assert b'http_request_duration_seconds_bucket{le="0.005",method="GET",route="/items/{item_id}"}' in body
+
+
+@pytest.mark.asyncio
+async def test_engine_and_function_timings() -> None:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    instrument_engine(engine)
+    before = sample("db_statement_duration_seconds_count", {"operation": "SELECT"})
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+        with pytest.raises(Exception):
+            await conn.execute(text("SELECT * FROM missing"))
+    await engine.dispose()
+    assert sample("db_statement_duration_seconds_count", {"operation": "SELECT"}) == before + 1
+
+    @timed("test_operation")
+    def operation() -> int:
+        return 1
+
+    assert operation() == 1
+    assert sample("crypto_operation_duration_seconds_count", {"operation": "test_operation"}) == 1
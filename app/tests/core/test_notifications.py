@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+from aioredis import Redis
+
+from app.core.notifications import ChangeNotifier
+
+
+def test_dispatch_reaches_only_the_users_connections() -> None:
+    notifier = ChangeNotifier(queue_size=1)
+    with notifier.subscribe(1) as queue, notifier.subscribe(2) as other_queue:
+        notifier.dispatch({"user_id": 1, "version": 3})
+        assert queue.get_nowait() == {"version": 3}
+        assert other_queue.empty()
+
+        # A client with a pending event only needs one, the rest are dropped
+        notifier.dispatch({"user_id": 1, "version": 4})
+        notifier.dispatch({"user_id": 1, "version": 5})
+        assert notifier.stats()["dropped"] == 1
+        assert notifier.stats()["connections"] == 2
+
+    assert notifier.stats()["connections"] == 0
+
+
+@pytest.mark.asyncio
+async def test_published_changes_reach_subscribers_through_redis(redis_client: Redis) -> None:
+    notifier = ChangeNotifier(queue_size=4)
+    notifier.redis = redis_client
+    await notifier.start()
+    try:
+        with notifier.subscribe(1) as queue:
+            await notifier.publish(1, 7)
+            assert await asyncio.wait_for(queue.get(), timeout=5) == {"version": 7}
+    finally:
+        await notifier.stop()
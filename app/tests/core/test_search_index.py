@@ -0,0 +1,69 @@
+from app.core.search_index import SearchIndex, UserSearchIndex
+
+
+def test_substring_search_ranks_prefix_matches_first() -> None:
+    index = UserSearchIndex(version=0)
+    index.put(1, ("My Bank", "alice", "alice@mail.com", None))
+    index.put(2, ("Banking app", None, None, "BankCo"))
+    index.put(3, ("Email", "bob", "bob@bank.com", "Mail"))
+
+    assert index.search("bank", limit=10) == [2, 1, 3]
+    assert index.search("BANK", limit=1) == [2]
+    # Queries shorter than a trigram scan every credential
+    assert index.search("ma", limit=10) == [3, 1]
+    # Trigrams never span two fields
+    assert index.search("ealice", limit=10) == []
+
+
+def test_changed_and_removed_credentials_stop_matching() -> None:
+    index = UserSearchIndex(version=0)
+    index.put(1, ("github", "octocat", None, None))
+    index.put(1, ("gitlab", "octocat", None, None))
+    assert index.search("github", limit=10) == []
+    assert index.search("gitlab", limit=10) == [1]
+
+    index.remove(1)
+    assert index.search("octo", limit=10) == [] and len(index) == 0
+
+    # Stale postings are dropped once they outnumber live ones
+    for version in range(2000):
+        index.put(2, (f"nickname {version}", None, None, None))
+    assert index.search("nickname 1999", limit=10) == [2]
+    assert index.search("nickname 1998", limit=10) == []
+    # Compactions run with the current texts only, so the counts match the postings they leave
+    postings = sum(len(posting) for posting in index._postings.values())
+    assert index._live + index._stale == postings
+
+
+def test_least_recently_searched_users_are_evicted() -> None:
+    search_index = SearchIndex(max_entries=3)
+    for user_id in (1, 2):
+        index = UserSearchIndex(version=0)
+        index.put(1, ("one", None, None, None))
+        search_index.store(user_id, index)
+
+    search_index.get(1)
+    index = UserSearchIndex(version=0)
+    index.put(1, ("one", None, None, None))
+    index.put(2, ("two", None, None, None))
+    search_index.store(3, index)
+
+    assert search_index.get(2) is None
+    assert search_index.get(1) is not None
+    assert search_index.stats()["entries"] == 3 and search_index.stats()["evictions"] == 1
+
+
+def test_writes_advance_the_version_only_without_gaps() -> None:
+    search_index = SearchIndex(max_entries=10)
+    search_index.store(1, UserSearchIndex(version=4))
+
+    search_index.put(1, 5, 10, ("new", None, None, None))
+    assert search_index.get(1).version == 5
+
+    # Version 6 was written elsewhere, the index has to read it before moving on
+    search_index.remove(1, 7, 10)
+    assert search_index.get(1).version == 5 and search_index.get(1).search("new", limit=10) == []
+
+    # Users without an index are left alone
+    search_index.put(2, 1, 11, ("other", None, None, None))
+    assert search_index.get(2) is None
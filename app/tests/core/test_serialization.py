@@ -0,0 +1,53 @@
+from collections import namedtuple
+from datetime import datetime
+from typing import List
+
+from pydantic import TypeAdapter
+
+from app.core.serialization import credential_rows_to_compact_json, credential_rows_to_json
+from app.models.credential import Credential, CredentialCompactPage, CredentialRead
+from app.models.site import Site
+from app.models.user import User
+
+CredentialRow = namedtuple("CredentialRow", ["nickname", "email", "username", "encrypted_password", "favorite",
+                                             "created_at", "id", "encryption_scheme", "data_key_id", "site_id",
+                                             "site_name", "site_url"])
+
+
+def make_credentials(owner: User) -> List[Credential]:
+    site = Site(id=3, name="Site_ü", url="https://site3.com")
+    created_at = datetime(2023, 5, 17, 12, 30, 1, 123456)
+    return [
+        Credential(id=1, nickname="Credential1", email=owner.email, username=owner.username,
+                   encrypted_password="cipher", favorite=True, user_id=1, site_id=3, site=site, owner=owner,
+                   created_at=created_at, encryption_scheme=2, data_key_id=4),
+        Credential(id=2, nickname="Credential2", email=None, username=None, encrypted_password="cipher",
+                   user_id=1, site_id=None, site=None, owner=owner, created_at=created_at),
+        Credential(id=3, nickname="Credential3", email=None, username=None, encrypted_password="cipher",
+                   user_id=1, site_id=3, site=site, owner=owner, created_at=created_at),
+    ]
+
+
+def to_rows(credentials: List[Credential]) -> List[CredentialRow]:
+    return [CredentialRow(c.nickname, c.email, c.username, c.encrypted_password, c.favorite, c.created_at, c.id,
+                          c.encryption_scheme, c.data_key_id, c.site and c.site.id, c.site and c.site.name,
+                          c.site and c.site.url) for c in credentials]
+
+
+def test_credential_rows_match_response_model() -> None:
+    owner = User(id=1, username="test_user", email="test_user@gmail.com", hashed_password="hash", public_key="key")
+    credentials = make_credentials(owner)
+
+    adapter = TypeAdapter(List[CredentialRead])
+    expected = adapter.dump_json(adapter.validate_python(credentials, from_attributes=True))
+    assert credential_rows_to_json(to_rows(credentials), owner=owner) == expected
+
+
+def test_compact_rows_sideload_each_site_once() -> None:
+    owner = User(id=1, username="test_user", email="test_user@gmail.com", hashed_password="hash", public_key="key")
+    credentials = make_credentials(owner)
+
+    page = CredentialCompactPage(credentials=[c.model_dump() for c in credentials],
+                                 sites={c.site.id: c.site.model_dump() for c in credentials if c.site})
+    assert credential_rows_to_compact_json(to_rows(credentials)) == page.model_dump_json().encode()
+    assert list(page.sites) == [3]
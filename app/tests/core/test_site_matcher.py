@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from app.core.site_matcher import SiteMatcher, normalize_host, registrable_labels
+from app.models.site import SiteRead
+
+
+def matcher_with(*urls: str) -> SiteMatcher:
+    matcher = SiteMatcher(max_age=300)
+    matcher.begin_rebuild()
+    matcher.finish_rebuild(SiteRead(id=i, name=f"Site_{i}", url=url) for i, url in enumerate(urls, start=1))
+    return matcher
+
+
+def test_normalize_host() -> None:
+    assert normalize_host("HTTPS://Login.Example.COM.:8443/path?q=1") == "login.example.com"
+    assert normalize_host("example.com/login") == "example.com"
+    assert normalize_host("https://bücher.de") == "xn--bcher-kva.de"
+    assert normalize_host("https://") is None
+
+
+def test_registrable_domain_follows_multi_label_suffixes() -> None:
+    assert registrable_labels("a.b.example.com") == 2
+    assert registrable_labels("www.bbc.co.uk") == 3
+    assert registrable_labels("localhost") == 1
+    assert registrable_labels("192.168.0.1") == 1
+
+
+def test_longest_registered_domain_wins() -> None:
+    matcher = matcher_with("https://github.com", "https://gist.github.com", "https://bbc.co.uk")
+    assert matcher.match("https://www.github.com/login").id == 1
+    assert matcher.match("https://api.gist.github.com").id == 2
+    assert matcher.match("https://news.bbc.co.uk").id == 3
+    # Sharing only a public suffix is not a match
+    assert matcher.match("https://itv.co.uk") is None
+    assert matcher.match("https://gitlab.com") is None
+
+
+def test_registrable_domain_matches_sibling_subdomains() -> None:
+    matcher = matcher_with("https://accounts.google.com", "http://127.0.0.1:8080")
+    assert matcher.match("https://mail.google.com").id == 1
+    assert matcher.match("google.com").id == 1
+    assert matcher.match("http://127.0.0.1/admin").id == 2
+    assert matcher.match("http://127.0.0.2") is None
+
+
+def test_writes_update_the_trie_in_place() -> None:
+    matcher = matcher_with("https://github.com")
+    matcher.put(SiteRead(id=2, name="Gitlab", url="https://gitlab.com"))
+    assert matcher.match("gitlab.com").id == 2
+
+    matcher.remove(1)
+    assert matcher.match("github.com") is None
+    assert matcher.stats() == {"sites": 1, "hosts": 1, "builds": 1}
+
+    # Writes made while the catalog is read are replayed onto the rebuilt trie
+    matcher.begin_rebuild()
+    matcher.remove(2)
+    matcher.finish_rebuild([SiteRead(id=2, name="Gitlab", url="https://gitlab.com")])
+    assert matcher.match("gitlab.com") is None
+
+
+@pytest.mark.asyncio
+async def test_overlapping_rebuilds_read_the_catalog_once() -> None:
+    matcher = SiteMatcher(max_age=60)
+    catalog_read = asyncio.Event()
+    reads = []
+
+    async def read_sites() -> list[SiteRead]:
+        reads.append(len(reads))
+        await catalog_read.wait()
+        return [SiteRead(id=1, name="Github", url="https://github.com")]
+
+    first = asyncio.create_task(matcher.rebuild(read_sites))
+    second = asyncio.create_task(matcher.rebuild(read_sites))
+    await asyncio.sleep(0)
+    # Created while the first rebuild reads the catalog, the second one must not drop it
+    matcher.put(SiteRead(id=2, name="Gitlab", url="https://gitlab.com"))
+    catalog_read.set()
+    await asyncio.gather(first, second)
+
+    assert reads == [0]
+    assert matcher.match("github.com").id == 1 and matcher.match("gitlab.com").id == 2
+    assert matcher.stats()["builds"] == 1
@@ -0,0 +1,61 @@
+import time
+
+import pytest
+from aioredis import Redis
+
+from app.core.user_cache import UserCache
+from app.models.user import User
+
+
+def make_user(username: str) -> User:
+    return User(id=1, username=username, email=f"{username}@gmail.com", hashed_password="hash", public_key="key")
+
+
+@pytest.mark.asyncio
+async def test_user_cache_hit_and_invalidate() -> None:
+    cache = UserCache(max_size=2, ttl=30, shared_ttl=300)
+    assert await cache.get("test_user") is None
+
+    await cache.set(make_user("test_user"), token_expires_at=time.time() + 60)
+    cached_user = await cache.get("test_user")
+    assert cached_user is not None and cached_user.public_key == "key"
+    assert cache.stats()["hits"] == 1
+
+    await cache.invalidate("test_user")
+    assert await cache.get("test_user") is None
+
+
+@pytest.mark.asyncio
+async def test_user_cache_entries_do_not_outlive_token() -> None:
+    cache = UserCache(max_size=2, ttl=30, shared_ttl=300)
+    await cache.set(make_user("test_user"), token_expires_at=time.time() - 1)
+    assert await cache.get("test_user") is None
+
+
+@pytest.mark.asyncio
+async def test_user_cache_evicts_least_recently_used() -> None:
+    cache = UserCache(max_size=2, ttl=30, shared_ttl=300)
+    expires_at = time.time() + 60
+    for username in ("user_0", "user_1", "user_2"):
+        await cache.set(make_user(username), token_expires_at=expires_at)
+    assert await cache.get("user_0") is None
+    assert await cache.get("user_2") is not None
+
+
+@pytest.mark.asyncio
+async def test_shared_tier_lookup_is_a_single_round_trip(redis_client: Redis, monkeypatch: pytest.MonkeyPatch) -> None:
+    writer, reader = (UserCache(max_size=2, ttl=30, shared_ttl=300) for _ in range(2))
+    writer.redis = reader.redis = redis_client
+    await writer.set(make_user("shared_user"), token_expires_at=time.time() + 20)
+
+    # Single commands are never sent, the entry and its TTL come from one pipeline
+    for command in ("get", "ttl"):
+        monkeypatch.setattr(redis_client, command, lambda *args, **kwargs: pytest.fail("separate round trip"))
+    try:
+        cached_user = await reader.get("shared_user")
+        assert cached_user is not None and cached_user.hashed_password is None
+        assert reader.stats()["shared_hits"] == 1
+        # The local copy expires with the shared entry, not after the longer local ttl
+        assert reader._users["shared_user"][1] <= time.time() + 20
+    finally:
+        await writer.invalidate("shared_user")
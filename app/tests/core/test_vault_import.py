@@ -0,0 +1,41 @@
+from typing import AsyncIterator
+
+import pytest
+
+from app.core.vault_import import ImportStopped, iter_csv_records, iter_lines
+
+
+async def collect(iterator: AsyncIterator) -> list:
+    return [item async for item in iterator]
+
+
+async def chunks_of(*chunks: bytes) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.asyncio
+async def test_iter_lines_splits_across_chunks() -> None:
+    lines = await collect(iter_lines(chunks_of(b"\xef\xbb\xbfa,b\r\nc", b",d\n", b"e,f")))
+    assert lines == [(1, "a,b"), (2, "c,d"), (3, "e,f")]
+
+
+@pytest.mark.asyncio
+async def test_iter_lines_stops_on_a_line_without_end() -> None:
+    async def endless() -> AsyncIterator[bytes]:
+        yield b"name,password\n"
+        while True:
+            yield b"x" * 1024
+
+    # Without the bound this would buffer forever
+    with pytest.raises(ImportStopped) as stopped:
+        await collect(iter_lines(endless(), max_line_length=10_000))
+    assert stopped.value.line == 2
+
+
+@pytest.mark.asyncio
+async def test_iter_csv_records_bounds_quoted_fields_spanning_lines() -> None:
+    lines = iter_lines(chunks_of(b'name,password\n"open', b"\nquoted\n" * 100), max_line_length=100)
+    with pytest.raises(ImportStopped) as stopped:
+        await collect(iter_csv_records(lines, max_record_length=100))
+    assert stopped.value.line == 2
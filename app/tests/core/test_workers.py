@@ -0,0 +1,36 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.core.workers import WorkerPool, WorkerPoolFull
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_runs_function_off_the_event_loop() -> None:
+    pool = WorkerPool(name="test", max_workers=1, max_queue=1)
+    thread_name = await pool.run(lambda: threading.current_thread().name)
+    assert thread_name != threading.current_thread().name
+    assert pool.stats()["completed"] == 1
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_rejects_jobs_when_queue_is_full() -> None:
+    pool = WorkerPool(name="test", max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    running = asyncio.ensure_future(pool.run(release.wait))
+    await asyncio.sleep(0.05)
+    waiting = asyncio.ensure_future(pool.run(release.wait))
+    await asyncio.sleep(0.05)
+    assert pool.queue_depth == 1
+
+    with pytest.raises(WorkerPoolFull):
+        await pool.run(release.wait)
+    assert pool.stats()["rejected"] == 1
+
+    release.set()
+    await asyncio.gather(running, waiting)
+    assert pool.queue_depth == 0
+    pool.shutdown()
@@ -0,0 +1,29 @@
+import pytest
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.site import SiteCRUD
+from app.models.site import Site
+from app.tests.conftest import db_site_quantity
+
+
+@pytest.mark.asyncio
+async def test_read_site_does_not_load_credentials_by_default(loaded_db_session: AsyncSession) -> None:
+    loaded_db_session.expunge_all()
+    site = await SiteCRUD(loaded_db_session).read(unique_id=1)
+    with pytest.raises(InvalidRequestError):
+        _ = site.credentials
+
+
+@pytest.mark.asyncio
+async def test_read_site_loads_requested_relationships(loaded_db_session: AsyncSession) -> None:
+    loaded_db_session.expunge_all()
+    site = await SiteCRUD(loaded_db_session).read(unique_id=1, load=(Site.credentials,))
+    assert len(site.credentials) > 0
+
+
+@pytest.mark.asyncio
+async def test_read_many_reduced_returns_only_id_and_name(loaded_db_session: AsyncSession) -> None:
+    sites = await SiteCRUD(loaded_db_session).read_many_reduced(offset=0, limit=50)
+    assert len(sites) == db_site_quantity
+    assert sites[0].model_dump() == {"id": 1, "name": "Site_0"}
@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.search_index import search_index
+from app.crud.credential import CredentialCRUD
+from app.crud.site import SiteCRUD
+from app.models.credential import CredentialBatchItem, CredentialCreate, CredentialUpdate
+from app.models.site import SiteUpdate
+from app.models.user import User
+from app.tests.conftest import db_credential_quantity
+
+# Past every credential loaded by the database fixture, which were written before versioning
+AFTER_FIXTURES = (0, db_credential_quantity)
+
+
+@pytest.mark.asyncio
+async def test_writes_take_increasing_versions_of_the_owner(loaded_db_session: AsyncSession) -> None:
+    crud = CredentialCRUD(loaded_db_session)
+    owner = await loaded_db_session.get(User, 1)
+
+    created = await crud.create(CredentialCreate(nickname="Synced", encrypted_password="cipher", user_id=1,
+                                                 site_id=None), owner=owner)
+    batch = await crud.create_many(user_id=1, items=[CredentialBatchItem(nickname=f"Synced_{i}",
+                                                                         encrypted_password="cipher")
+                                                     for i in range(2)])
+    updated = await crud.update(created.id, CredentialUpdate(nickname="Synced_renamed", encrypted_password="cipher"),
+                                user_id=1, owner=owner)
+    assert await crud.delete(batch.created[0].id, user_id=1)
+
+    credentials, tombstones, more = await crud.read_changes(user_id=1, after=None, limit=100)
+    assert not more
+    assert [c.version for c in credentials] == [0, 0, 3, 4]
+    assert [(t.credential_id, t.version) for t in tombstones] == [(batch.created[0].id, 5)]
+    assert credentials[-1].id == updated.id
+
+    credentials, tombstones, _ = await crud.read_changes(user_id=1, after=(3, batch.created[1].id), limit=100)
+    assert [c.nickname for c in credentials] == ["Synced_renamed"]
+    assert len(tombstones) == 1
+
+    # Another user's changes are never returned
+    credentials, tombstones, _ = await crud.read_changes(user_id=2, after=AFTER_FIXTURES, limit=100)
+    assert credentials == [] and tombstones == []
+
+
+@pytest.mark.asyncio
+async def test_read_changes_pages_in_version_order(loaded_db_session: AsyncSession) -> None:
+    crud = CredentialCRUD(loaded_db_session)
+    for i in range(3):
+        await crud.create(CredentialCreate(nickname=f"Paged_{i}", encrypted_password="cipher", user_id=1,
+                                           site_id=None))
+
+    credentials, tombstones, more = await crud.read_changes(user_id=1, after=AFTER_FIXTURES, limit=2)
+    assert more and [c.nickname for c in credentials] == ["Paged_0", "Paged_1"]
+
+    after = credentials[-1].version, credentials[-1].id
+    credentials, tombstones, more = await crud.read_changes(user_id=1, after=after, limit=2)
+    assert not more and [c.nickname for c in credentials] == ["Paged_2"]
+
+
+@pytest.mark.asyncio
+async def test_search_reads_changes_written_by_other_workers(loaded_db_session: AsyncSession,
+                                                             monkeypatch: pytest.MonkeyPatch) -> None:
+    crud = CredentialCRUD(loaded_db_session)
+    created = await crud.create(CredentialCreate(nickname="Local", encrypted_password="cipher", user_id=1,
+                                                 site_id=None))
+    assert await crud.search(user_id=1, query="local", limit=10) == [created.id]
+    builds = search_index.stats()["builds"]
+
+    # Writes of another worker never touch this worker's index, only the change version tells about them
+    with monkeypatch.context() as patched:
+        patched.setattr(search_index, "put", lambda *args: None)
+        patched.setattr(search_index, "remove", lambda *args: None)
+        await crud.update(created.id, CredentialUpdate(nickname="Remote", encrypted_password="cipher"), user_id=1)
+        batch = await crud.create_many(user_id=1, items=[CredentialBatchItem(nickname="Remote batch",
+                                                                             encrypted_password="cipher")])
+        await crud.delete(batch.created[0].id, user_id=1)
+
+    assert await crud.search(user_id=1, query="local", limit=10) == []
+    assert await crud.search(user_id=1, query="remote", limit=10) == [created.id]
+    # Brought up to date in place rather than rebuilt
+    assert search_index.stats()["builds"] == builds
+
+
+@pytest.mark.asyncio
+async def test_site_renames_reach_search_indexes_through_versions(loaded_db_session: AsyncSession) -> None:
+    crud = CredentialCRUD(loaded_db_session)
+    created = await crud.create(CredentialCreate(nickname="Renamed site", encrypted_password="cipher", user_id=1,
+                                                 site_id=2))
+    assert created.id in await crud.search(user_id=1, query="site_1", limit=50)
+    version = await loaded_db_session.scalar(select(User.change_version).where(User.id == 1))
+    builds = search_index.stats()["builds"]
+
+    # Nothing clears the index, other workers learn about the rename like about any credential write
+    await SiteCRUD(loaded_db_session).update(2, SiteUpdate(name="Renamed_catalog", url="https://site1.com"))
+    await loaded_db_session.refresh(created)
+    assert created.version == version + 1
+    assert await loaded_db_session.scalar(select(User.change_version).where(User.id == 1)) == version + 1
+
+    assert created.id in await crud.search(user_id=1, query="renamed_catalog", limit=50)
+    assert created.id not in await crud.search(user_id=1, query="site_1", limit=50)
+    assert search_index.stats()["builds"] == builds
+
+    changes, _, _ = await crud.read_changes(user_id=1, after=(version, 0), limit=50)
+    assert created.id in [credential.id for credential in changes]
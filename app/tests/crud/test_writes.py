@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+from typing import Any, Iterator, List
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.credential import CredentialCRUD
+from app.crud.data_key import DataKeyCRUD
+from app.crud.site import SiteCRUD
+from app.crud.user import UserCRUD
+from app.models.credential import CredentialCreate, CredentialUpdate
+from app.models.data_key import DataKey
+from app.models.site import SiteCreate, SiteUpdate
+from app.models.user import User, UserCreateInternal
+
+
+@contextmanager
+def round_trips(session: AsyncSession) -> Iterator[List[str]]:
+    """
+    Records the first keyword of every statement sent through the session's engine, commits included
+    """
+    engine = session.bind.sync_engine
+    trips: List[str] = []
+
+    def before_cursor_execute(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        trips.append(statement.split(maxsplit=1)[0].upper())
+
+    def commit(conn: Any) -> None:
+        trips.append("COMMIT")
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "commit", commit)
+    try:
+        yield trips
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        event.remove(engine, "commit", commit)
+
+
+@pytest.mark.asyncio
+async def test_site_writes_version_credentials_in_the_same_transaction(loaded_db_session: AsyncSession) -> None:
+    crud = SiteCRUD(loaded_db_session)
+
+    with round_trips(loaded_db_session) as trips:
+        site = await crud.create(SiteCreate(name="Site_new", url="https://new.com"))
+    assert trips == ["INSERT", "COMMIT"]
+    assert site.id is not None and site.url == "https://new.com"
+
+    # The owners of the site's credentials get a new change version, the site has none yet
+    with round_trips(loaded_db_session) as trips:
+        site = await crud.update(site.id, SiteUpdate(name="Site_renamed"))
+    assert trips == ["UPDATE", "UPDATE", "COMMIT"]
+    assert site.name == "Site_renamed"
+
+    with round_trips(loaded_db_session) as trips:
+        assert await crud.delete(site.id)
+    assert trips == ["UPDATE", "DELETE", "COMMIT"]
+    assert await crud.update(site.id, SiteUpdate(name="Site_gone")) is None
+
+
+@pytest.mark.asyncio
+async def test_credential_writes_fold_ownership_into_the_statement(loaded_db_session: AsyncSession) -> None:
+    # Every credential write first takes the next change version of the owner, see test_sync
+    crud = CredentialCRUD(loaded_db_session)
+    owner = await loaded_db_session.get(User, 1)
+    # The site is not in the identity map, the worst case for the write paths
+    loaded_db_session.expunge_all()
+
+    credential_data = CredentialCreate(nickname="Credential_new", encrypted_password="cipher", user_id=1, site_id=1)
+    with round_trips(loaded_db_session) as trips:
+        credential = await crud.create(credential_data, owner=owner)
+    assert trips == ["UPDATE", "INSERT", "SELECT", "COMMIT"]
+    assert credential.site.id == 1 and credential.owner.username == owner.username
+
+    with round_trips(loaded_db_session) as trips:
+        credential = await crud.update(credential.id, CredentialUpdate(nickname="Credential_renamed",
+                                                                       encrypted_password="cipher"),
+                                       user_id=1, owner=owner)
+    assert trips == ["UPDATE", "UPDATE", "COMMIT"]
+    assert credential.nickname == "Credential_renamed" and credential.site.id == 1
+
+    # Credential 2 belongs to another user, nothing is deleted and no read happens first
+    with round_trips(loaded_db_session) as trips:
+        assert not await crud.delete(2, user_id=1)
+    assert trips == ["UPDATE", "DELETE", "COMMIT"]
+    assert await crud.read(2) is not None
+
+    # The delete leaves a tombstone behind
+    with round_trips(loaded_db_session) as trips:
+        assert await crud.delete(credential.id, user_id=1)
+    assert trips == ["UPDATE", "DELETE", "INSERT", "COMMIT"]
+
+
+@pytest.mark.asyncio
+async def test_user_writes_are_single_statements(loaded_db_session: AsyncSession) -> None:
+    crud = UserCRUD(loaded_db_session)
+
+    with round_trips(loaded_db_session) as trips:
+        user = await crud.create(UserCreateInternal(username="new_user", email="new_user@gmail.com",
+                                                    password="new_password", public_key="key"))
+    assert trips == ["INSERT", "COMMIT"]
+    assert user.id is not None and user.hashed_password != "new_password"
+
+    with round_trips(loaded_db_session) as trips:
+        assert await crud.delete(user.id)
+    assert trips == ["DELETE", "COMMIT"]
+
+
+@pytest.mark.asyncio
+async def test_data_key_update_rotates_once(loaded_db_session: AsyncSession) -> None:
+    crud = DataKeyCRUD(loaded_db_session)
+    first = await crud.create(DataKey(user_id=1, wrapped_key="first"))
+
+    with round_trips(loaded_db_session) as trips:
+        second = await crud.update(first.id, DataKey(user_id=2, wrapped_key="second"))
+    assert trips == ["UPDATE", "INSERT", "COMMIT"]
+    assert second.id != first.id and second.user_id == 1 and second.retired_at is None
+    assert (await crud.read(first.id)).retired_at is not None
+
+    # A retired key is never rotated again, concurrent rotations make a single successor
+    assert await crud.update(first.id, DataKey(user_id=1, wrapped_key="third")) is None
+    assert [key.id for key in await crud.read_many(offset=0, limit=100) if key.user_id == 1] == [first.id, second.id]
@@ -0,0 +1,6 @@
+"""
+Benchmarks for the API hot paths
+
+Each module can be run on its own, e.g. `python -m benchmarks.export`, and prints its results as JSON.
+They use a throwaway SQLite database so no PostgreSQL or Redis server is needed.
+"""
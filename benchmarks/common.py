@@ -0,0 +1,71 @@
+import json
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncGenerator
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models.credential import Credential
+from app.models.site import Site
+from app.models.user import User
+
+
+@asynccontextmanager
+async def temporary_database() -> AsyncGenerator[AsyncEngine, None]:
+    """
+    Yields an engine bound to an empty SQLite database that is removed afterwards
+    """
+    directory = tempfile.mkdtemp(prefix="pyvault-bench-")
+    path = os.path.join(directory, "bench.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    try:
+        yield engine
+    finally:
+        await engine.dispose()
+        os.remove(path)
+        os.rmdir(directory)
+
+
+def session_maker(engine: AsyncEngine) -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def seed_vault(engine: AsyncEngine, credential_quantity: int, site_quantity: int = 10,
+                     public_key: str = "public_key") -> int:
+    """
+    Creates a user owning credential_quantity credentials spread over site_quantity sites, returns the user id
+    """
+    async with session_maker(engine)() as session:
+        user = User(username="bench_user", email="bench_user@gmail.com", hashed_password="hash", public_key=public_key)
+        session.add(user)
+        for i in range(site_quantity):
+            session.add(Site(name=f"Site_{i}", url=f"https://site{i}.com"))
+        await session.commit()
+        await session.refresh(user)
+
+        created_at = datetime.utcnow()
+        for start in range(0, credential_quantity, 5000):
+            rows = [{
+                "nickname": f"Credential{i}",
+                "email": f"user_{i}@gmail.com",
+                "username": f"user_{i}",
+                "encrypted_password": "x" * 344,
+                "favorite": False,
+                "user_id": user.id,
+                "site_id": (i % site_quantity) + 1 if site_quantity else None,
+                "created_at": created_at,
+            } for i in range(start, min(start + 5000, credential_quantity))]
+            await session.execute(insert(Credential).values(rows))
+        await session.commit()
+        return user.id
+
+
+def report(name: str, results: Any) -> None:
+    print(json.dumps({"benchmark": name, "results": results}, indent=2, default=str))
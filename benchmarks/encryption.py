@@ -0,0 +1,46 @@
+"""
+Credential encryption throughput, RSA-OAEP per credential against an RSA wrapped AES-GCM data key
+
+    python -m benchmarks.encryption [credential quantity ...]
+"""
+import sys
+import time
+
+from app.core.cypt_utils import (encrypt_many_with_data_key, encrypt_many_with_key, generate_data_key,
+                                 generate_key_pair, wrap_data_key)
+from benchmarks.common import report
+
+
+def encrypt_rsa(public_key: str, values: list[str]) -> None:
+    encrypt_many_with_key(public_key, values)
+
+
+def encrypt_envelope(public_key: str, values: list[str]) -> None:
+    # The wrap is paid once per data key, it is included so small batches show its amortized cost
+    data_key = generate_data_key()
+    wrap_data_key(public_key, data_key)
+    encrypt_many_with_data_key(data_key, values)
+
+
+def measure(encrypt, public_key: str, values: list[str]) -> dict:
+    start = time.perf_counter()
+    encrypt(public_key, values)
+    elapsed = time.perf_counter() - start
+    return {"seconds": round(elapsed, 4), "credentials_per_second": round(len(values) / elapsed)}
+
+
+def main(quantities: list[int]) -> None:
+    public_key, _ = generate_key_pair()
+    results = []
+    for quantity in quantities:
+        values = [f"password_{i}" for i in range(quantity)]
+        results.append({
+            "credentials": quantity,
+            "rsa_oaep": measure(encrypt_rsa, public_key, values),
+            "envelope": measure(encrypt_envelope, public_key, values),
+        })
+    report("encryption", results)
+
+
+if __name__ == "__main__":
+    main([int(q) for q in sys.argv[1:]] or [1, 100, 10000])
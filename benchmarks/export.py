@@ -0,0 +1,67 @@
+"""
+Vault export throughput, streaming through a server-side cursor against paging with OFFSET/LIMIT
+
+    python -m benchmarks.export [credential quantity ...]
+"""
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from app.crud.credential import CredentialCRUD
+from app.models.credential import CredentialExport
+from benchmarks.common import report, seed_vault, session_maker, temporary_database
+
+
+async def export_streaming(crud: CredentialCRUD, user_id: int) -> int:
+    rows = 0
+    async for credential in crud.stream_personal(user_id=user_id):
+        CredentialExport.model_validate(credential).model_dump_json()
+        rows += 1
+    return rows
+
+
+async def export_paginated(crud: CredentialCRUD, user_id: int, page_size: int = 50) -> int:
+    rows, offset = 0, 0
+    while True:
+        page = await crud.read_personal_many(offset=offset, limit=page_size, user_id=user_id, site_id=None, load=())
+        for credential in page:
+            CredentialExport.model_validate(credential).model_dump_json()
+        crud.db_session.expunge_all()
+        rows += len(page)
+        offset += page_size
+        if len(page) < page_size:
+            return rows
+
+
+async def measure(engine, user_id: int, export) -> dict:
+    # Throughput and memory are measured on separate runs since tracing allocations slows everything down
+    async with session_maker(engine)() as session:
+        start = time.perf_counter()
+        rows = await export(CredentialCRUD(session), user_id)
+        elapsed = time.perf_counter() - start
+
+    async with session_maker(engine)() as session:
+        tracemalloc.start()
+        await export(CredentialCRUD(session), user_id)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {"rows": rows, "seconds": round(elapsed, 3), "rows_per_second": round(rows / elapsed),
+            "peak_memory_kb": round(peak / 1024)}
+
+
+async def main(quantities: list[int]) -> None:
+    results = []
+    for quantity in quantities:
+        async with temporary_database() as engine:
+            user_id = await seed_vault(engine, quantity)
+            results.append({
+                "credentials": quantity,
+                "streaming": await measure(engine, user_id, export_streaming),
+                "paginated": await measure(engine, user_id, export_paginated),
+            })
+    report("export", results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(q) for q in sys.argv[1:]] or [1000, 10000, 50000]))
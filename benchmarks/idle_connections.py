@@ -0,0 +1,182 @@
+"""
+Idle change event streams a single worker holds, and how fast a change reaches all of them
+
+    python -m benchmarks.idle_connections [--batch 200] [connections ...]
+
+The application runs on one uvicorn worker in this process with a SQLite vault and fakeredis, clients run in a
+separate process opening raw sockets to /dashboard/credentials/events. For every level the worker's resident memory
+per connection is reported, then one change is published through Redis and the time until every stream received
+it is measured. Levels are capped by the open file limit of both processes.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import resource
+import socket
+import statistics
+import sys
+import time
+from datetime import timedelta
+from multiprocessing.connection import Connection
+from typing import Any, AsyncGenerator, List
+
+import uvicorn
+from fakeredis.aioredis import FakeRedis
+from sqlalchemy import event
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.auth_utils import create_access_token
+from app.core.notifications import change_notifier
+from app.dependencies.db import get_db, get_session_maker
+from app.dependencies.redis import get_redis
+from app.main import app
+from benchmarks.common import report, seed_vault, session_maker, temporary_database
+
+
+def raise_file_limit() -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def resident_kb() -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def open_stream(port: int, token: str) -> asyncio.StreamReader:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET /dashboard/credentials/events HTTP/1.1\r\nHost: bench\r\n"
+                 f"Authorization: Bearer {token}\r\n\r\n".encode())
+    await writer.drain()
+    # The retry line is the first event, the stream is subscribed once it arrives
+    await reader.readuntil(b"retry:")
+    # Keeps the writer alive with the reader, closing it would end the stream
+    reader.writer = writer
+    return reader
+
+
+async def run_clients(port: int, token: str, connections: int, batch: int, pipe: Connection) -> None:
+    readers: List[asyncio.StreamReader] = []
+    for start in range(0, connections, batch):
+        readers.extend(await asyncio.gather(*[open_stream(port, token)
+                                              for _ in range(start, min(start + batch, connections))]))
+    pipe.send("ready")
+
+    # The server sends the wall clock time it published at, both processes share the clock
+    published_at = await asyncio.get_running_loop().run_in_executor(None, pipe.recv)
+
+    async def wait_event(reader: asyncio.StreamReader) -> float:
+        await reader.readuntil(b"event: change")
+        return time.time() - published_at
+
+    latencies = await asyncio.gather(*[wait_event(reader) for reader in readers])
+    pipe.send(sorted(latencies))
+    for reader in readers:
+        reader.writer.close()
+
+
+def client_process(port: int, token: str, connections: int, batch: int, pipe: Connection) -> None:
+    raise_file_limit()
+    asyncio.run(run_clients(port, token, connections, batch, pipe))
+
+
+async def measure_level(port: int, token: str, user_id: int, connections: int, batch: int, version: int,
+                        checked_out: List[int]) -> dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    before_kb = resident_kb()
+    pipe, child_pipe = multiprocessing.Pipe()
+    process = multiprocessing.get_context("spawn").Process(
+        target=client_process, args=(port, token, connections, batch, child_pipe))
+    start = time.perf_counter()
+    process.start()
+
+    await loop.run_in_executor(None, pipe.recv)
+    connect_seconds = time.perf_counter() - start
+    held = change_notifier.stats()["connections"]
+    db_connections = checked_out[0]
+    after_kb = resident_kb()
+
+    pipe.send(time.time())
+    await change_notifier.publish(user_id, version)
+    latencies = await loop.run_in_executor(None, pipe.recv)
+    await loop.run_in_executor(None, process.join)
+
+    return {
+        "connections": connections,
+        "held": held,
+        "db_connections_checked_out": db_connections,
+        "connect_seconds": round(connect_seconds, 2),
+        "worker_rss_mb": round(after_kb / 1024, 1),
+        "kb_per_connection": round((after_kb - before_kb) / connections, 2),
+        "fanout_p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "fanout_max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+async def run(levels: List[int], batch: int) -> dict[str, Any]:
+    file_limit = raise_file_limit()
+    async with temporary_database() as engine:
+        user_id = await seed_vault(engine, 0, site_quantity=0)
+        # Streams must not hold a database connection once authenticated
+        checked_out = [0]
+        event.listen(engine.sync_engine, "checkout", lambda *args: checked_out.__setitem__(0, checked_out[0] + 1))
+        event.listen(engine.sync_engine, "checkin", lambda *args: checked_out.__setitem__(0, checked_out[0] - 1))
+        token = create_access_token("bench_user", timedelta(hours=1))
+
+        async def get_db_override() -> AsyncGenerator[AsyncSession, None]:
+            async with session_maker(engine)() as db_session:
+                yield db_session
+
+        redis = FakeRedis()
+        app.dependency_overrides[get_db] = get_db_override
+        app.dependency_overrides[get_session_maker] = lambda: session_maker(engine)
+        app.dependency_overrides[get_redis] = lambda: redis
+        change_notifier.redis = redis
+        await change_notifier.start()
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off", log_level="error",
+                                               backlog=max(levels)))
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+
+        results = []
+        try:
+            # First requests import and cache what later ones reuse, that memory is not per connection
+            await measure_level(port, token, user_id, min(50, batch), batch, 0, checked_out)
+            while change_notifier.stats()["connections"]:
+                await asyncio.sleep(0.1)
+
+            for version, connections in enumerate(levels, start=1):
+                results.append(await measure_level(port, token, user_id, connections, batch, version, checked_out))
+                # Streams of the previous level are torn down before the next one is measured
+                while change_notifier.stats()["connections"]:
+                    await asyncio.sleep(0.1)
+        finally:
+            server.should_exit = True
+            await serving
+            await change_notifier.stop()
+            change_notifier.redis = None
+            app.dependency_overrides.clear()
+
+    return {"file_limit": file_limit, "levels": results}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("levels", nargs="*", type=int, default=[1000, 5000])
+    parser.add_argument("--batch", type=int, default=200, help="connections opened concurrently by the client")
+    args = parser.parse_args()
+    report("idle_connections", asyncio.run(run(args.levels, args.batch)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""
+End-to-end load test of the API, virtual users drive the ASGI app through httpx with a weighted request mix
+
+    python -m benchmarks.load [--users 8] [--iterations 50] [--save baseline.json] [--compare baseline.json]
+
+Every virtual user registers and logs in, then sends `iterations` requests picked from MIX. The database is a
+throwaway SQLite file and Redis is replaced by fakeredis, so no server is needed. With --compare the run is
+checked against a saved result and the exit code is 1 when an endpoint regressed by more than --threshold.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Any, AsyncGenerator, Optional
+
+from fakeredis.aioredis import FakeRedis
+from httpx import AsyncClient
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.auth_utils import hashing_pool
+from app.core.cypt_utils import encryption_pool, key_pair_pool
+from app.dependencies.db import get_db, get_session_maker
+from app.dependencies.redis import get_redis
+from app.main import app
+from app.models.site import Site
+from benchmarks.common import report, session_maker, temporary_database
+
+# Relative weight of each request once a user is logged in
+MIX = {
+    "create_credential": 3,
+    "list_credentials": 5,
+    "list_sites": 2,
+    "delete_credential": 1,
+}
+SITE_QUANTITY = 20
+
+# Endpoint of the request in flight, the ASGI transport runs the app in the caller's task
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("current_endpoint", default="setup")
+
+
+class LoadRecorder:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.queries: dict[str, int] = defaultdict(int)
+
+    def count_queries(self, engine: AsyncEngine) -> None:
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def before_cursor_execute(*args: Any) -> None:
+            self.queries[current_endpoint.get()] += 1
+
+    async def request(self, client: AsyncClient, endpoint: str, method: str, url: str, expected: int,
+                      **kwargs: Any) -> Optional[Any]:
+        token = current_endpoint.set(endpoint)
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        finally:
+            self.latencies[endpoint].append(time.perf_counter() - start)
+            current_endpoint.reset(token)
+        if response.status_code != expected:
+            self.errors[endpoint] += 1
+            return None
+        return response.json() if response.content else True
+
+    def summary(self, elapsed: float) -> dict[str, Any]:
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors[endpoint],
+                "throughput": round(len(latencies) / elapsed, 2),
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "queries_per_request": round(self.queries[endpoint] / len(latencies), 2),
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {"seconds": round(elapsed, 3), "requests": total, "throughput": round(total / elapsed, 2),
+                "endpoints": endpoints}
+
+
+def percentile(sorted_values: list[float], rank: int) -> float:
+    # Nearest rank, in milliseconds
+    index = max(0, -(-len(sorted_values) * rank // 100) - 1)
+    return round(sorted_values[index] * 1000, 3)
+
+
+async def virtual_user(client: AsyncClient, recorder: LoadRecorder, number: int, iterations: int,
+                       rng: random.Random) -> None:
+    username, password = f"load_user_{number}", "load_password"
+    user_data = {"username": username, "email": f"{username}@gmail.com", "password": password}
+    if not await recorder.request(client, "register", "POST", "/auth/register", 201, json=user_data):
+        return
+    token = await recorder.request(client, "login", "POST", "/auth/login", 200,
+                                   data={"username": username, "password": password})
+    if not token:
+        return
+    headers = {"Authorization": f"Bearer {token['access_token']}"}
+
+    owned: list[int] = []
+    endpoints, weights = list(MIX), list(MIX.values())
+    for i in range(iterations):
+        endpoint = rng.choices(endpoints, weights)[0]
+        if endpoint == "delete_credential" and not owned:
+            endpoint = "create_credential"
+
+        if endpoint == "create_credential":
+            credential = {"nickname": f"{username}_{i}", "email": user_data["email"], "username": username,
+                          "encrypted_password": f"password_{i}", "favorite": False, "user_id": 0,
+                          "site_id": rng.randint(1, SITE_QUANTITY)}
+            created = await recorder.request(client, endpoint, "POST", "/dashboard/credentials", 201,
+                                             json=credential, headers=headers)
+            if created:
+                owned.append(created["id"])
+        elif endpoint == "list_credentials":
+            await recorder.request(client, endpoint, "GET", "/dashboard/credentials", 200,
+                                   params={"limit": 10}, headers=headers)
+        elif endpoint == "list_sites":
+            await recorder.request(client, endpoint, "GET", "/dashboard/sites", 200, params={"limit": 50})
+        else:
+            credential_id = owned.pop(rng.randrange(len(owned)))
+            await recorder.request(client, endpoint, "DELETE", f"/dashboard/credentials/{credential_id}", 200,
+                                   headers=headers)
+
+
+async def run(users: int, iterations: int, seed: int) -> dict[str, Any]:
+    recorder = LoadRecorder()
+    async with temporary_database() as engine:
+        async with session_maker(engine)() as session:
+            session.add_all([Site(name=f"Site_{i}", url=f"https://site{i}.com") for i in range(SITE_QUANTITY)])
+            await session.commit()
+        recorder.count_queries(engine)
+
+        async def get_db_override() -> AsyncGenerator[AsyncSession, None]:
+            async with session_maker(engine)() as db_session:
+                yield db_session
+
+        redis = FakeRedis()
+        app.dependency_overrides[get_db] = get_db_override
+        app.dependency_overrides[get_session_maker] = lambda: session_maker(engine)
+        app.dependency_overrides[get_redis] = lambda: redis
+        try:
+            async with AsyncClient(app=app, base_url="http://127.0.0.1:8000") as client:
+                start = time.perf_counter()
+                await asyncio.gather(*[virtual_user(client, recorder, number, iterations, random.Random(seed + number))
+                                       for number in range(users)])
+                elapsed = time.perf_counter() - start
+        finally:
+            app.dependency_overrides.clear()
+            hashing_pool.shutdown()
+            key_pair_pool.shutdown()
+            encryption_pool.shutdown()
+
+    return {"users": users, "iterations": iterations, "seed": seed, **recorder.summary(elapsed)}
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], threshold: float) -> dict[str, Any]:
+    """
+    Relative change of every endpoint against the baseline, slower latency and lower throughput are regressions
+    """
+    endpoints = {}
+    regressions = []
+    for endpoint, metrics in current["endpoints"].items():
+        previous = baseline["endpoints"].get(endpoint)
+        if previous is None:
+            continue
+        changes = {}
+        for metric in ("throughput", "p50_ms", "p95_ms", "p99_ms", "queries_per_request"):
+            before, after = previous[metric], metrics[metric]
+            change = (after - before) / before if before else 0.0
+            changes[metric] = {"baseline": before, "current": after, "change": round(change, 4)}
+            worse = -change if metric == "throughput" else change
+            if metric in ("throughput", "p95_ms", "queries_per_request") and worse > threshold:
+                regressions.append(f"{endpoint}.{metric}")
+        endpoints[endpoint] = changes
+    return {"threshold": threshold, "endpoints": endpoints, "regressions": regressions}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the result to this file to use it as a baseline")
+    parser.add_argument("--compare", help="baseline file written by --save")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.users, args.iterations, args.seed))
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(result, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            comparison = compare(json.load(file), result, args.threshold)
+        report("load", {"result": result, "comparison": comparison})
+        return 1 if comparison["regressions"] else 0
+
+    report("load", result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
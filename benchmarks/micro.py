@@ -0,0 +1,155 @@
+"""
+Micro-benchmarks of the CPU bound functions on the request path
+
+    python -m benchmarks.micro [--samples 20] [--min-sample-seconds 0.05] [name ...]
+
+Each function is called in a loop until a sample lasts at least --min-sample-seconds, and the per call time of
+every sample is collected. Results give the median and a bootstrap 95% confidence interval of the mean. Request
+profiles add up the functions every request of that kind runs, showing which one dominates its CPU time.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, List
+
+from jose import jwt
+from pydantic import TypeAdapter
+
+from app.core.auth_utils import create_access_token, get_hashed_password, verify_password
+from app.core.cypt_utils import encrypt_with_key, generate_key_pair, load_public_key
+from app.core.site_matcher import SiteMatcher
+from app.models.credential import Credential, CredentialRead
+from app.models.site import Site, SiteRead
+from app.models.user import User
+from benchmarks.common import report
+from config import ALGORITHM, SECRET_KEY
+
+# Functions run by each kind of request, cache hits assumed for the user and the parsed public key
+REQUEST_PROFILES = {
+    "login": ["verify_password", "create_access_token"],
+    "list_credentials_10": ["jwt_decode", "serialize_credentials_10"],
+    "list_credentials_50": ["jwt_decode", "serialize_credentials_50"],
+    "create_credential": ["jwt_decode", "encrypt_with_key"],
+    "register": ["get_hashed_password"],
+    "match_site": ["match_site_10000"],
+}
+
+
+def credential_page(size: int) -> List[Credential]:
+    public_key, _ = generate_key_pair()
+    owner = User(id=1, username="bench_user", email="bench_user@gmail.com", hashed_password="hash",
+                 public_key=public_key)
+    site = Site(id=1, name="Site_1", url="https://site1.com")
+    encrypted_password = encrypt_with_key(public_key, "password")
+    return [Credential(id=i, nickname=f"Credential{i}", email="bench_user@gmail.com", username="bench_user",
+                       encrypted_password=encrypted_password, user_id=1, site_id=1, site=site, owner=owner,
+                       created_at=datetime.utcnow()) for i in range(size)]
+
+
+def site_catalog(size: int) -> SiteMatcher:
+    matcher = SiteMatcher(max_age=float("inf"))
+    matcher.begin_rebuild()
+    matcher.finish_rebuild(SiteRead(id=i, name=f"Site_{i}", url=f"https://login.site{i}.com") for i in range(size))
+    return matcher
+
+
+def build_cases() -> dict[str, Callable[[], Any]]:
+    public_key, _ = generate_key_pair()
+    parsed_key = load_public_key(public_key)
+    token = create_access_token("bench_user", timedelta(minutes=30))
+    hashed_password = get_hashed_password("bench_password")
+
+    # Same path FastAPI takes for a List[CredentialRead] response model
+    adapter = TypeAdapter(List[CredentialRead])
+    pages = {size: credential_page(size) for size in (10, 50)}
+    matcher = site_catalog(10000)
+
+    return {
+        "create_access_token": lambda: create_access_token("bench_user", timedelta(minutes=30)),
+        "jwt_decode": lambda: jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]),
+        "get_hashed_password": lambda: get_hashed_password("bench_password"),
+        "verify_password": lambda: verify_password("bench_password", hashed_password),
+        "generate_key_pair": generate_key_pair,
+        "encrypt_with_key": lambda: encrypt_with_key(parsed_key, "password"),
+        "serialize_credentials_10": lambda: adapter.dump_json(adapter.validate_python(pages[10], from_attributes=True)),
+        "serialize_credentials_50": lambda: adapter.dump_json(adapter.validate_python(pages[50], from_attributes=True)),
+        # A sibling subdomain, which walks the whole host and falls back to the registrable domain
+        "match_site_10000": lambda: matcher.match("https://www.site9999.com/account/login?next=/"),
+    }
+
+
+def sample(function: Callable[[], Any], samples: int, min_sample_seconds: float) -> List[float]:
+    # Calibrate the loop count so timer resolution does not dominate fast functions
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_sample_seconds:
+            break
+        loops *= 2 if elapsed == 0 else max(2, int(min_sample_seconds / elapsed))
+
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        timings.append((time.perf_counter() - start) / loops)
+    return timings
+
+
+def bootstrap_interval(values: List[float], resamples: int = 2000, seed: int = 0) -> tuple[float, float]:
+    # Percentile bootstrap of the mean, makes no assumption on how timings are distributed
+    rng = random.Random(seed)
+    means = sorted(statistics.fmean(rng.choices(values, k=len(values))) for _ in range(resamples))
+    return means[int(resamples * 0.025)], means[int(resamples * 0.975) - 1]
+
+
+def summarize(timings: List[float]) -> dict[str, float]:
+    low, high = bootstrap_interval(timings)
+    return {
+        "median_us": round(statistics.median(timings) * 1e6, 2),
+        "mean_us": round(statistics.fmean(timings) * 1e6, 2),
+        "stdev_us": round(statistics.stdev(timings) * 1e6, 2),
+        "ci95_low_us": round(low * 1e6, 2),
+        "ci95_high_us": round(high * 1e6, 2),
+    }
+
+
+def profiles(results: dict[str, dict[str, float]]) -> dict[str, Any]:
+    summaries = {}
+    for request, functions in REQUEST_PROFILES.items():
+        if not all(function in results for function in functions):
+            continue
+        total = sum(results[function]["median_us"] for function in functions)
+        summaries[request] = {
+            "total_us": round(total, 2),
+            "share": {function: round(results[function]["median_us"] / total, 3) for function in functions},
+        }
+    return summaries
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", help="functions to run, all when omitted")
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--min-sample-seconds", type=float, default=0.05)
+    args = parser.parse_args()
+
+    cases = build_cases()
+    unknown = set(args.names) - set(cases)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = {name: summarize(sample(function, args.samples, args.min_sample_seconds))
+               for name, function in cases.items() if not args.names or name in args.names}
+    report("micro", {"functions": results, "requests": profiles(results)})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Latency of /dashboard/credentials/search against vault size, served from the in-memory index and with a LIKE scan
+
+    python -m benchmarks.search [--repeat 50] [vault size ...]
+
+Each size seeds a SQLite vault, times the first search that builds the index and the memory the index takes, then
+times warm searches end to end through CredentialCRUD.search, change version check included. The same queries run
+as a LIKE over the four searched columns for comparison.
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, List
+
+from sqlalchemy import func, or_, select
+
+from app.core.search_index import search_index
+from app.crud.credential import CredentialCRUD
+from app.models.credential import Credential
+from app.models.site import Site
+from benchmarks.common import report, seed_vault, session_maker, temporary_database
+
+# A single credential, one in ten thousand, every credential through a common substring, and a two letter scan
+QUERIES = ("credential4321", "user_12", "gmail", "te_3", "ia")
+
+
+def milliseconds(samples: List[float]) -> dict[str, float]:
+    samples = sorted(samples)
+    return {"p50_ms": round(statistics.median(samples) * 1000, 3),
+            "p95_ms": round(samples[int(len(samples) * 0.95) - 1] * 1000, 3)}
+
+
+async def like_search(crud: CredentialCRUD, user_id: int, query: str, limit: int) -> List[int]:
+    pattern = f"%{query.lower()}%"
+    statement = select(Credential.id).outerjoin(Site, Credential.site_id == Site.id).where(
+        Credential.user_id == user_id, or_(*[func.lower(column).like(pattern) for column in (
+            Credential.nickname, Credential.username, Credential.email, Site.name)])).limit(limit)
+    return list(await crud.db_session.scalars(statement))
+
+
+async def measure_size(size: int, repeat: int) -> dict[str, Any]:
+    async with temporary_database() as engine:
+        user_id = await seed_vault(engine, size)
+        search_index.clear()
+
+        async with session_maker(engine)() as session:
+            crud = CredentialCRUD(session)
+            start = time.perf_counter()
+            await crud.search(user_id=user_id, query="warm", limit=20)
+            build_seconds = time.perf_counter() - start
+
+            # Built a second time under tracemalloc, which slows the build down too much to time it
+            search_index.clear()
+            tracemalloc.start()
+            await crud.search(user_id=user_id, query="warm", limit=20)
+            index_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            queries = {}
+            for query in QUERIES:
+                indexed, scanned, matches = [], [], 0
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    matches = len(await crud.search(user_id=user_id, query=query, limit=20))
+                    indexed.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    await like_search(crud, user_id, query, limit=20)
+                    scanned.append(time.perf_counter() - start)
+                queries[query] = {"matches": matches, "index": milliseconds(indexed), "like": milliseconds(scanned)}
+
+        return {
+            "credentials": size,
+            "build_ms": round(build_seconds * 1000, 1),
+            "index_mb": round(index_bytes / 2 ** 20, 2),
+            "queries": queries,
+        }
+
+
+async def run(sizes: List[int], repeat: int) -> List[dict[str, Any]]:
+    return [await measure_size(size, repeat) for size in sizes]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sizes", nargs="*", type=int, default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=50, help="timed searches per query")
+    args = parser.parse_args()
+    report("search", asyncio.run(run(args.sizes, args.repeat)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+CPU spent building a credential list response, ORM objects validated into List[CredentialRead] against rows
+encoded straight to JSON, and the compact page with sideloaded sites
+
+    python -m benchmarks.serialization [--pages 200] [page size ...]
+
+The first two paths read the same page from a SQLite vault and produce the same bytes. CPU time is measured with
+process_time, so waiting on the database is left out and only the work done by the worker is counted.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from typing import Any, Awaitable, Callable, List
+
+from pydantic import TypeAdapter
+
+from app.core.cypt_utils import generate_key_pair
+from app.core.serialization import credential_rows_to_compact_json, credential_rows_to_json
+from app.crud.credential import CredentialCRUD
+from app.models.credential import CredentialRead
+from app.models.user import User
+from benchmarks.common import report, seed_vault, session_maker, temporary_database
+
+adapter = TypeAdapter(List[CredentialRead])
+
+
+async def orm_page(crud: CredentialCRUD, owner: User, size: int) -> bytes:
+    # What FastAPI does for a response_model: validate from attributes, then dump
+    credentials = await crud.read_personal_many(offset=0, limit=size, user_id=owner.id, site_id=None)
+    return adapter.dump_json(adapter.validate_python(credentials, from_attributes=True))
+
+
+async def rows_page(crud: CredentialCRUD, owner: User, size: int) -> bytes:
+    rows = await crud.read_personal_rows(offset=0, limit=size, user_id=owner.id, site_id=None)
+    return credential_rows_to_json(rows, owner=owner)
+
+
+async def compact_page(crud: CredentialCRUD, owner: User, size: int) -> bytes:
+    rows = await crud.read_personal_rows(offset=0, limit=size, user_id=owner.id, site_id=None)
+    return credential_rows_to_compact_json(rows)
+
+
+async def measure(engine, owner: User, size: int, pages: int,
+                  build: Callable[[CredentialCRUD, User, int], Awaitable[bytes]]) -> dict[str, float]:
+    cpu, wall, content = 0.0, 0.0, b""
+    for _ in range(pages):
+        # A session per page, as with a request, so the identity map never serves cached objects
+        async with session_maker(engine)() as session:
+            crud = CredentialCRUD(session)
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            content = await build(crud, owner, size)
+            cpu += time.process_time() - cpu_start
+            wall += time.perf_counter() - wall_start
+    return {"cpu_us_per_page": round(cpu / pages * 1e6, 1), "wall_us_per_page": round(wall / pages * 1e6, 1),
+            "bytes_per_page": len(content)}
+
+
+async def run(sizes: List[int], pages: int) -> List[dict[str, Any]]:
+    results = []
+    async with temporary_database() as engine:
+        # A real PEM key, its size is what the full representation repeats in every item
+        user_id = await seed_vault(engine, max(sizes), public_key=generate_key_pair()[0])
+        async with session_maker(engine)() as session:
+            owner = await session.get(User, user_id)
+
+        for size in sizes:
+            async with session_maker(engine)() as session:
+                crud = CredentialCRUD(session)
+                assert await orm_page(crud, owner, size) == await rows_page(crud, owner, size)
+
+            # Warm up both paths before measuring
+            await measure(engine, owner, size, 5, orm_page)
+            await measure(engine, owner, size, 5, rows_page)
+            await measure(engine, owner, size, 5, compact_page)
+            orm = await measure(engine, owner, size, pages, orm_page)
+            rows = await measure(engine, owner, size, pages, rows_page)
+            compact = await measure(engine, owner, size, pages, compact_page)
+            results.append({
+                "page_size": size,
+                "orm_validated": orm,
+                "rows_orjson": rows,
+                "compact": compact,
+                "cpu_saved_us_per_page": round(orm["cpu_us_per_page"] - rows["cpu_us_per_page"], 1),
+                "speedup": round(orm["cpu_us_per_page"] / rows["cpu_us_per_page"], 2),
+                "compact_bytes_saved": rows["bytes_per_page"] - compact["bytes_per_page"],
+            })
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sizes", nargs="*", type=int, default=[10, 50])
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+    report("serialization", asyncio.run(run(args.sizes, args.pages)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Worker startup cost, import time of the application and time to get the database ready on boot
+
+    python -m benchmarks.startup [--runs 5]
+
+Imports are timed in fresh interpreters, together with the crypto libraries the application loads on first use.
+Boots are timed against a SQLite file: the first boot creating the schema, later boots checking its version,
+and the create_all call every boot used to run for comparison.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import event
+from sqlmodel import SQLModel
+
+import config
+from app.database import PasswordDB
+from benchmarks.common import report
+
+IMPORT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+import cryptography.hazmat.primitives.asymmetric.rsa, jose.jwt, passlib.context
+print(json.dumps({"import": imported - start, "lazy_crypto": time.perf_counter() - imported}))
+"""
+
+
+def measure_imports(runs: int) -> dict[str, float]:
+    samples = [json.loads(subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], check=True, capture_output=True,
+                                         text=True).stdout) for _ in range(runs)]
+    return {
+        "app_import_ms": round(statistics.median(s["import"] for s in samples) * 1000, 1),
+        "lazy_crypto_import_ms": round(statistics.median(s["lazy_crypto"] for s in samples) * 1000, 1),
+    }
+
+
+async def measure_boot(boot: Callable[[Any], Awaitable[None]]) -> tuple[float, int]:
+    # Engine creation is included, every worker builds its own
+    start = time.perf_counter()
+    db = PasswordDB()
+    statements = []
+    event.listen(db.engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(1))
+    await boot(db)
+    elapsed = time.perf_counter() - start
+    await db.close()
+    return elapsed, len(statements)
+
+
+async def create_all(db: Any) -> None:
+    async with db.engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+
+async def measure_boots(runs: int) -> dict[str, Any]:
+    import app.main  # noqa  # Registers every model in the metadata
+
+    directory = tempfile.mkdtemp(prefix="pyvault-bench-")
+    path = os.path.join(directory, "bench.db")
+    config.DB_URL, config.TESTING = f"sqlite+aiosqlite:///{path}", False
+    try:
+        first, first_statements = await measure_boot(lambda db: db.initiate_db())
+        checks = [await measure_boot(lambda db: db.initiate_db()) for _ in range(runs)]
+        legacy = [await measure_boot(create_all) for _ in range(runs)]
+    finally:
+        os.remove(path)
+        os.rmdir(directory)
+
+    return {
+        "first_boot": {"ms": round(first * 1000, 2), "statements": first_statements},
+        "version_check": {"ms": round(statistics.median(t for t, _ in checks) * 1000, 2), "statements": checks[0][1]},
+        "create_all": {"ms": round(statistics.median(t for t, _ in legacy) * 1000, 2), "statements": legacy[0][1]},
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    report("startup", {"imports": measure_imports(args.runs), "boot": asyncio.run(measure_boots(args.runs))})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
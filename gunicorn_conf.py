@@ -1,13 +1,57 @@
 # gunicorn_conf.py
+import os
+import shutil
+import tempfile
 
-bind = "127.0.0.1:4545"
+# PYVAULT_PROFILE=production selects the production profile, anything else keeps the development one
+PROFILE = os.environ.setdefault("PYVAULT_PROFILE", "development")
+PRODUCTION = PROFILE == "production"
+
+
+def available_cores():
+    # Honors CPU affinity and container cpusets, unlike os.cpu_count()
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = os.environ.get("BIND", "0.0.0.0:4545" if PRODUCTION else "127.0.0.1:4545")
 
 # Worker Options
-# workers = cpu_count() + 1
-workers = 1
+# Async workers handle many connections each, one per core keeps every core busy without oversubscribing
+workers = int(os.environ.get("WEB_CONCURRENCY", available_cores() if PRODUCTION else 1))
+# Uvicorn picks uvloop and httptools when they are installed and falls back to asyncio and h11
 worker_class = 'uvicorn.workers.UvicornWorker'
+# Workers fork from a master that already imported the application
+preload_app = PRODUCTION
+# Warm-up runs before a worker accepts connections, give it time on cold starts
+timeout = 60 if PRODUCTION else 30
+graceful_timeout = 30
+keepalive = 5
 
 # Logging Options
-loglevel = 'debug'
-accesslog = './access_log'
-errorlog = './error_log'
+if PRODUCTION:
+    # Access logs are written synchronously on the event loop, enable them through ACCESS_LOG when needed
+    loglevel = 'info'
+    accesslog = os.environ.get("ACCESS_LOG")
+    errorlog = '-'
+else:
+    loglevel = 'debug'
+    accesslog = './access_log'
+    errorlog = './error_log'
+
+# Metrics Options
+# Every worker writes its samples here so /metrics reports the totals of all workers
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "pyvault-metrics"))
+
+
+def on_starting(server):
+    # Samples left by a previous run would be added to the new totals
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)